@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Check access to many DRS URIs through gen3 and google storage, concurrently.
+
+Reads one DRS URI per line from a file (or stdin) and writes one JSON record per URI
+(see test.drs.check_drs_access) as each check completes, including the DNS, connect,
+TLS, time-to-first-byte and total time of both the gen3 and the google storage hop:
+
+    BDCAT_STAGE=staging python scripts/check_drs_access.py uris.txt --workers 32 > results.jsonl
+
+With --checksums, the workers also download every accessible object and compare its checksums
+with those recorded in indexd (see test.drs.check_drs_access_and_checksums).
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+from test.bq import log_drs_hop_timings
+from test.drs import check_drs_access_many
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Check access to many DRS URIs through gen3.')
+    parser.add_argument("uris", nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+                        help='File with one DRS URI per line.  Defaults to stdin.')
+    parser.add_argument("--workers", type=int, default=16, help='Number of URIs to check concurrently.')
+    parser.add_argument("--output", type=argparse.FileType('w'), default=sys.stdout,
+                        help='Where to write the JSONL results.  Defaults to stdout.')
+    parser.add_argument("--bigquery", action='store_true',
+                        help='Also log each record to the drs_hop_latency_{BDCAT_STAGE} BigQuery table.')
+    parser.add_argument("--checksums", action='store_true',
+                        help='Also download each accessible object and verify its checksums against indexd.')
+    args = parser.parse_args(argv)
+
+    counts = collections.Counter()
+    for record in check_drs_access_many(args.uris, workers=args.workers, checksums=args.checksums):
+        counts[record['status']] += 1
+        args.output.write(json.dumps(record) + '\n')
+        args.output.flush()
+        if args.bigquery:
+            log_drs_hop_timings(record)
+
+    print(f'Checked {sum(counts.values())} DRS URIs: {dict(counts)}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
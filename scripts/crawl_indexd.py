@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Crawl every record of the current stage's indexd into a JSONL file (see test.indexd.crawl).
+
+An interrupted crawl resumes where it stopped when run again with the same file:
+
+    BDCAT_STAGE=staging python scripts/crawl_indexd.py records.jsonl --workers 8
+
+The crawl is what test_import_drs_from_gen3 picks restricted DRS URIs from, given
+BDCAT_INDEXD_RECORDS=records.jsonl.  --select prints some URIs of an ACL category instead.
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import sys
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+from test.indexd import CATEGORIES, PAGE_LIMIT, acl_category, crawl, read_records, select_drs_uris
+from test.utils import GEN3_DOMAIN
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Crawl the records of indexd into a JSONL file.')
+    parser.add_argument("path", help='The JSONL file to write, or to resume writing.')
+    parser.add_argument("--workers", type=int, default=8, help='Pages to request at once.')
+    parser.add_argument("--limit", type=int, default=PAGE_LIMIT, help='Records per page.')
+    parser.add_argument("--params", type=json.loads, default=None,
+                        help='Further query parameters of /index/index, as JSON, e.g. \'{"acl": "phs000007"}\'.')
+    parser.add_argument("--restart", action='store_true', help='Crawl from the first page, ignoring any checkpoint.')
+    parser.add_argument("--select", choices=CATEGORIES,
+                        help='After crawling, print random DRS URIs of this ACL category.')
+    parser.add_argument("--count", type=int, default=5, help='How many URIs to --select.')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+    crawl(args.path, GEN3_DOMAIN, limit=args.limit, workers=args.workers, params=args.params, restart=args.restart)
+    if args.select:
+        for uri in select_drs_uris(args.path, args.select, count=args.count):
+            print(uri)
+    else:
+        counts = collections.Counter(acl_category(record) for record in read_records(args.path))
+        print(f'Records by ACL category: {dict(counts)}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Report latency trends for recorded test durations and fail on regressions.
+
+Prints rolling p50/p95/p99 per window for every series (by default: the md5sum workflow and
+per-test durations, for each stage) and exits non-zero if the latest window of any of them is
+significantly slower than the windows before it, or if any of them can't be read, e.g. because
+its table doesn't exist.  --drs-hops adds the DRS hops recorded by check_drs_access.py --bigquery:
+
+    python scripts/latency_trends.py --stage staging --stage prod
+    python scripts/latency_trends.py --stage prod --drs-hops
+    python scripts/latency_trends.py --series platform-dev-178517.bdc.terra_md5_latency_min_prod:d --json
+
+Reads from the backend selected by BDCAT_METRICS_BACKEND, see test/metrics.py.
+"""
+import argparse
+import json
+import os
+import sys
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+from test.bq import get_client
+from test.trends import Series, analyze, default_series, drs_hop_series
+
+
+def print_report(report):
+    name = f"{report['table_id']}:{report['column']}" + (f" [{report['group']}]" if report['group'] else '')
+    verdict = 'REGRESSION' if report['regression'] else 'ok'
+    if 'p_value' in report:
+        verdict += f" (median x{report['median_ratio']:.2f}, p={report['p_value']:.4f})"
+    else:
+        verdict += ' (not enough samples to compare)'
+    print(f'{name}: {verdict}')
+    for start, summary in report['windows'].items():
+        print(f"    {start}  n={summary['n']:<4} p50={summary['p50']:.3f}  "
+              f"p95={summary['p95']:.3f}  p99={summary['p99']:.3f}")
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Detect latency regressions in recorded test durations.')
+    parser.add_argument("--stage", action='append', choices=['prod', 'staging'],
+                        help='Analyze the default series of these stages.  Defaults to both.')
+    parser.add_argument("--series", action='append', type=Series.parse, metavar='TABLE:COLUMN[:GROUP_BY]',
+                        help='Analyze these series instead of the defaults.')
+    parser.add_argument("--drs-hops", action='store_true',
+                        help='Also analyze the DRS hop timings of the stages, see scripts/check_drs_access.py.')
+    parser.add_argument("--window-days", type=int, default=7)
+    parser.add_argument("--baseline-windows", type=int, default=4,
+                        help='Number of windows before the latest one to compare it against.')
+    parser.add_argument("--alpha", type=float, default=0.01, help='Significance level.')
+    parser.add_argument("--min-ratio", type=float, default=1.1,
+                        help='Only flag slowdowns of at least this factor in the median.')
+    parser.add_argument("--json", action='store_true', help='Print the reports as JSON lines.')
+    args = parser.parse_args(argv)
+
+    stages = args.stage or ['prod', 'staging']
+    series = args.series or [s for stage in stages for s in default_series(stage)]
+    if args.drs_hops:
+        series += [s for stage in stages for s in drs_hop_series(stage)]
+    backend = get_client()
+    regressions = unreadable = 0
+    for s in series:
+        try:
+            reports = analyze(backend, s,
+                              window_days=args.window_days,
+                              baseline_windows=args.baseline_windows,
+                              alpha=args.alpha,
+                              min_ratio=args.min_ratio)
+        except Exception as e:
+            # A series that can't be read can't be vouched for, so don't let it pass silently
+            print(f'Could not read {s.table_id}:{s.column}: {e}', file=sys.stderr)
+            unreadable += 1
+            continue
+        for report in reports:
+            regressions += report['regression']
+            if args.json:
+                print(json.dumps(report))
+            else:
+                print_report(report)
+
+    if regressions:
+        print(f'Found {regressions} latency regression(s).', file=sys.stderr)
+    if unreadable:
+        print(f'Could not read {unreadable} series.', file=sys.stderr)
+    if regressions or unreadable:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Load test the Gen3 -> Terra PFB handoff: create N workspaces, import M PFBs into each
+concurrently, and report throughput and how long the jobs spent in each import state.
+
+    python scripts/pfb_load_test.py --workspaces 5 --pfbs 4 --output pfb_load.json
+
+This is the lifecycle of test_pfb_handoff_from_gen3_to_terra, fanned out on one event loop
+(see test/async_utils.py).  Every workspace the run set out to create is deleted again, also when
+the run fails, is interrupted with Ctrl-C or is terminated (e.g. by the CI job timeout).  A second
+interruption during that cleanup cuts it short, which can leave workspaces behind.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import signal
+import sys
+import time
+import uuid
+from typing import Dict, List
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+from test.async_utils import PFB_IN_PROGRESS, AsyncClient
+from test.infra.poll import Poller
+from test.trends import summarize
+
+STATIC_PFB = 'https://cdistest-public-test-bucket.s3.amazonaws.com/export_2020-06-02T17_33_36.avro'
+
+
+async def run_import(client: AsyncClient, workspace: str, pfb: str, args, limit: asyncio.Semaphore) -> dict:
+    """Import one PFB and wait for it; never raises, except when cancelled."""
+    record = dict(workspace=workspace, pfb=pfb, status=None, error=None, dwell_times={})
+    async with limit:
+        start = time.monotonic()
+        poller = Poller(timeout=args.timeout, initial=args.poll_initial, maximum=args.poll_maximum)
+        try:
+            job_id = (await client.import_pfb(workspace, pfb))['jobId']
+            record['job_id'] = job_id
+            response = await client.wait_for_pfb_import(workspace, job_id, poller)
+            record['status'] = response['status']
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            record['status'] = 'TimedOut' if isinstance(e, TimeoutError) else 'Failed'
+            record['error'] = f'{type(e).__name__}: {e}'
+        record['seconds'] = time.monotonic() - start
+        record['dwell_times'] = poller.dwell_times
+    print(f"{workspace} {record.get('job_id', '-')}: {record['status']} after {record['seconds']:.1f}s", file=sys.stderr)
+    return record
+
+
+def report(records: List[dict], wall_seconds: float) -> dict:
+    done = [r for r in records if r['status'] == 'Done']
+    states: Dict[str, List[float]] = {}
+    for record in records:
+        for state, seconds in record['dwell_times'].items():
+            states.setdefault(state, []).append(seconds)
+    return dict(jobs=len(records),
+                done=len(done),
+                failed=len(records) - len(done),
+                wall_seconds=wall_seconds,
+                imports_per_minute=len(done) / wall_seconds * 60 if wall_seconds else 0.0,
+                total_seconds=summarize([r['seconds'] for r in done]) if done else None,
+                state_seconds={state: summarize(seconds) for state, seconds in states.items()})
+
+
+async def load_test(args) -> dict:
+    run_id = datetime.datetime.now().strftime('%Y_%m_%d_%H%M%S')
+    workspaces = [f'integration_test_pfb_load_{run_id}_{uuid.uuid4().hex[:8]}_delete_me'
+                  for _ in range(args.workspaces)]
+    limit = asyncio.Semaphore(args.concurrency)
+    start = time.monotonic()
+
+    async with AsyncClient(pool_size=args.concurrency) as client:
+        try:
+            # Let every creation finish, so that none is still in flight during the teardown
+            errors = [e for e in await asyncio.gather(*[client.create_terra_workspace(workspace)
+                                                        for workspace in workspaces],
+                                                      return_exceptions=True) if isinstance(e, BaseException)]
+            if errors:
+                raise errors[0]
+            pfbs = [args.pfb[i % len(args.pfb)] for i in range(args.pfbs)]
+            records = await asyncio.gather(*[run_import(client, workspace, pfb, args, limit)
+                                             for workspace in workspaces for pfb in pfbs])
+            return dict(t=str(datetime.datetime.now()),
+                        config=dict(workspaces=args.workspaces, pfbs=args.pfbs, concurrency=args.concurrency,
+                                    in_progress_states=list(PFB_IN_PROGRESS)),
+                        summary=report(records, time.monotonic() - start),
+                        jobs=records)
+        finally:
+            # All of them, since a creation that failed or was interrupted may have gone through
+            # anyway.  Awaited directly, not shielded: a shielded teardown would keep running after
+            # a second cancellation, while the session it uses is being closed.
+            await teardown(client, workspaces)
+
+
+async def teardown(client: AsyncClient, workspaces: List[str]):
+    """Delete the workspaces; a 404 means one was never created or is gone already."""
+    results = await asyncio.gather(*[client.delete_terra_workspace(workspace) for workspace in workspaces],
+                                   return_exceptions=True)
+    for workspace, result in zip(workspaces, results):
+        if isinstance(result, BaseException) or result not in (202, 404):
+            print(f'Could not delete the workspace "{workspace}": {result!r}', file=sys.stderr)
+    print(f'Deleted {results.count(202)} workspaces.', file=sys.stderr)
+
+
+async def main_async(args) -> dict:
+    # Turn SIGTERM into a cancellation, which runs the teardown like Ctrl-C does
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, task.cancel)
+    except NotImplementedError:
+        pass
+    return await load_test(args)
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Load test PFB imports from Gen3 into Terra workspaces.')
+    parser.add_argument("--workspaces", type=int, default=2, help='Number of workspaces to create.')
+    parser.add_argument("--pfbs", type=int, default=2, help='Number of PFBs to import into each workspace.')
+    parser.add_argument("--pfb", action='append',
+                        help='URL of a PFB to import; repeat to cycle through several.  '
+                             'Defaults to the static PFB of test_pfb_handoff_from_gen3_to_terra.')
+    parser.add_argument("--concurrency", type=int, default=20, help='Maximum imports in flight at once.')
+    parser.add_argument("--timeout", type=float, default=30 * 60, help='Seconds to wait for each import.')
+    parser.add_argument("--poll-initial", type=float, default=1.0)
+    parser.add_argument("--poll-maximum", type=float, default=10.0)
+    parser.add_argument("--output", type=argparse.FileType('w'), default=sys.stdout)
+    args = parser.parse_args(argv)
+    args.pfb = args.pfb or [STATIC_PFB]
+
+    try:
+        result = asyncio.run(main_async(args))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print('Interrupted.', file=sys.stderr)
+        sys.exit(130)
+
+    json.dump(result, args.output, indent=2)
+    args.output.write('\n')
+    summary = result['summary']
+    print(f"{summary['done']}/{summary['jobs']} imports done in {summary['wall_seconds']:.0f}s "
+          f"({summary['imports_per_minute']:.1f}/min)", file=sys.stderr)
+    for state, seconds in summary['state_seconds'].items():
+        print(f"    {state:<15} p50={seconds['p50']:.1f}s  p95={seconds['p95']:.1f}s  p99={seconds['p99']:.1f}s",
+              file=sys.stderr)
+    sys.exit(0 if summary['failed'] == 0 else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,58 +6,120 @@ Each gitlab repo seems to only be allowed one slack integration (although you ca
 a comma-separated list to designate multiple channels in one slack account so
 long as the hook has permissions for each).
 
+Run from a job's after_script, posts the job's status (CI_JOB_STATUS); the job's own pipeline
+is still running at that point, so there is nothing to wait for.  Given --pipeline, waits for
+any number of pipelines from one process and posts each one's status as it finishes:
+
+    python scripts/post_to_slack.py --pipeline 1234 --pipeline 1235 --listen 8099
+
+With --listen, pipeline webhooks (see test/infra/gitlab.py) end the wait, and the GitLab API
+is only polled as a fallback.  --listen alone runs a notifier that posts for every pipeline
+that a webhook reports as finished, until interrupted.  Webhooks must carry the secret token in
+GITLAB_WEBHOOK_SECRET, and are only accepted from this host unless --listen-host says otherwise.
+
 TODO: This solution can be removed if multiple slack notifications are ever supported
  natively in the gitlab integrations GUI.
 """
+import asyncio
 import requests
 import os
 import sys
 import argparse
 import json
 
-from multiprocessing import Process
-
 pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))  # noqa
 sys.path.insert(0, pkg_root)  # noqa
 
-from scripts.run_integration_tests import wait_for_final_status, DEFAULT_BRANCH, DEFAULT_HOST, DEFAULT_PROJECT_NUM
+from scripts.run_integration_tests import PRIVATE_TOKEN, WEBHOOK_SECRET, DEFAULT_BRANCH, DEFAULT_HOST, DEFAULT_PROJECT_NUM
+from test.infra import gitlab
+from test.infra.aio import client_session
 
 # set to dockstore's "dockstore-testing" slack channel on Gitlab
 SLACK_WEBHOOK = os.environ['SLACK_WEBHOOK']
+SLACK_NOTIFICATION_URL = 'https://hooks.slack.com/services/' + SLACK_WEBHOOK
 
 # https://docs.gitlab.com/ee/ci/variables/predefined_variables.html
-GITLAB_USER_NAME = os.environ['GITLAB_USER_NAME']
-CI_JOB_URL = os.environ['CI_JOB_URL']
-CI_PIPELINE_URL = os.environ['CI_PIPELINE_URL']
+GITLAB_USER_NAME = os.environ.get('GITLAB_USER_NAME')
+CI_JOB_URL = os.environ.get('CI_JOB_URL')
+CI_JOB_STATUS = os.environ.get('CI_JOB_STATUS')
 
 
-def post_notification(host, project):
-    slack_notification_url = 'https://hooks.slack.com/services/' + SLACK_WEBHOOK
+def notification(user, url, status) -> dict:
+    return {
+        'text': f'{user} triggered: <{url}>\n'
+                f'Status is: {status}'
+    }
+
+
+def post_notification(data: dict):
     headers = {
         'Content-type': 'application/json'
     }
-    status = wait_for_final_status(pipeline=CI_PIPELINE_URL.split('/')[-1],
-                                   host=host,
-                                   project=project,
-                                   quiet=True)
-    data = {
-        'text': f'{GITLAB_USER_NAME} triggered: <{CI_JOB_URL}>\n'
-                f'Status is: {status}'
-    }
-    response = requests.post(slack_notification_url, data=json.dumps(data), headers=headers)
+    response = requests.post(SLACK_NOTIFICATION_URL, data=json.dumps(data), headers=headers)
     response.raise_for_status()
 
 
+def post_webhook_notification(event: dict):
+    """Post the status of a pipeline that a webhook reported as finished."""
+    pipeline = event['object_attributes']
+    url = f"{event['project']['web_url']}/-/pipelines/{pipeline['id']}"
+    post_notification(notification(event.get('user', {}).get('name'), url, pipeline['status']))
+
+
+async def watch_and_notify(pipelines, listener=None):
+    """Wait for every pipeline at once, posting each one's status as it finishes."""
+    async with client_session() as session:
+        async def on_done(pipeline, details):
+            # Who started the pipeline, and its page rather than its API URL
+            data = notification(details.get('user', {}).get('name'), details['web_url'], details['status'])
+            async with session.post(SLACK_NOTIFICATION_URL, json=data) as resp:
+                resp.raise_for_status()
+
+        return await gitlab.watch_pipelines(pipelines, PRIVATE_TOKEN, on_done, listener=listener)
+
+
 def main(argv=sys.argv[1:]):
     parser = argparse.ArgumentParser(description='Post integration testing status to slack.')
     parser.add_argument("--project", type=int, default=DEFAULT_PROJECT_NUM)
     parser.add_argument("--branch", default=DEFAULT_BRANCH)
     parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--pipeline", action='append', default=[],
+                        help='A pipeline to wait for; may be repeated.')
+    parser.add_argument("--listen", type=int, metavar='PORT',
+                        help='Receive pipeline webhooks on this port, polling only as a fallback.  '
+                             'Needs GITLAB_WEBHOOK_SECRET.')
+    parser.add_argument("--listen-host", default='127.0.0.1',
+                        help='Address to receive webhooks on, e.g. 0.0.0.0 for any host.  Defaults to this host only.')
     args = parser.parse_args(argv)
+    if args.listen is not None and not WEBHOOK_SECRET:
+        parser.error('--listen needs the webhook\'s secret token in GITLAB_WEBHOOK_SECRET')
+
+    if not args.pipeline and args.listen is None:
+        post_notification(notification(GITLAB_USER_NAME, CI_JOB_URL, CI_JOB_STATUS))
+        return
+
+    if not args.pipeline:
+        listener = gitlab.PipelineListener(port=args.listen, host=args.listen_host, secret=WEBHOOK_SECRET,
+                                           on_final=post_webhook_notification)
+        try:
+            listener.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.server_close()
+        return
 
-    t = Process(name='post-2-slack', target=post_notification, kwargs={'host': args.host, 'project': args.project})
-    t.daemon = True
-    t.start()
+    pipelines = [(args.host, args.project, pipeline) for pipeline in args.pipeline]
+    listener = None
+    if args.listen is not None:
+        listener = gitlab.PipelineListener(port=args.listen, host=args.listen_host, secret=WEBHOOK_SECRET).start()
+    try:
+        statuses = asyncio.run(watch_and_notify(pipelines, listener=listener))
+    finally:
+        if listener is not None:
+            listener.close()
+    for (_, _, pipeline), status in statuses.items():
+        print(f'Pipeline {pipeline}: {status}')
 
 
 if __name__ == '__main__':
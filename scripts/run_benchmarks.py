@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Benchmark the harness's own overhead against the local stand-in server (see test/infra/standin.py).
+
+Measures requests/sec through the endpoint helpers in test/utils.py, the cost of the retry
+decorator, of token acquisition, the wake-up latency of the Poller and the cost of SaveResult
+bookkeeping, and writes the results as JSON so that runs can be compared:
+
+    python scripts/run_benchmarks.py --output before.json
+    python scripts/run_benchmarks.py --output after.json --compare before.json
+
+Everything runs with BDCAT_STAGE=local, so no credentials or network are needed.
+"""
+import argparse
+import base64
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+from test.trends import percentile
+
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], dict]] = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def stats(seconds: List[float]) -> dict:
+    """Per-call latency percentiles in milliseconds, and calls per second."""
+    total = sum(seconds)
+    return dict(n=len(seconds),
+                p50_ms=percentile(seconds, 50) * 1000,
+                p95_ms=percentile(seconds, 95) * 1000,
+                p99_ms=percentile(seconds, 99) * 1000,
+                per_second=len(seconds) / total if total else float('inf'))
+
+
+def time_calls(func: Callable[[], object], n: int) -> List[float]:
+    seconds = []
+    for _ in range(n):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def time_concurrently(func: Callable[[], object], n: int, workers: int) -> dict:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        seconds = list(executor.map(lambda _: time_calls(func, 1)[0], range(n)))
+    wall = time.perf_counter() - start
+    return dict(stats(seconds), workers=workers, per_second=n / wall)
+
+
+@benchmark
+def helpers(args) -> dict:
+    """Round trips through the endpoint helpers, one at a time and from ``--workers`` threads."""
+    from test import utils
+
+    workspace = f'benchmark_{random.randint(0, 10 ** 9)}_delete_me'
+    utils.create_terra_workspace(workspace)
+    try:
+        job_id = utils.import_pfb(workspace, 'gs://benchmark/test.avro')['jobId']
+        submission_id = utils.run_workflow()['submissionId']
+        calls = {
+            'check_terra_health': utils.check_terra_health,
+            'check_workflow_status': lambda: utils.check_workflow_status(submission_id),
+            'pfb_job_status_in_terra': lambda: utils.pfb_job_status_in_terra(workspace, job_id),
+            'import_drs_from_gen3': lambda: utils.import_drs_from_gen3('drs://dg.712C/fa640b0e-9779-452f-99a6-16d833d15bd0'),
+        }
+        results = {}
+        for name, call in calls.items():
+            call()  # warm up the connection pool
+            results[name] = dict(serial=stats(time_calls(call, args.n)),
+                                 concurrent=time_concurrently(call, args.n, args.workers))
+        return results
+    finally:
+        utils.delete_terra_workspace(workspace)
+
+
+@benchmark
+def retry_overhead(args) -> dict:
+    """What the retry decorator adds to a call that succeeds, and to one that fails once."""
+    # test.utils re-exports it, but importing it from there needs terra_notebook_utils
+    from test.infra.retry import retry
+
+    # Don't measure (or print) a warning per retry
+    logging.getLogger('test.infra.retry').setLevel(logging.ERROR)
+
+    def noop():
+        pass
+
+    wrapped = retry()(noop)
+    n = args.n * 100
+    plain, decorated = stats(time_calls(noop, n)), stats(time_calls(wrapped, n))
+
+    def fails_once():
+        state = {'calls': 0}
+
+        @retry(intervals=[0])
+        def flaky():
+            state['calls'] += 1
+            if state['calls'] == 1:
+                raise ValueError()
+
+        flaky()
+
+    return dict(plain=plain,
+                decorated=decorated,
+                overhead_us=(decorated['p50_ms'] - plain['p50_ms']) * 1000,
+                one_retry=stats(time_calls(fails_once, args.n)))
+
+
+@benchmark
+def tokens(args) -> dict:
+    """A cached Terra token, and Gen3 API key to access token exchanges against the stand-in."""
+    import jwt
+    from test import utils
+    from test.infra.auth import Gen3Credentials
+
+    api_key = jwt.encode({'iss': f'{utils.GEN3_DOMAIN}/user'}, 'benchmark')
+    api_key = api_key.decode('utf-8') if isinstance(api_key, bytes) else api_key
+    credentials = Gen3Credentials(base64.encodebytes(api_key.encode('utf-8')).decode('utf-8'))
+    credentials.access_token()
+
+    def mint():
+        credentials.invalidate()
+        credentials.access_token()
+
+    return dict(terra_cached=stats(time_calls(utils.terra_token.headers, args.n * 100)),
+                gen3_cached=stats(time_calls(credentials.headers, args.n * 100)),
+                gen3_exchange=stats(time_calls(mint, args.n)))
+
+
+@benchmark
+def poller_wakeup(args) -> dict:
+    """How long after a terminal state is reached the Poller notices it."""
+    from test.infra.poll import Poller
+
+    lateness, polls = [], []
+    for _ in range(args.n // 5 or 1):
+        done_at = time.monotonic() + random.uniform(0, 0.5)
+        poller = Poller(timeout=10, initial=0.01, maximum=0.2)
+        poller.wait(lambda: time.monotonic() >= done_at, done=bool)
+        lateness.append(time.monotonic() - done_at)
+        polls.append(poller.polls)
+    return dict(lateness=stats(lateness), mean_polls=sum(polls) / len(polls))
+
+
+@benchmark
+def save_result(args) -> dict:
+    """SaveResult's per-test bookkeeping, from one thread and from ``--workers`` threads."""
+    from test.test_basic_submission import SaveResult
+
+    class Case(unittest.TestCase):
+        def runTest(self):
+            pass
+
+    def record(result):
+        test = Case()
+        result.startTest(test)
+        result.addSuccess(test)
+        result.stopTest(test)
+
+    result = SaveResult(io.StringIO(), descriptions=False, verbosity=0)
+    serial = stats(time_calls(lambda: record(result), args.n * 10))
+    result = SaveResult(io.StringIO(), descriptions=False, verbosity=0)
+    concurrent = time_concurrently(lambda: record(result), args.n * 10, args.workers)
+    assert len(result.tests_run) == args.n * 10
+    return dict(serial=serial, concurrent=concurrent)
+
+
+def compare(results: dict, baseline: dict, path=()):
+    """Print the ratio of every p50 and throughput figure to the same figure in a baseline."""
+    for key, value in results.items():
+        if isinstance(value, dict):
+            if isinstance(baseline.get(key), dict):
+                compare(value, baseline[key], path + (key,))
+        elif key in ('p50_ms', 'per_second') and baseline.get(key):
+            print(f"{'.'.join(path + (key,))}: {baseline[key]:.4g} -> {value:.4g} (x{value / baseline[key]:.2f})",
+                  file=sys.stderr)
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Benchmark the harness against a local stand-in server.')
+    parser.add_argument("--benchmark", action='append', choices=sorted(BENCHMARKS),
+                        help='Run only these benchmarks.  Defaults to all of them.')
+    parser.add_argument("-n", type=int, default=200, help='Calls per measurement.')
+    parser.add_argument("--workers", type=int, default=8, help='Threads for the concurrent measurements.')
+    parser.add_argument("--latency", type=float, default=0.0, help='Seconds the stand-in adds to every response.')
+    parser.add_argument("--output", type=argparse.FileType('w'), default=sys.stdout)
+    parser.add_argument("--compare", type=argparse.FileType('r'), help='A previous output to compare against.')
+    args = parser.parse_args(argv)
+
+    # Must be set before test.utils is first imported
+    os.environ['BDCAT_STAGE'] = 'local'
+    os.environ['BDCAT_STANDIN_LATENCY'] = str(args.latency)
+    os.environ['BDCAT_STANDIN_ERROR_RATE'] = '0'
+
+    report = dict(t=str(datetime.datetime.now()),
+                  python=platform.python_version(),
+                  machine=platform.machine(),
+                  cpus=os.cpu_count(),
+                  config=dict(n=args.n, workers=args.workers, latency=args.latency),
+                  results={})
+    for name in args.benchmark or BENCHMARKS:
+        print(f'Running {name}...', file=sys.stderr)
+        report['results'][name] = BENCHMARKS[name](args)
+
+    json.dump(report, args.output, indent=2)
+    args.output.write('\n')
+    if args.compare:
+        compare(report['results'], json.load(args.compare)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,69 +1,200 @@
 #!/usr/bin/env python3
-import requests
+"""
+Trigger the integration tests on GitLab and wait for them to finish.
+
+Given several --branch, --project or --stage options, triggers a pipeline for every combination
+at once, e.g. to validate staging and prod together before a release, and exits non-zero
+unless all of them succeed:
+
+    python scripts/run_integration_tests.py --stage staging --stage prod
+
+A pipeline's branch decides which stage its jobs test (see the "except" lists in .gitlab-ci.yml),
+so --stage picks the branch: master for staging and prod for prod.  A --branch whose pipelines
+don't run a stage's jobs is refused for that stage.
+"""
+import collections
+import itertools
 import time
 import os
 import sys
 import argparse
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))  # noqa
 sys.path.insert(0, pkg_root)  # noqa
 
-from test.utils import retry
+from test.infra import gitlab
+from test.infra.concurrency import bounded_imap
+from test.infra.sessions import configure
 
 PRIVATE_TOKEN = os.environ['GITLAB_READ_TOKEN']
 TOKEN = os.environ['GITLAB_TRIGGER_TOKEN']
+# The secret token of the project's pipeline webhook, see --listen
+WEBHOOK_SECRET = os.environ.get('GITLAB_WEBHOOK_SECRET')
 DEFAULT_HOST = 'https://biodata-integration-tests.net'
 DEFAULT_BRANCH = 'master'
 DEFAULT_PROJECT_NUM = 3
 
+# The branch to run each stage's jobs on, and the branches that don't run them, as in .gitlab-ci.yml
+STAGE_BRANCHES = {'staging': DEFAULT_BRANCH, 'prod': 'prod'}
+STAGE_EXCEPT = {'staging': {'prod'}, 'prod': {'master', 'staging'}}
+
 
-@retry(error_codes={500, 502, 503, 504}, errors={requests.exceptions.HTTPError, ConnectionError})
 def get_status(pipeline, host=DEFAULT_HOST, project=DEFAULT_PROJECT_NUM):
-    job_status_url = f'{host}/api/v4/projects/{project}/pipelines/{pipeline}'
-    response = requests.get(job_status_url, headers={'PRIVATE-TOKEN': PRIVATE_TOKEN})
-    response.raise_for_status()
-    return response.json()['status']
+    return gitlab.get_status(host, project, pipeline, PRIVATE_TOKEN)
 
 
-def wait_for_final_status(pipeline, host=DEFAULT_HOST, project=DEFAULT_PROJECT_NUM, quiet=False):
-    status = 'pending'
-    while status in ('pending', 'running'):
-        time.sleep(10)
-        status = get_status(pipeline=pipeline, host=host, project=project)
+def wait_for_final_status(pipeline, host=DEFAULT_HOST, project=DEFAULT_PROJECT_NUM, quiet=False, listener=None):
+    def report(status, wait):
         if not quiet:
             print(f'Status is: {status}')
-            print('Checking status again in 10 seconds.')
-    return status
-
-
-def main(argv=sys.argv[1:]):
-    parser = argparse.ArgumentParser(description='Gitlab Test Trigger')
-    parser.add_argument("--project", type=int, default=DEFAULT_PROJECT_NUM)
-    parser.add_argument("--branch", default=DEFAULT_BRANCH)
-    parser.add_argument("--host", default=DEFAULT_HOST)
-    parser.add_argument("--quiet", default=False, help='Suppress printing run messages.')
-    args = parser.parse_args(argv)
-
-    job_trigger_url = f'{args.host}/api/v4/projects/{args.project}/trigger/pipeline?token={TOKEN}&ref={args.branch}'
-
-    response = requests.post(job_trigger_url)
-    response.raise_for_status()
-    test_url = response.json()['web_url']
+            print(f'Checking status again in {wait:.0f} seconds.')
+
+    return gitlab.wait_for_pipeline(host, project, pipeline, PRIVATE_TOKEN, listener=listener, on_poll=report)
+
+
+class Target(NamedTuple):
+    project: int
+    branch: str
+    stage: Optional[str] = None
+
+    def __str__(self):
+        return f'{self.project}/{self.branch}' + (f' ({self.stage})' if self.stage else '')
+
+
+def targets(projects: List[int], branches: List[str], stages: List[str]) -> List[Target]:
+    """
+    Every combination of projects, branches and stages, each once.  Without branches, a stage runs
+    on its own branch, and no stage on DEFAULT_BRANCH.
+
+    :raises ValueError: One of the branches doesn't run the jobs of one of the stages, or branches
+        are given with several stages, whose pipelines would be the same.
+    """
+    projects, branches, stages = (list(dict.fromkeys(values)) for values in (projects, branches, stages))
+    if branches and len(stages) > 1:
+        # A pipeline runs the jobs of whichever stages its branch runs, so the stage doesn't tell them apart
+        raise ValueError('A branch\'s pipeline is the same for every stage, give a single stage with branches')
+    if not stages:
+        return [Target(project, branch) for project, branch in itertools.product(projects, branches or [DEFAULT_BRANCH])]
+    combinations = []
+    for stage in stages:
+        for branch in branches or [STAGE_BRANCHES[stage]]:
+            if branch in STAGE_EXCEPT[stage]:
+                raise ValueError(f'Pipelines of {branch} don\'t run the {stage} jobs, see .gitlab-ci.yml')
+            combinations += [Target(project, branch, stage) for project in projects]
+    return combinations
+
+
+def trigger(host: str, target: Target) -> dict:
+    # Not BDCAT_STAGE: a trigger variable overrides the stage that each job sets for itself
+    return gitlab.trigger_pipeline(host, target.project, target.branch, TOKEN)
+
+
+def run_many(host: str, targets: List[Target], listener=None, quiet=False, workers=8) -> int:
+    """
+    Trigger a pipeline per target concurrently and wait for all of them from one polling loop.
+
+    Prints a line whenever a pipeline's status changes, and a summary at the end.
+    :return: The exit code: 0 if every pipeline succeeded, 1 otherwise.
+    """
+    def start(target):
+        try:
+            return target, trigger(host, target), None
+        except Exception as e:
+            return target, None, f'{type(e).__name__}: {e}'
+
+    configure(host, pool_size=workers)
+    pipelines: Dict[gitlab.Pipeline, Tuple[Target, str]] = {}
+    failed_to_start = []
+    for target, pipeline, error in bounded_imap(start, targets, workers=workers):
+        if pipeline is None:
+            print(f'Could not trigger {target}: {error}')
+            failed_to_start.append(target)
+        else:
+            pipelines[(host, target.project, str(pipeline['id']))] = (target, pipeline['web_url'])
+            if not quiet:
+                print(f'Started {target}.  See: {pipeline["web_url"]}')
+
+    previous: Dict[gitlab.Pipeline, str] = {}
+
+    def report(statuses):
+        if quiet:
+            return
+        counts = collections.Counter(statuses.values())
+        changes = [f'{pipelines[p][0]}: {status}' for p, status in statuses.items() if previous.get(p) != status]
+        summary = ', '.join(f'{s}: {n}' for s, n in sorted(counts.items()))
+        print(f'[{time.strftime("%H:%M:%S")}] {summary} | {", ".join(changes)}')
+        previous.update(statuses)
+
+    statuses = gitlab.wait_for_pipelines(pipelines, PRIVATE_TOKEN, listener=listener, workers=workers,
+                                         on_change=report) if pipelines else {}
+
+    print('Summary:')
+    rows = [(str(target), status, url) for p, (target, url) in pipelines.items() for status in [statuses[p]]]
+    rows += [(str(target), 'not started', '') for target in failed_to_start]
+    width = max(len(row[0]) for row in rows)
+    for name, status, url in rows:
+        print(f'  {name.ljust(width)}  {status.ljust(11)}  {url}')
+    return 0 if not failed_to_start and all(status == 'success' for status in statuses.values()) else 1
+
+
+def run_one(host: str, target: Target, listener=None, quiet=False):
+    test_url = trigger(host, target)['web_url']
     pipeline = test_url.split('/')[-1].strip()
 
-    if not args.quiet:
-        print('Starting integration tests.  Checking status in 10 seconds.')
+    if not quiet:
+        print('Starting integration tests.')
         print(f'See: {test_url}')
 
-    status = wait_for_final_status(pipeline=pipeline, host=args.host, project=args.project, quiet=args.quiet)
+    status = wait_for_final_status(pipeline=pipeline, host=host, project=target.project, quiet=quiet,
+                                   listener=listener)
 
-    if status == 'failed':
-        raise RuntimeError('Integration Tests have Failed: ' + test_url)
+    if status != 'success':
+        # Like run_many, anything but success fails, e.g. a canceled pipeline
+        raise RuntimeError(f'Integration Tests have {status}: {test_url}')
 
-    if not args.quiet:
+    if not quiet:
         print(f'Exiting.  Status was: {status}')
         print(f'See: {test_url}')
 
 
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Gitlab Test Trigger')
+    parser.add_argument("--project", type=int, action='append',
+                        help=f'A project to run; may be repeated.  Defaults to {DEFAULT_PROJECT_NUM}.')
+    parser.add_argument("--branch", action='append', default=[],
+                        help=f'A branch to run; may be repeated.  Defaults to {DEFAULT_BRANCH}, or to '
+                             f'the branch of each --stage.')
+    parser.add_argument("--stage", action='append', default=[], choices=sorted(STAGE_BRANCHES),
+                        help='Run the jobs of this BDCAT_STAGE, on its branch unless --branch is given; '
+                             'may be repeated without --branch.')
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--quiet", default=False, help='Suppress printing run messages.')
+    parser.add_argument("--listen", type=int, metavar='PORT',
+                        help='Wait for the pipeline\'s webhook on this port, polling only as a fallback; '
+                             'see test/infra/gitlab.py.  Needs GITLAB_WEBHOOK_SECRET.')
+    parser.add_argument("--listen-host", default='127.0.0.1',
+                        help='Address to receive webhooks on, e.g. 0.0.0.0 for any host.  Defaults to this host only.')
+    args = parser.parse_args(argv)
+    if args.listen is not None and not WEBHOOK_SECRET:
+        parser.error('--listen needs the webhook\'s secret token in GITLAB_WEBHOOK_SECRET')
+    try:
+        combinations = targets(args.project or [DEFAULT_PROJECT_NUM], args.branch, args.stage)
+    except ValueError as e:
+        parser.error(str(e))
+
+    listener = None
+    if args.listen is not None:
+        listener = gitlab.PipelineListener(port=args.listen, host=args.listen_host, secret=WEBHOOK_SECRET).start()
+    try:
+        if len(combinations) > 1:
+            # Every combination at once, e.g. --stage staging --stage prod before a release
+            sys.exit(run_many(args.host, combinations, listener=listener, quiet=args.quiet))
+        run_one(args.host, combinations[0], listener=listener, quiet=args.quiet)
+    finally:
+        if listener is not None:
+            listener.close()
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Run SevenBridges test plans through the QA broker (see test/infra/sb_broker.py).
+
+Run a plan in 4 concurrent shards, split by the tests and durations of a previous run:
+
+    python scripts/run_sb_tests.py shard bdc-staging-sbgtests.plans.bdc-20220101-120000-abc --shards 4
+
+Run only the tests that failed in a previous run:
+
+    python scripts/run_sb_tests.py rerun-failed bdc-staging-sbgtests.plans.bdc-20220101-120000-abc
+
+Rank the slowest tests of a previous run, optionally recording every test's timing to BigQuery:
+
+    python scripts/run_sb_tests.py report bdc-staging-sbgtests.plans.bdc-20220101-120000-abc --top 20 --bigquery
+
+BDCAT_SB_BROKER_TOKEN must be set.  Exits non-zero if any test failed.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+from test.infra import sb_broker
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Run SevenBridges test plans through the QA broker.')
+    parser.add_argument("--environment", choices=[env.name for env in sb_broker.SBEnv], default='staging')
+    parser.add_argument("--test-plan", default='sbgtests.plans.bdc')
+    parser.add_argument("--timeout", type=float, default=1800)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    shard_parser = subparsers.add_parser('shard', help='Run a plan in concurrent shards.')
+    shard_parser.add_argument("previous_task_id", help='A previous test run of the plan, to split its tests.')
+    shard_parser.add_argument("--shards", type=int, default=4)
+    shard_parser.add_argument("--report", type=argparse.FileType('w'),
+                              help='Where to write the merged summary of the shards\' reports.')
+    rerun_parser = subparsers.add_parser('rerun-failed', help='Run the tests that failed in a previous run.')
+    rerun_parser.add_argument("task_id")
+    report_parser = subparsers.add_parser('report', help='Rank the slowest tests of a previous run.')
+    report_parser.add_argument("task_id")
+    report_parser.add_argument("--top", type=int, default=10)
+    report_parser.add_argument("--bigquery", action='store_true',
+                               help='Also record every test\'s state and duration to the metrics store.')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+    sb_environment = sb_broker.SBEnv[args.environment]
+    if args.command == 'shard':
+        broker = sb_broker.SevenBridgesBrokerClient()
+        results = sb_broker.run_sharded(broker, sb_environment, args.test_plan, args.previous_task_id,
+                                        shards=args.shards, timeout=args.timeout)
+        if args.report:
+            json.dump(sb_broker.merge_summaries(r.summary for r in results if r.summary), args.report, indent=2)
+    elif args.command == 'report':
+        metrics = table_id = None
+        if args.bigquery:
+            # Imported here, since test.bq needs the google and terra packages that nothing else here does
+            from test.bq import SB_TEST_TIMINGS_TABLE, get_sink
+            metrics, table_id = get_sink(), SB_TEST_TIMINGS_TABLE
+        summary = sb_broker.ingest_report(sb_broker.SevenBridgesBrokerClient(), args.task_id, sb_environment,
+                                          metrics, table_id, top=args.top)
+        if metrics is not None:
+            metrics.flush()
+        print(sb_broker.format_ranking(summary))
+        sys.exit(0 if not summary.failed_tests else 1)
+    else:
+        result = sb_broker.rerun_failed(sb_environment, args.test_plan, args.task_id, timeout=args.timeout)
+        if result is None:
+            print(f'No tests failed in {args.task_id}')
+            return
+        results = [result]
+    print(sb_broker.format_results(results))
+    sys.exit(0 if all(result.passed for result in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Async variants of the endpoint helpers in test/utils.py.
+
+Every helper is a method of AsyncClient, which owns one pooled aiohttp session, so a single
+event loop can drive hundreds of concurrent workspace, PFB and DRS operations:
+
+    async with AsyncClient() as client:
+        jobs = await asyncio.gather(*[client.import_pfb(workspace, pfb) for pfb in pfbs])
+
+Endpoints, billing project and credentials are the ones test/utils.py selects with BDCAT_STAGE.
+"""
+import asyncio
+import contextlib
+from typing import AsyncIterator, Optional
+
+import aiohttp
+
+from test.infra.aio import async_retry, client_session
+from test.infra.poll import Poller
+from test.infra.sessions import POOL_SIZE
+from test.utils import (BILLING_PROJECT,
+                        GEN3_DOMAIN,
+                        ORC_DOMAIN,
+                        RAWLS_DOMAIN,
+                        add_requester_pays_arg_to_url,
+                        drs_uri_to_guid,
+                        terra_token)
+
+SERVER_ERRORS = {500, 502, 503, 504}
+PFB_IN_PROGRESS = ('Pending', 'Translating', 'ReadyForUpsert', 'Upserting')
+REQUEST_ERRORS = {aiohttp.ClientResponseError, aiohttp.ClientConnectionError, asyncio.TimeoutError}
+
+
+class AsyncClient:
+
+    """The Terra and Gen3 endpoint helpers, as coroutines sharing one connection pool
+
+    :param pool_size: Connections kept per host.
+    """
+
+    def __init__(self, pool_size: int = POOL_SIZE):
+        self.pool_size = pool_size
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> 'AsyncClient':
+        self._session = client_session(self.pool_size, raise_for_status=False)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            raise RuntimeError('Use AsyncClient as an async context manager: async with AsyncClient() as client')
+        return self._session
+
+    async def _headers(self, headers: dict) -> dict:
+        # A token refresh makes a blocking call, keep it off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, terra_token.headers, headers)
+
+    @contextlib.asynccontextmanager
+    async def _request(self, method: str, url: str, headers: dict, **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+        """Make a request with the Terra token; if that is refused with a 401, once more with a new token."""
+        headers = await self._headers(headers)
+        resp = await self.session.request(method, url, headers=headers, **kwargs)
+        try:
+            if resp.status == 401:
+                resp.release()
+                terra_token.invalidate(headers['Authorization'][len('Bearer '):])
+                resp = await self.session.request(method, url, headers=await self._headers(headers), **kwargs)
+            yield resp
+        finally:
+            resp.release()
+
+    async def _json(self, method: str, url: str, headers: dict, **kwargs):
+        async with self._request(method, url, headers, **kwargs) as resp:
+            if resp.status >= 400:
+                print(await resp.read())
+            resp.raise_for_status()
+            return await resp.json(content_type=None)
+
+    @async_retry(error_codes=SERVER_ERRORS, errors=REQUEST_ERRORS)
+    async def check_terra_health(self):
+        async with self.session.get(f'{ORC_DOMAIN}/status') as resp:
+            resp.raise_for_status()
+            return await resp.json(content_type=None)
+
+    @async_retry(error_codes=SERVER_ERRORS, errors=REQUEST_ERRORS)
+    async def create_terra_workspace(self, workspace):
+        data = dict(namespace=BILLING_PROJECT,
+                    name=workspace,
+                    authorizationDomain=[],
+                    attributes={'description': ''},
+                    copyFilesWithPrefix='notebooks/')
+        return await self._json('POST', f'{RAWLS_DOMAIN}/api/workspaces',
+                                {'Content-Type': 'application/json', 'Accept': 'application/json'}, json=data)
+
+    @async_retry(error_codes=SERVER_ERRORS, errors=REQUEST_ERRORS)
+    async def delete_terra_workspace(self, workspace) -> int:
+        """Returns the response's status code; like utils.delete_terra_workspace, a 404 isn't an error."""
+        endpoint = f'{RAWLS_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}'
+        async with self._request('DELETE', endpoint, {'Accept': 'text/plain'}) as resp:
+            if resp.status in SERVER_ERRORS:
+                resp.raise_for_status()
+            return resp.status
+
+    @async_retry(error_codes=SERVER_ERRORS, errors=REQUEST_ERRORS)
+    async def import_pfb(self, workspace, pfb_file):
+        return await self._json('POST', f'{ORC_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}/importPFB',
+                                {'Content-Type': 'application/json', 'Accept': 'application/json'},
+                                json=dict(url=pfb_file))
+
+    # Like utils.pfb_job_status_in_terra, the whole schedule is always waited out
+    @async_retry(error_codes=SERVER_ERRORS, errors=REQUEST_ERRORS, intervals=[1, 1, 2, 4, 8, 16, 32, 64],
+                 jitter=False, circuit_breaker=None)
+    async def pfb_job_status_in_terra(self, workspace, job_id):
+        return await self._json('GET', f'{ORC_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}/importPFB/{job_id}',
+                                {'Accept': 'application/json'})
+
+    @async_retry(error_codes=SERVER_ERRORS, errors=REQUEST_ERRORS)
+    async def check_workflow_status(self, submission_id, workspace='DRS-Test-Workspace'):
+        endpoint = f'{RAWLS_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}/submissions/{submission_id}'
+        return await self._json('GET', endpoint, {'Accept': 'application/json'})
+
+    @async_retry(error_codes=SERVER_ERRORS, errors=REQUEST_ERRORS)
+    async def import_drs_from_gen3(self, guid: str) -> bytes:
+        """
+        Fetch the first two bytes of a DRS URI through gen3, like utils.import_drs_from_gen3.
+
+        :raises aiohttp.ClientResponseError: Either hop failed.
+        """
+        guid = drs_uri_to_guid(guid)
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        async with self._request('GET', f'{GEN3_DOMAIN}/user/data/download/{guid}', headers) as resp:
+            resp.raise_for_status()
+            gs_endpoint = (await resp.json(content_type=None))['url']
+        # Use 'Range' header to only download the first two bytes
+        headers = await self._headers({**headers, 'Range': 'bytes=0-1'})
+        async with self.session.get(add_requester_pays_arg_to_url(gs_endpoint), headers=headers) as resp:
+            resp.raise_for_status()
+            return await resp.read()
+
+    async def wait_for_pfb_import(self, workspace, job_id, poller: Optional[Poller] = None) -> dict:
+        """Poll a PFB import until it leaves the in-progress states; see Poller for per-state dwell times."""
+        poller = poller or Poller(timeout=30 * 60, initial=1, maximum=10)
+        return await poller.wait_async(lambda: self.pfb_job_status_in_terra(workspace, job_id),
+                                       done=lambda status: status['status'] not in PFB_IN_PROGRESS,
+                                       state=lambda status: status['status'])
+
+    async def wait_for_workflow(self, submission_id, poller: Optional[Poller] = None) -> dict:
+        """Poll a submission until it is "Done" or its workflow failed."""
+        poller = poller or Poller(timeout=None, initial=5, maximum=60)
+        return await poller.wait_async(lambda: self.check_workflow_status(submission_id),
+                                       done=lambda r: r['status'] == 'Done' or r['workflows'][0]['status'] == 'Failed',
+                                       state=lambda r: r['workflows'][0]['status'])
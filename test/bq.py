@@ -1,34 +1,58 @@
+import atexit
 import datetime
 import logging
+import os
+import threading
+from typing import List, Optional
 
-from google.api_core.exceptions import ServiceUnavailable
+from google.api_core.exceptions import BadGateway, GoogleAPICallError, InternalServerError, ServerError
+from google.api_core.exceptions import ServiceUnavailable, TooManyRequests
+from google.auth.exceptions import TransportError
 from google.cloud import bigquery
 from google.cloud.exceptions import Conflict
 from google.oauth2.service_account import Credentials
 
-from test.utils import retry
+from test.metrics import DRS_HOPS, DRS_HOP_FIELDS, BufferedClient, Field, MetricsBackend, local_backend
+from test.utils import retry, STAGE
 
 log = logging.getLogger(__name__)
 
 
-class Client:
+class Client(MetricsBackend):
+
+    """Records metrics to BigQuery"""
 
     def __init__(self, project='platform-dev-178517'):
         credentials = Credentials.from_service_account_file('gcp-creds.json')
         self.client = bigquery.Client(project=project, credentials=credentials)
 
-    @retry(errors={ServiceUnavailable})
-    def add_row(self, table_id: str, row: dict):
-        rows_to_insert = [row]
-        errors = self.client.insert_rows_json(table_id, rows_to_insert)
+    @retry(errors={ServiceUnavailable, InternalServerError, BadGateway, TooManyRequests})
+    def add_rows(self, table_id: str, rows: List[dict]):
+        errors = self.client.insert_rows_json(table_id, rows)
         if errors:
             raise RuntimeError(f'Encountered errors while inserting rows: {errors}')
 
+    def is_transient(self, error: Exception) -> bool:
+        if isinstance(error, GoogleAPICallError):
+            # Other 4xx, e.g. NotFound, BadRequest or Forbidden, won't go away by retrying
+            return isinstance(error, (ServerError, TooManyRequests))
+        return isinstance(error, TransportError) or super().is_transient(error)
+
     def list_table(self, table_id, limit=10):
         q = self.client.query(f'SELECT * FROM `{table_id}` LIMIT {limit}')
         return list(q.result())
 
+    def read_table(self, table_id, since: Optional[datetime.datetime] = None) -> List[dict]:
+        query, job_config = f'SELECT * FROM `{table_id}`', bigquery.QueryJobConfig()
+        if since is not None:
+            query += ' WHERE t >= @since'
+            job_config.query_parameters = [bigquery.ScalarQueryParameter('since', 'TIMESTAMP', since)]
+        q = self.client.query(query + ' ORDER BY t', job_config=job_config)
+        return [dict(row.items()) for row in q.result()]
+
     def create_table(self, table_id, schema):
+        schema = [bigquery.SchemaField(f.name, f.field_type, mode=f.mode) if isinstance(f, Field) else f
+                  for f in schema]
         table = bigquery.Table(table_id, schema=schema)
         try:
             table = self.client.create_table(table)
@@ -36,36 +60,61 @@ class Client:
         except Conflict:
             log.warning(f'Table {table.project}.{table.dataset_id}.{table.table_id} already exists')
 
-    def create_test_table(self, table_id):
-        schema = [
-            bigquery.SchemaField('t', 'TIMESTAMP', mode='REQUIRED'),
-            bigquery.SchemaField('u', 'INTEGER', mode='REQUIRED'),
-            bigquery.SchemaField('d', 'INTEGER', mode='REQUIRED'),
-            bigquery.SchemaField('m', 'INTEGER', mode='REQUIRED')
-        ]
-        self.create_table(table_id, schema)
-
-    def log_test_results(self, test_name, status, timestamp, create=False):
-        table_id = f'platform-dev-178517.bdc.integration_tests_{test_name}'
-        if status != 'skip':
-            if status == 'success':
-                field = 'u'
-            elif status in ('failure', 'error'):
-                field = 'd'
-            else:
-                raise ValueError(f'Unexpected status: {status!r} for test: {test_name!r}')
-            row = {f: (1 if f == field else 0) for f in ('u', 'd', 'm')}
-            row['t'] = str(timestamp)
-            if create:
-                self.create_test_table(table_id)
-            self.add_row(table_id, row)
+
+_client: Optional[MetricsBackend] = None
+_sink: Optional[BufferedClient] = None
+_lock = threading.Lock()
+
+
+def get_client() -> MetricsBackend:
+    """
+    The metrics backend shared by this process, so credentials are only read once.
+
+    BigQuery unless BDCAT_METRICS_BACKEND selects a local backend, see test/metrics.py.
+    """
+    global _client
+    with _lock:
+        if _client is None:
+            backend = os.environ.get('BDCAT_METRICS_BACKEND', 'bigquery')
+            _client = Client() if backend == 'bigquery' else local_backend(backend)
+        return _client
+
+
+def get_sink() -> BufferedClient:
+    """The BufferedClient shared by this process; it is flushed at exit."""
+    global _sink
+    with _lock:
+        if _sink is None:
+            _sink = BufferedClient(get_client)
+            atexit.register(_sink.flush)
+        return _sink
 
 
 def log_duration(table, duration):
     try:
         # Track time in minutes
-        Client().add_row(table, {'t': str(datetime.datetime.now()), 'd': duration / 60})
+        get_sink().add_row(table, {'t': str(datetime.datetime.now()), 'd': duration / 60})
 
     except Exception:
         # We don't want failed logging to fail the whole test
         log.warning('Failed to log run time to BigQuery', exc_info=True)
+
+
+# Per-test states and durations of SevenBridges test runs, see sb_broker.ingest_report
+SB_TEST_TIMINGS_TABLE = 'platform-dev-178517.bdc.sb_test_timings'
+
+
+def log_drs_hop_timings(record, table=f'platform-dev-178517.bdc.drs_hop_latency_{STAGE}'):
+    try:
+        # Track time in seconds, most hops take well under a minute
+        columns = {'uri', 'status', 'error', 'signed_url_host'}
+        columns.update(f'{hop}_{field}' for hop in DRS_HOPS for field in DRS_HOP_FIELDS)
+        row = {k: v for k, v in record.items() if k in columns}
+        row['t'] = str(datetime.datetime.now())
+        sink = get_sink()
+        sink.ensure_table(table, sink.create_drs_hop_table)
+        sink.add_row(table, row)
+
+    except Exception:
+        # We don't want failed logging to fail the whole test
+        log.warning('Failed to log DRS hop timings to BigQuery', exc_info=True)
@@ -0,0 +1,170 @@
+import logging
+import time
+from typing import Iterable, Iterator
+from urllib.parse import urlsplit
+
+import requests
+from requests.exceptions import HTTPError, ConnectionError
+
+from test.infra.checksums import HASHLIB_ALGORITHMS, compare, hash_url
+from test.infra.concurrency import bounded_imap
+from test.infra.retry import retry
+from test.infra.sessions import configure
+from test.infra.timing import ConnectionTimer
+from test.utils import (GEN3_DOMAIN,
+                        add_requester_pays_arg_to_url,
+                        drs_cache,
+                        drs_cache_identity,
+                        drs_uri_to_guid,
+                        get_indexd_record,
+                        read_first_bytes_from_gs,
+                        request_signed_url_from_gen3,
+                        signed_url_from_gen3,
+                        terra_token)
+
+log = logging.getLogger(__name__)
+
+GS_DOMAIN = 'https://storage.googleapis.com'
+
+
+def _timed_hop(hop: str, request, arg, record: dict) -> requests.Response:
+    """
+    Make one hop's request, retrying server errors, and add its timings to ``record``.
+
+    Timings describe the final attempt; time spent on earlier failed attempts (and the
+    backoff between them) is reported separately as ``{hop}_retry_seconds``.
+    """
+    start = time.perf_counter()
+    attempts = 0
+    final = {}
+
+    # Decorated per call, since attempts are counted in this call's closure
+    @retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
+    def attempt():
+        nonlocal attempts
+        attempts += 1
+        attempt_start = time.perf_counter()
+        with ConnectionTimer() as timer:
+            resp = request(arg)
+        final.update({f'{hop}_status_code': resp.status_code,
+                      f'{hop}_dns_seconds': timer.dns_seconds,
+                      f'{hop}_connect_seconds': timer.connect_seconds,
+                      f'{hop}_tls_seconds': timer.tls_seconds,
+                      f'{hop}_ttfb_seconds': timer.ttfb_seconds,
+                      f'{hop}_total_seconds': time.perf_counter() - attempt_start})
+        if resp.status_code >= 500:
+            # Only server errors are retried, a 401/403 is a result in its own right
+            resp.raise_for_status()
+        return resp
+
+    try:
+        return attempt()
+    finally:
+        record.update(final)
+        record[f'{hop}_attempts'] = attempts
+        record[f'{hop}_retry_seconds'] = time.perf_counter() - start - final.get(f'{hop}_total_seconds', 0.0)
+
+
+def check_drs_access(drs_uri: str) -> dict:
+    """
+    Run both hops of import_drs_from_gen3 for one DRS URI and describe the outcome.
+
+    Never raises; an unexpected failure is reported with status "error".  Example::
+
+        {"uri": "drs://dg.712C/...", "status": "ok", "signed_url_host": "storage.googleapis.com",
+         "gen3_status_code": 200, "gen3_attempts": 1, "gen3_retry_seconds": 0.0,
+         "gen3_dns_seconds": 0.01, "gen3_connect_seconds": 0.02, "gen3_tls_seconds": 0.05,
+         "gen3_ttfb_seconds": 0.33, "gen3_total_seconds": 0.42,
+         "gs_status_code": 206, "gs_attempts": 1, ...}
+
+    status is one of "ok", "gen3_failed", "gs_failed" or "error".  The gen3 hop is the
+    fence /user/data/download/{guid} resolution and the gs hop is the ranged read of the
+    signed url.
+    """
+    record = dict(uri=drs_uri)
+    try:
+        guid = drs_uri_to_guid(drs_uri)
+
+        gen3_resp = _timed_hop('gen3', request_signed_url_from_gen3, guid, record)
+        if not gen3_resp.ok:
+            record['status'] = 'gen3_failed'
+            return record
+
+        gs_endpoint = gen3_resp.json()['url']
+        record['signed_url_host'] = urlsplit(gs_endpoint).netloc
+
+        gs_resp = _timed_hop('gs', read_first_bytes_from_gs, gs_endpoint, record)
+        record['status'] = 'ok' if gs_resp.ok else 'gs_failed'
+        if gs_resp.ok and drs_cache:
+            # The gen3 hop is always timed, but later reads of the object (e.g. verify_drs_checksums) needn't repeat it
+            drs_cache.put(GEN3_DOMAIN, drs_cache_identity(), guid, gs_endpoint)
+    except Exception as e:
+        log.debug('Checking %s failed', drs_uri, exc_info=True)
+        record.update(status='error', error=repr(e))
+    return record
+
+
+def check_drs_access_and_checksums(drs_uri: str) -> dict:
+    """
+    check_drs_access(), and if the object is accessible, verify_drs_checksums() as "checksums".
+
+    Never raises; status is "checksum_mismatch" if a checksum doesn't match, or "error" if
+    the checksums couldn't be verified.
+    """
+    record = check_drs_access(drs_uri)
+    if record['status'] == 'ok':
+        try:
+            record['checksums'] = verify_drs_checksums(drs_uri)
+            if not record['checksums']['ok']:
+                record['status'] = 'checksum_mismatch'
+        except Exception as e:
+            log.debug('Verifying the checksums of %s failed', drs_uri, exc_info=True)
+            record.update(status='error', error=repr(e))
+    return record
+
+
+def check_drs_access_many(drs_uris: Iterable[str], workers: int = 16, checksums: bool = False) -> Iterator[dict]:
+    """
+    Check many DRS URIs concurrently, yielding check_drs_access() records as they complete.
+
+    ``drs_uris`` is consumed lazily, so it may be a file object or any other long stream;
+    blank lines are skipped.  With ``checksums``, the workers also verify the checksums of
+    every accessible object, see check_drs_access_and_checksums().
+    """
+    # Keep one pooled connection per worker to each host, rather than discarding the overflow
+    configure(GEN3_DOMAIN, pool_size=workers)
+    configure(GS_DOMAIN, pool_size=workers)
+    uris = (uri.strip() for uri in drs_uris)
+    check = check_drs_access_and_checksums if checksums else check_drs_access
+    return bounded_imap(check, (uri for uri in uris if uri), workers=workers)
+
+
+def verify_drs_checksums(drs_uri: str, workers: int = 8) -> dict:
+    """
+    Download a DRS object through gen3 and compare its checksums with those recorded in indexd.
+
+    The object is streamed with ``workers`` concurrent range requests and every checksum is
+    computed in the same pass: crc32c, plus each of md5, sha1, sha256, sha512 and crc that
+    indexd has a record of.  Example::
+
+        {"uri": "drs://dg.712C/...", "size": 2048, "seconds": 0.8, "ok": true,
+         "expected": {"md5": "e87e..."}, "computed": {"md5": "e87e...", "crc32c": "1a2b3c4d"},
+         "matches": {"md5": true}}
+
+    ok is true if at least one checksum could be compared and all compared checksums match.
+    """
+    start = time.perf_counter()
+    guid = drs_uri_to_guid(drs_uri)
+    record = get_indexd_record(guid)
+    expected = record.get('hashes') or {}
+    algorithms = [a for a in HASHLIB_ALGORITHMS + ('crc',) if a in expected] + ['crc32c']
+
+    computed = hash_url(add_requester_pays_arg_to_url(signed_url_from_gen3(guid)),
+                        algorithms=algorithms,
+                        size=record.get('size'),
+                        headers=terra_token.headers(),
+                        workers=workers)
+    matches = compare(computed, expected)
+    return dict(uri=drs_uri, size=record.get('size'), seconds=time.perf_counter() - start,
+                ok=bool(matches) and all(matches.values()),
+                expected=expected, computed=computed, matches=matches)
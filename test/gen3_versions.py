@@ -0,0 +1,173 @@
+"""
+Fetch the versions of Gen3 services across any number of commons, concurrently.
+
+    versions = fetch_versions(COMMONS)
+    versions[('bdcat_staging', 'indexd')].version >= versions[('bdcat_prod', 'indexd')].version
+
+More commons can be added with BDCAT_GEN3_COMMONS, e.g. "name=https://host,other=https://host".
+Responses are cached for BDCAT_VERSION_CACHE_TTL seconds (default 300), so that several
+checks in one run query each endpoint once.
+"""
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from test.infra.concurrency import bounded_imap
+from test.infra.sessions import get_session
+
+log = logging.getLogger(__name__)
+
+COMMONS = {
+    'bdcat_prod': 'https://gen3.biodatacatalyst.nhlbi.nih.gov',
+    'bdcat_staging': 'https://staging.gen3.biodatacatalyst.nhlbi.nih.gov',
+}
+for _entry in filter(None, os.environ.get('BDCAT_GEN3_COMMONS', '').split(',')):
+    _name, _, _url = _entry.partition('=')
+    COMMONS[_name.strip()] = _url.strip()
+
+# The version endpoint of each service, relative to a commons' URL
+SERVICES = {
+    'indexd': '/index/_version',
+    'fence': '/user/_version',
+    'sheepdog': '/api/_version',
+}
+
+TIMEOUT = 10
+CACHE_TTL = float(os.environ.get('BDCAT_VERSION_CACHE_TTL', 5 * 60))
+
+
+@functools.total_ordering
+class Version:
+
+    """
+    A version string that compares semantically, component by component.
+
+    Gen3 releases are named "YYYY.MM", which string comparison gets right only as long
+    as months are zero-padded; services use "MAJOR.MINOR.PATCH".  Missing components
+    count as zero, and a pre-release sorts before its release.  As in SemVer, the
+    dot-separated identifiers of pre-releases compare as numbers if they are numeric, and
+    "+build" metadata is ignored.
+
+    >>> Version('2021.9') < Version('2021.10')
+    True
+    >>> Version('2022.01') > Version('2021.12')
+    True
+    >>> Version('1.2') == Version('v1.2.0')
+    True
+    >>> Version('2022.01-rc1') < Version('2022.01')
+    True
+    >>> Version('1.2.3-rc.2') < Version('1.2.3-rc.10') < Version('1.2.3-rc.x')
+    True
+    >>> Version('1.2.3+build.5') == Version('1.2.3')
+    True
+    >>> Version('master')
+    Traceback (most recent call last):
+    ...
+    ValueError: Not a version: 'master'
+    """
+
+    _pattern = re.compile(r'^v?(\d+(?:\.\d+)*)(?:[-.]?([^+]+))?(?:\+(.*))?$')
+
+    def __init__(self, version: str):
+        match = self._pattern.match(version.strip())
+        if not match:
+            raise ValueError(f'Not a version: {version!r}')
+        self.text = version
+        numbers = [int(n) for n in match.group(1).split('.')]
+        while len(numbers) > 1 and numbers[-1] == 0:
+            numbers.pop()
+        self.release = tuple(numbers)
+        self.pre_release = match.group(2)
+        self.build = match.group(3)
+
+    def _key(self) -> tuple:
+        if self.pre_release is None:
+            # (1,) sorts after (0, ...): a release is newer than its pre-releases
+            return self.release, (1,)
+        # Numeric identifiers sort by value and before alphanumeric ones
+        identifiers = tuple((0, int(i), '') if i.isdigit() else (1, 0, i) for i in self.pre_release.split('.'))
+        return self.release, (0, identifiers)
+
+    def __eq__(self, other):
+        return isinstance(other, Version) and self._key() == other._key()
+
+    def __lt__(self, other: 'Version'):
+        return self._key() < other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return f'Version({self.text!r})'
+
+    def __str__(self):
+        return self.text
+
+
+class VersionResult(NamedTuple):
+    url: str
+    version: Optional[Version] = None
+    payload: Optional[dict] = None
+    error: Optional[str] = None
+
+
+_cache: Dict[str, Tuple[float, VersionResult]] = {}
+_cache_lock = threading.Lock()
+
+
+def fetch_version(url: str, timeout: float = TIMEOUT, ttl: float = CACHE_TTL) -> VersionResult:
+    """Fetch and parse one version endpoint; never raises, a failure is reported as the result's error."""
+    with _cache_lock:
+        cached = _cache.get(url)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+    try:
+        resp = get_session(url).get(url, timeout=timeout)
+        resp.raise_for_status()
+        payload = resp.json()
+        result = VersionResult(url, Version(payload['version']), payload)
+    except Exception as e:
+        log.warning('Could not get the version from %s: %s', url, e)
+        # Failures aren't cached, the next check should try again
+        return VersionResult(url, error=f'{type(e).__name__}: {e}')
+    with _cache_lock:
+        _cache[url] = (time.monotonic() + ttl, result)
+    return result
+
+
+def fetch_versions(commons: Optional[Dict[str, str]] = None,
+                   services: Optional[Dict[str, str]] = None,
+                   timeout: float = TIMEOUT,
+                   workers: int = 16) -> Dict[Tuple[str, str], VersionResult]:
+    """
+    Fetch every service's version from every commons concurrently.
+
+    :param commons: Names and URLs of the commons; defaults to COMMONS.
+    :param services: Names and version endpoints of the services; defaults to SERVICES.
+    :param timeout: Seconds to wait for each endpoint, so that one slow commons can't hang the check.
+    :return: The result per (commons, service).
+    """
+    commons = COMMONS if commons is None else commons
+    services = SERVICES if services is None else services
+    keys = [(c, s) for c in commons for s in services]
+
+    def fetch(key):
+        c, s = key
+        return key, fetch_version(commons[c] + services[s], timeout=timeout)
+
+    return dict(bounded_imap(fetch, keys, workers=workers))
+
+
+def format_matrix(versions: Dict[Tuple[str, str], VersionResult]) -> str:
+    """A table of versions, with a row per service and a column per commons."""
+    commons = list(dict.fromkeys(c for c, _ in versions))
+    services = list(dict.fromkeys(s for _, s in versions))
+    rows = [[''] + commons]
+    for s in services:
+        rows.append([s] + [str(versions[(c, s)].version or 'error') if (c, s) in versions else '' for c in commons])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows)
@@ -0,0 +1,184 @@
+"""
+Crawl the records of a Gen3 indexd into a JSONL file, and pick test DRS URIs from it by ACL.
+
+    crawl('records.jsonl', GEN3_DOMAIN)
+    select_drs_uris('records.jsonl', 'restricted', count=3)
+
+A full listing is far too large for one response, so /index/index is read in pages of
+``limit`` records, ``workers`` pages at a time.  Pages are written in order as they arrive,
+one record per line with only the fields in FIELDS, so memory use doesn't grow with the index.
+
+After each page the crawl saves a checkpoint next to the output file ("records.jsonl.checkpoint").
+An interrupted crawl resumes from the page after the last one written, truncating whatever
+was written after that checkpoint.  A finished crawl is not repeated unless ``restart`` is set.
+"""
+import json
+import logging
+import os
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional
+
+from requests.exceptions import ConnectionError, HTTPError
+
+from test.infra.retry import retry
+from test.infra.sessions import configure, get_session
+
+log = logging.getLogger(__name__)
+
+FIELDS = ('did', 'acl', 'size', 'hashes', 'urls')
+PAGE_LIMIT = 1024  # the most indexd returns per page
+
+# ACLs that the integration test account has access to, besides public ("*") data
+ACCESSIBLE_ACLS = frozenset([
+    'admin', 'topmed', 'phs000888', 'phs000681', 'phs001014', 'phs001095', 'phs001215', 'phs001544',
+    'phs001395', 'phs000169', 'phs000636', 'phs000820', 'phs000971', 'phs000984', 'phs000292',
+    'phs000997', 'phs000944', 'phs000304', 'phs000209', 'phs000538', 'phs000353',
+])
+CATEGORIES = ('public', 'accessible', 'restricted')
+
+
+def acl_category(record: dict, accessible: Iterable[str] = ACCESSIBLE_ACLS) -> str:
+    """
+    Whether a record is "public", "accessible" to the test account or "restricted".
+
+    >>> acl_category({'acl': ['*']})
+    'public'
+    >>> acl_category({'acl': ['phs000007', 'topmed']})
+    'accessible'
+    >>> acl_category({'acl': ['phs000007']})
+    'restricted'
+    """
+    acl = set(record.get('acl') or ())
+    if '*' in acl:
+        return 'public'
+    return 'accessible' if acl & set(accessible) else 'restricted'
+
+
+@retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
+def fetch_page(gen3_domain: str, page: int, limit: int = PAGE_LIMIT, params: Optional[dict] = None) -> List[dict]:
+    """One page of indexd records, numbered from 0."""
+    url = f'{gen3_domain}/index/index'
+    resp = get_session(url).get(url, params={**(params or {}), 'limit': limit, 'page': page})
+    resp.raise_for_status()
+    return resp.json()['records']
+
+
+class _Checkpoint:
+
+    """The progress of a crawl, saved atomically next to its output"""
+
+    def __init__(self, path: str, query: dict):
+        self.path = path + '.checkpoint'
+        self.query = query
+        self.page, self.offset, self.records, self.done = 0, 0, 0, False
+
+    def load(self) -> bool:
+        """Load a saved checkpoint of the same query, returning whether there was one."""
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return False
+        if saved['query'] != self.query:
+            raise ValueError(f'{self.path} is a checkpoint of a different crawl ({saved["query"]}); '
+                             f'restart it, or crawl to another file')
+        self.page, self.offset, self.records, self.done = saved['page'], saved['offset'], saved['records'], saved['done']
+        return True
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(dict(query=self.query, page=self.page, offset=self.offset, records=self.records, done=self.done), f)
+        os.replace(tmp, self.path)
+
+
+def crawl(path: str,
+          gen3_domain: str,
+          limit: int = PAGE_LIMIT,
+          workers: int = 8,
+          params: Optional[dict] = None,
+          restart: bool = False) -> int:
+    """
+    Write every indexd record to ``path`` as JSONL, resuming from a checkpoint if there is one.
+
+    :param params: Further query parameters of /index/index, e.g. ``{'acl': 'phs000007'}``.
+    :param restart: Ignore any checkpoint and crawl from the first page.
+    :return: The number of records in ``path``.
+    """
+    checkpoint = _Checkpoint(path, dict(gen3_domain=gen3_domain, limit=limit, params=params or {}))
+    if restart or not checkpoint.load():
+        checkpoint.save()
+    elif checkpoint.done:
+        log.info('%s is a finished crawl of %d records', path, checkpoint.records)
+        return checkpoint.records
+    else:
+        log.info('Resuming the crawl into %s at page %d, after %d records', path, checkpoint.page, checkpoint.records)
+
+    configure(gen3_domain, pool_size=workers)
+    with open(path, 'ab') as out, ThreadPoolExecutor(max_workers=workers) as executor:
+        # Drop anything written after the checkpoint, by a crawl that was interrupted mid-page
+        out.truncate(checkpoint.offset)
+        out.seek(checkpoint.offset)
+        pending = deque()
+        next_page = checkpoint.page
+        while not checkpoint.done:
+            while len(pending) < workers:
+                pending.append(executor.submit(fetch_page, gen3_domain, next_page, limit, params))
+                next_page += 1
+            # Write in page order, while the next pages download
+            records = pending.popleft().result()
+            for record in records:
+                out.write(json.dumps({field: record.get(field) for field in FIELDS}).encode('utf-8') + b'\n')
+            out.flush()
+            os.fsync(out.fileno())
+            checkpoint.page += 1
+            checkpoint.offset = out.tell()
+            checkpoint.records += len(records)
+            # The first short page is the last one; pages requested past it are discarded
+            checkpoint.done = len(records) < limit
+            checkpoint.save()
+            if checkpoint.page % 100 == 0:
+                log.info('Crawled %d pages, %d records', checkpoint.page, checkpoint.records)
+        for future in pending:
+            future.cancel()
+    log.info('Crawled %d records into %s', checkpoint.records, path)
+    return checkpoint.records
+
+
+def read_records(path: str) -> Iterator[dict]:
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def select_drs_uris(path: str,
+                    category: str,
+                    count: int = 1,
+                    accessible: Iterable[str] = ACCESSIBLE_ACLS,
+                    seed: Optional[int] = None) -> List[str]:
+    """
+    Pick ``count`` random DRS URIs of one ACL category from a crawl, or fewer if there aren't as many.
+
+    The crawl is read once and never held in memory (reservoir sampling).
+    """
+    if category not in CATEGORIES:
+        raise ValueError(f'Unknown ACL category {category!r}, expected one of {CATEGORIES}')
+    rand = random.Random(seed)
+    accessible = set(accessible)
+    chosen: List[str] = []
+    seen = 0
+    for record in read_records(path):
+        if acl_category(record, accessible) != category:
+            continue
+        seen += 1
+        uri = f"drs://{record['did']}"
+        if len(chosen) < count:
+            chosen.append(uri)
+        else:
+            i = rand.randrange(seen)
+            if i < count:
+                chosen[i] = uri
+    return chosen
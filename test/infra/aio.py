@@ -0,0 +1,73 @@
+"""
+asyncio counterparts of test/infra/retry.py and test/infra/sessions.py, for aiohttp.
+
+One event loop and one aiohttp.ClientSession can keep hundreds of requests in flight,
+where the blocking helpers need a thread per request; see test/async_utils.py.
+"""
+import asyncio
+import functools
+from typing import Iterable, Optional, Set
+
+import aiohttp
+
+from test.infra.retry import CircuitBreaker, Failure, breaker, schedule_factory
+from test.infra.sessions import CONNECT_TIMEOUT, POOL_SIZE, READ_TIMEOUT
+
+
+def describe_aiohttp_error(e: Exception) -> Optional[Failure]:
+    """Describe an exception from aiohttp, or return None if ``e`` isn't from a request."""
+    if isinstance(e, aiohttp.ClientResponseError):
+        return Failure(e.status, str(e.request_info.url), e.headers or {})
+    elif isinstance(e, aiohttp.ClientConnectorError):
+        return Failure(None, f'//{e.host}', {})
+    elif isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return Failure(None, None, {})
+    return None
+
+
+def async_retry(intervals: Optional[Iterable[float]] = None,
+                errors: Optional[Set] = None,
+                error_codes: Optional[Set] = None,
+                budget: Optional[float] = None,
+                jitter: bool = True,
+                circuit_breaker: Optional[CircuitBreaker] = breaker):
+    """
+    test.infra.retry.retry for coroutine functions; sleeps without blocking the event loop.
+
+    Takes the same arguments, except that "error_codes" apply to aiohttp.ClientResponseError,
+    which is also what is retried by default when only "error_codes" are given.
+    """
+    errors, schedule = schedule_factory(intervals, errors, error_codes, budget, jitter, circuit_breaker,
+                                        describe=describe_aiohttp_error,
+                                        default_errors={aiohttp.ClientResponseError})
+
+    def decorate(func):
+        name = getattr(func, '__qualname__', repr(func))
+
+        @functools.wraps(func)
+        async def call(*args, **kwargs):
+            attempts = schedule(name)
+            while True:
+                try:
+                    result = await func(*args, **kwargs)
+                except errors as e:
+                    wait = attempts.backoff(e)
+                    if wait is None:
+                        raise
+                    await asyncio.sleep(wait)
+                else:
+                    attempts.succeeded()
+                    return result
+        return call
+    return decorate
+
+
+def client_session(pool_size: int = POOL_SIZE, **kwargs) -> aiohttp.ClientSession:
+    """
+    An aiohttp.ClientSession with the same defaults as test.infra.sessions.PooledSession.
+
+    ``pool_size`` limits the connections per host.  Must be called from a coroutine.
+    """
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=pool_size)
+    timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, **kwargs)
@@ -0,0 +1,114 @@
+import base64
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+import jwt
+
+from test.infra.sessions import get_session
+
+logger = logging.getLogger(__name__)
+
+# Refresh tokens this many seconds before they actually expire
+REFRESH_MARGIN = 300
+
+
+class AccessTokenCache:
+
+    """Cache a bearer token until shortly before it expires
+
+    :param fetch: Called to mint a new token; returns a ``(token, expires_at)`` tuple, where
+        ``expires_at`` is a UNIX timestamp.
+    :param refresh_margin: Seconds before ``expires_at`` at which the token is refreshed.
+
+    Only one thread refreshes at a time; threads that race for an expired token wait for
+    that refresh instead of minting tokens of their own.
+    """
+
+    def __init__(self, fetch: Callable[[], Tuple[str, float]], refresh_margin: float = REFRESH_MARGIN):
+        self._fetch = fetch
+        self._refresh_margin = refresh_margin
+        # The token and its expiry, replaced as one so that readers never see half of a refresh
+        self._cached: Optional[Tuple[str, float]] = None
+        self._lock = threading.Lock()
+
+    def _fresh(self, cached: Optional[Tuple[str, float]]) -> bool:
+        return cached is not None and time.time() < cached[1] - self._refresh_margin
+
+    def get(self) -> str:
+        cached = self._cached
+        if not self._fresh(cached):
+            with self._lock:
+                # Another thread may have refreshed while we were waiting for the lock
+                cached = self._cached
+                if not self._fresh(cached):
+                    cached = self._cached = self._fetch()
+                    logger.debug('Refreshed access token, valid for %.0f s', cached[1] - time.time())
+        return cached[0]
+
+    def invalidate(self, token: Optional[str] = None):
+        """
+        Drop the cached token, e.g. after a 401, so that the next call mints a new one.
+
+        :param token: Only drop the cached token if it is still this one, the one that was refused.
+            Callers that were refused the same token at once then cause a single refresh.
+        """
+        with self._lock:
+            if token is None or (self._cached is not None and self._cached[0] == token):
+                self._cached = None
+
+    def headers(self, headers: Optional[dict] = None) -> dict:
+        """Return a copy of ``headers`` with a ready ``Authorization`` header added."""
+        return {**(headers or {}), 'Authorization': f'Bearer {self.get()}'}
+
+
+class Gen3Credentials:
+
+    """Exchange a Gen3 API key for access tokens, reusing each token until near its expiry
+
+    :param encoded_api_key: The base64 encoded API key; defaults to the GEN3_API_KEY environment variable.
+
+    The API key is decoded once, on first use, and the minted access token is shared by
+    every caller until shortly before its ``exp`` claim.
+    """
+
+    def __init__(self, encoded_api_key: Optional[str] = None):
+        self._encoded_api_key = encoded_api_key
+        self._api_key: Optional[str] = None
+        self._hostname: Optional[str] = None
+        self._decode_lock = threading.Lock()
+        self._token = AccessTokenCache(self._mint)
+
+    def _decode(self):
+        with self._decode_lock:
+            if self._api_key is None:
+                encoded = self._encoded_api_key or os.environ['GEN3_API_KEY']
+                api_key = base64.decodebytes(encoded.encode('utf-8')).decode('utf-8')
+                decoded_api_key = jwt.decode(api_key, verify=False)
+                self._hostname = decoded_api_key['iss'].replace('/user', '')
+                self._api_key = api_key
+
+    @property
+    def hostname(self) -> str:
+        """The Gen3 commons that issued the API key, e.g. "https://staging.gen3.biodatacatalyst.nhlbi.nih.gov"."""
+        if self._api_key is None:
+            self._decode()
+        return self._hostname
+
+    def _mint(self) -> Tuple[str, float]:
+        endpoint = f'{self.hostname}/user/credentials/api/access_token'
+        resp = get_session(endpoint).post(endpoint, data={"api_key": self._api_key, "Content-Type": "application/json"})
+        resp.raise_for_status()
+        access_token = resp.json()['access_token']
+        return access_token, jwt.decode(access_token, verify=False)['exp']
+
+    def access_token(self) -> str:
+        return self._token.get()
+
+    def invalidate(self):
+        self._token.invalidate()
+
+    def headers(self, headers: Optional[dict] = None) -> dict:
+        return self._token.headers(headers)
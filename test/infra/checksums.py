@@ -0,0 +1,161 @@
+"""
+Compute several checksums of a local file or a remote object in one streaming pass.
+
+Local files are read through mmap.  Remote objects (e.g. signed URLs from Gen3) are read
+with concurrent HTTP range requests that are fed to the hashes in order, so at most
+``workers`` chunks are held in memory whatever the object's size.
+
+Digests are lowercase hex strings, the format indexd records them in.  "crc32c" is the
+Castagnoli CRC that GCS uses and "crc" the zlib CRC-32 that indexd calls crc.
+"""
+import hashlib
+import mmap
+import re
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+import google_crc32c
+from requests.exceptions import ConnectionError, HTTPError
+
+from test.infra.retry import retry
+from test.infra.sessions import get_session
+
+CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_ALGORITHMS = ('md5', 'crc32c')
+HASHLIB_ALGORITHMS = ('md5', 'sha1', 'sha256', 'sha512')
+
+
+class _CRC32:
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self) -> str:
+        return f'{self.value:08x}'
+
+
+class _CRC32C:
+    def __init__(self):
+        self.checksum = google_crc32c.Checksum()
+
+    def update(self, data):
+        self.checksum.update(data)
+
+    def hexdigest(self) -> str:
+        return self.checksum.digest().hex()
+
+
+class MultiHasher:
+
+    """Feed data to several hashes at once
+
+    :param algorithms: Any of "md5", "sha1", "sha256", "sha512", "crc32c" and "crc".
+    """
+
+    def __init__(self, algorithms: Iterable[str] = DEFAULT_ALGORITHMS):
+        self.hashes = {}
+        for algorithm in algorithms:
+            if algorithm in HASHLIB_ALGORITHMS:
+                self.hashes[algorithm] = hashlib.new(algorithm)
+            elif algorithm == 'crc32c':
+                self.hashes[algorithm] = _CRC32C()
+            elif algorithm == 'crc':
+                self.hashes[algorithm] = _CRC32()
+            else:
+                raise ValueError(f'Unsupported checksum algorithm: {algorithm!r}')
+        self.size = 0
+
+    def update(self, data):
+        for h in self.hashes.values():
+            h.update(data)
+        self.size += len(data)
+
+    def hexdigests(self) -> Dict[str, str]:
+        return {algorithm: h.hexdigest() for algorithm, h in self.hashes.items()}
+
+
+def hash_file(path: str, algorithms: Iterable[str] = DEFAULT_ALGORITHMS, chunk_size: int = CHUNK_SIZE) -> Dict[str, str]:
+    """Checksums of a local file."""
+    hasher = MultiHasher(algorithms)
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            return hasher.hexdigests()
+        with mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, len(view), chunk_size):
+                    hasher.update(view[offset:offset + chunk_size])
+            finally:
+                view.release()
+    return hasher.hexdigests()
+
+
+@retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
+def _fetch_range(url: str, start: int, end: int, headers: dict) -> Tuple[bytes, Optional[int]]:
+    """Bytes ``start`` to ``end`` (inclusive) of ``url``, and the object's total size if the server says."""
+    resp = get_session(url).get(url, headers={**headers, 'Range': f'bytes={start}-{end}'})
+    if resp.status_code == 416 and start == 0 and resp.headers.get('Content-Range') == 'bytes */0':
+        # No range of an empty object can be satisfied
+        return b'', 0
+    resp.raise_for_status()
+    if resp.status_code != 206:
+        raise RuntimeError(f'Expected a partial response to a range request, got {resp.status_code} from {url}')
+    match = re.match(r'bytes \d+-\d+/(\d+)', resp.headers.get('Content-Range', ''))
+    return resp.content, int(match.group(1)) if match else None
+
+
+def hash_url(url: str,
+             algorithms: Iterable[str] = DEFAULT_ALGORITHMS,
+             size: Optional[int] = None,
+             headers: Optional[dict] = None,
+             chunk_size: int = CHUNK_SIZE,
+             workers: int = 8) -> Dict[str, str]:
+    """
+    Checksums of a remote object, read with up to ``workers`` concurrent range requests.
+
+    Server errors are retried per range, like every other request.
+
+    :param size: The object's size in bytes, if known; otherwise it's taken from the
+        Content-Range of the first response.
+    :param headers: Sent with every request, e.g. an Authorization header.
+    """
+    headers = headers or {}
+    hasher = MultiHasher(algorithms)
+    if size == 0:
+        return hasher.hexdigests()
+    first, total = _fetch_range(url, 0, chunk_size - 1, headers)
+    size = total if size is None else size
+    if size is None:
+        raise RuntimeError(f'The size of {url} is unknown')
+    hasher.update(first)
+
+    offsets = iter(range(len(first), size, chunk_size))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for offset in offsets:
+            pending.append(executor.submit(_fetch_range, url, offset, min(offset + chunk_size, size) - 1, headers))
+            if len(pending) >= workers:
+                break
+        while pending:
+            # Hash in order, while the next chunks download
+            data, _ = pending.popleft().result()
+            hasher.update(data)
+            for offset in offsets:
+                pending.append(executor.submit(_fetch_range, url, offset, min(offset + chunk_size, size) - 1, headers))
+                break
+    if hasher.size != size:
+        raise RuntimeError(f'Read {hasher.size} bytes from {url}, expected {size}')
+    return hasher.hexdigests()
+
+
+def compare(computed: Dict[str, str], expected: Dict[str, str]) -> Dict[str, bool]:
+    """Whether each checksum present in both matches, e.g. {"md5": True}."""
+    return {algorithm: computed[algorithm].lower() == expected[algorithm].lower()
+            for algorithm in computed if expected.get(algorithm)}
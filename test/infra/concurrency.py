@@ -0,0 +1,143 @@
+import io
+import itertools
+import sys
+import threading
+import unittest
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def bounded_imap(func: Callable[[T], R], items: Iterable[T], workers: int = 8) -> Iterator[R]:
+    """
+    Apply ``func`` to every item on a pool of ``workers`` threads, yielding results as they complete.
+
+    ``items`` is consumed lazily and at most ``2 * workers`` calls are in flight at once, so
+    arbitrarily long inputs (e.g. a stream of DRS URIs read from stdin) are never held in
+    memory.  Results are yielded in completion order, not input order.  An exception raised
+    by ``func`` is re-raised when its result is reached.
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for item in items:
+            pending.add(executor.submit(func, item))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+class _ThreadCapture:
+
+    """A stream that collects the writes of threads that are capturing, and passes on the rest"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def start(self):
+        self._local.buffer = io.StringIO()
+
+    def release(self):
+        """Stop capturing on this thread and write out what it captured."""
+        buffer, self._local.buffer = self._local.buffer, None
+        if buffer.tell():
+            self.stream.write(buffer.getvalue())
+            self.stream.flush()
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def writeln(self, text=''):
+        # Like unittest's stream decorator, which the result's stream is
+        self.write(text + '\n')
+
+    def flush(self):
+        if getattr(self._local, 'buffer', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class ConcurrentSuite(unittest.TestSuite):
+
+    """Run the test methods of each test class concurrently, on up to ``workers`` threads
+
+    Module and class fixtures are handled by unittest, as in a plain TestSuite: setUpClass
+    runs before any test of its class starts and tearDownClass after all of them have
+    finished, and a failing setUpClass or setUpModule is reported the usual way.  Classes
+    run one after the other.
+
+    Each test's output, i.e. its result line and what it prints to stdout or stderr, is
+    held back until the test finishes and then written out in one piece, so that the
+    output of concurrent tests doesn't interleave.
+    """
+
+    def __init__(self, tests, workers: int):
+        super().__init__()
+        self.addTests(self._flatten(tests))
+        self.workers = workers
+        self._output_lock = threading.Lock()
+
+    @classmethod
+    def _flatten(cls, tests):
+        for test in tests:
+            if isinstance(test, unittest.TestSuite):
+                yield from cls._flatten(test)
+            else:
+                yield test
+
+    def _run_test(self, test, result, streams):
+        for stream in streams:
+            stream.start()
+        try:
+            test(result)
+        finally:
+            with self._output_lock:
+                for stream in streams:
+                    stream.release()
+
+    def run(self, result, debug=False):
+        top_level = getattr(result, '_testRunEntered', False) is False
+        if top_level:
+            result._testRunEntered = True
+        streams = [_ThreadCapture(sys.stdout), _ThreadCapture(sys.stderr)]
+        saved = sys.stdout, sys.stderr, getattr(result, 'stream', None)
+        sys.stdout, sys.stderr = streams
+        if saved[2] is not None:
+            result.stream = _ThreadCapture(saved[2])
+            streams.append(result.stream)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                # unittest's loaders keep the tests of a class together
+                for test_class, tests in itertools.groupby(self, type):
+                    if result.shouldStop:
+                        break
+                    tests = list(tests)
+                    # The same fixture handling as TestSuite.run, once per class instead of per test
+                    self._tearDownPreviousClass(tests[0], result)
+                    self._handleModuleFixture(tests[0], result)
+                    self._handleClassSetUp(tests[0], result)
+                    result._previousTestClass = test_class
+                    if getattr(test_class, '_classSetupFailed', False) or getattr(result, '_moduleSetUpFailed', False):
+                        continue
+                    for future in [executor.submit(self._run_test, test, result, streams) for test in tests]:
+                        future.result()
+            if top_level:
+                self._tearDownPreviousClass(None, result)
+                self._handleModuleTearDown(result)
+                result._testRunEntered = False
+        finally:
+            sys.stdout, sys.stderr = saved[:2]
+            if saved[2] is not None:
+                result.stream = saved[2]
+        return result
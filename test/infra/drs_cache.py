@@ -0,0 +1,140 @@
+"""
+An on-disk cache of the signed URLs that Gen3 (fence) resolves DRS GUIDs to.
+
+Resolving a GUID is a round trip to fence on every read of a DRS object, yet the signed URL it
+returns stays valid until its expiry, typically an hour.  Cached URLs are reused until
+``margin`` seconds before they expire, and only for the account that fence granted them to:
+
+    cache = SignedURLCache('drs_cache.sqlite')
+    identity = fingerprint(account)
+    url = cache.get(GEN3_DOMAIN, identity, guid)
+    if url is None:
+        url = resolve(guid, token)
+        cache.put(GEN3_DOMAIN, identity, guid, url)
+
+A cached URL skips fence's access check, so tests of access control mustn't read from the cache.
+
+The expiry is read from the URL itself: "Expires=" (V2 signatures, which fence issues) or
+"X-Goog-Date" plus "X-Goog-Expires" (V4).  URLs without either are not cached.  The cache is
+a SQLite database, so it can be shared by several processes, e.g. parallel test shards.
+"""
+import calendar
+import hashlib
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from urllib.parse import parse_qs, urlsplit
+
+log = logging.getLogger(__name__)
+
+# Versioned rather than migrated: the entries of an older schema (signed_urls, from before entries
+# were keyed by identity) are left where they are, for whichever version of this module wrote them
+TABLE = 'signed_urls_v2'
+
+
+def expires_at(url: str) -> Optional[float]:
+    """
+    When a signed URL expires, as a unix timestamp, or None if it doesn't say.
+
+    >>> expires_at('https://storage.googleapis.com/b/o?GoogleAccessId=x&Expires=1607381713&Signature=y')
+    1607381713.0
+    >>> expires_at('https://storage.googleapis.com/b/o?X-Goog-Date=20201207T220000Z&X-Goog-Expires=3600')
+    1607382000.0
+    >>> expires_at('https://storage.googleapis.com/b/o') is None
+    True
+    """
+    query = parse_qs(urlsplit(url).query)
+    try:
+        if 'Expires' in query:
+            return float(query['Expires'][0])
+        if 'X-Goog-Date' in query and 'X-Goog-Expires' in query:
+            signed = time.strptime(query['X-Goog-Date'][0], '%Y%m%dT%H%M%SZ')
+            return float(calendar.timegm(signed) + int(query['X-Goog-Expires'][0]))
+    except ValueError:
+        log.warning('Could not parse the expiry of a signed URL: %s', url)
+    return None
+
+
+def fingerprint(credential: str) -> str:
+    """
+    Tell accounts or credentials apart without storing them.
+
+    >>> fingerprint('token')
+    '3c469e9d6c5875d3'
+    """
+    return hashlib.sha256(credential.encode()).hexdigest()[:16]
+
+
+class SignedURLCache:
+
+    """Signed URLs by Gen3 domain, identity and GUID; safe to share between processes
+
+    The identity is a fingerprint() of the account the URL was resolved for, so that a URL fence
+    granted to one user is never handed to another.
+
+    :param path: The SQLite database, created if it doesn't exist.
+    :param margin: Seconds before its expiry that a URL is no longer handed out, leaving the
+        caller time to use it.
+    """
+
+    def __init__(self, path: str = 'drs_cache.sqlite', margin: float = 5 * 60):
+        self.path = path
+        self.margin = margin
+        self.hits = self.misses = 0
+        with self._connect() as conn:
+            # WAL lets readers in other processes carry on while one process writes
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {TABLE} '
+                         '(domain TEXT NOT NULL, identity TEXT NOT NULL, guid TEXT NOT NULL, url TEXT NOT NULL, '
+                         'expires REAL NOT NULL, PRIMARY KEY (domain, identity, guid))')
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # A connection per call keeps this usable from several threads and processes
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:  # commits, or rolls back on error
+                yield conn
+        finally:
+            conn.close()
+
+    def get_entry(self, domain: str, identity: str, guid: str) -> Optional[dict]:
+        """The cached "url" and "expires" of a GUID, unless missing or about to expire."""
+        with self._connect() as conn:
+            row = conn.execute(f'SELECT url, expires FROM {TABLE} '
+                               'WHERE domain = ? AND identity = ? AND guid = ? AND expires > ?',
+                               (domain, identity, guid, time.time() + self.margin)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        url, expires = row
+        return dict(url=url, expires=expires)
+
+    def get(self, domain: str, identity: str, guid: str) -> Optional[str]:
+        entry = self.get_entry(domain, identity, guid)
+        return entry['url'] if entry else None
+
+    def put(self, domain: str, identity: str, guid: str, url: str) -> bool:
+        """Cache a signed URL, returning whether it was (it isn't if its expiry is unknown or too close)."""
+        expires = expires_at(url)
+        if expires is None or expires <= time.time() + self.margin:
+            return False
+        with self._connect() as conn:
+            conn.execute(f'INSERT OR REPLACE INTO {TABLE} (domain, identity, guid, url, expires) '
+                         'VALUES (?, ?, ?, ?, ?)',
+                         (domain, identity, guid, url, expires))
+        return True
+
+    def invalidate(self, domain: str, identity: str, guid: str):
+        """Forget a GUID's URL, e.g. one that storage rejected before its expiry."""
+        with self._connect() as conn:
+            conn.execute(f'DELETE FROM {TABLE} WHERE domain = ? AND identity = ? AND guid = ?',
+                         (domain, identity, guid))
+
+    def purge(self) -> int:
+        """Delete expired entries, returning how many there were."""
+        with self._connect() as conn:
+            return conn.execute(f'DELETE FROM {TABLE} WHERE expires <= ?', (time.time(),)).rowcount
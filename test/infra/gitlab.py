@@ -0,0 +1,351 @@
+"""
+Wait for GitLab pipelines to finish, notified by pipeline webhooks, with polling as the fallback.
+
+A PipelineListener is a small HTTP server that GitLab posts pipeline events to.  Waiting on it
+costs no requests to the GitLab API; the API is only polled, every ``fallback`` seconds, in case
+a webhook was missed or never configured:
+
+    with PipelineListener(port=8099, secret=os.environ['GITLAB_WEBHOOK_SECRET']).start() as listener:
+        status = wait_for_pipeline(host, project, pipeline, token, listener=listener)
+
+The webhook is configured in the project's Settings > Webhooks, with the "Pipeline events"
+trigger, the URL of the listener and the same secret token.  A listener only accepts
+connections from the local host, e.g. behind a reverse proxy, unless given another ``host``.
+
+watch_pipelines() waits for any number of pipelines from one event loop, e.g. to notify
+about each one as it finishes.  wait_for_pipelines() waits for many pipelines from one polling
+loop, which refreshes all of them in one concurrent round per poll.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+import requests
+
+from test.infra.aio import async_retry, client_session
+from test.infra.concurrency import bounded_imap
+from test.infra.poll import Poller
+from test.infra.retry import retry
+from test.infra.sessions import configure, get_session
+
+log = logging.getLogger(__name__)
+
+# Every other status (success, failed, canceled, skipped, manual, scheduled) is final
+ACTIVE_STATUSES = frozenset({'created', 'waiting_for_resource', 'preparing', 'pending', 'running'})
+SERVER_ERRORS = {500, 502, 503, 504}
+
+# (host, project, pipeline)
+Pipeline = Tuple[str, int, str]
+
+
+class PipelineListener(ThreadingHTTPServer):
+
+    """Receives GitLab pipeline webhooks and keeps the latest status of every pipeline
+
+    :param port: Port to listen on, or 0 for any free port.
+    :param host: Address to listen on, e.g. "0.0.0.0" to accept webhooks from any host.
+    :param secret: The webhook's secret token; requests without it in X-Gitlab-Token are refused.
+        Required, since anyone who can reach the listener could otherwise report a pipeline's status.
+    :param on_final: Called with the webhook event of every pipeline that reaches a final status,
+        from the thread that received it.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, host: str = '127.0.0.1', secret: Optional[str] = None,
+                 on_final: Optional[Callable[[dict], None]] = None):
+        if not secret:
+            raise ValueError('A PipelineListener needs the secret token of the webhook')
+        super().__init__((host, port), _WebhookHandler)
+        self.secret = secret
+        self.on_final = on_final
+        self.statuses: Dict[str, str] = {}
+        self.events = 0
+        self._changed = threading.Condition()
+        self._waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = {}
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def start(self) -> 'PipelineListener':
+        threading.Thread(target=self.serve_forever, name='pipeline-listener', daemon=True).start()
+        log.info('Listening for GitLab pipeline webhooks on %s', self.url)
+        return self
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> 'PipelineListener':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, pipeline, status: str):
+        pipeline = str(pipeline)
+        with self._changed:
+            self.statuses[pipeline] = status
+            self.events += 1
+            self._changed.notify_all()
+            waiters = self._waiters.pop(pipeline, []) if status not in ACTIVE_STATUSES else []
+        log.info('Pipeline %s is %s', pipeline, status)
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(status))
+
+    def wait(self, pipeline, timeout: float) -> Optional[str]:
+        """The final status of a pipeline, as soon as a webhook reports it, or None after ``timeout`` seconds."""
+        pipeline = str(pipeline)
+        with self._changed:
+            self._changed.wait_for(lambda: self.statuses.get(pipeline, 'created') not in ACTIVE_STATUSES, timeout)
+            status = self.statuses.get(pipeline)
+        return status if status is not None and status not in ACTIVE_STATUSES else None
+
+    def wait_for_event(self, seen: int, timeout: float) -> bool:
+        """Wait for a webhook after the ``seen``-th, returning whether one came within ``timeout`` seconds."""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.events != seen, timeout)
+
+    def final_status(self, pipeline) -> Optional[str]:
+        status = self.statuses.get(str(pipeline))
+        return status if status is not None and status not in ACTIVE_STATUSES else None
+
+    async def wait_async(self, pipeline, timeout: float) -> Optional[str]:
+        """Like wait(), without blocking the event loop or a thread."""
+        pipeline = str(pipeline)
+        future = asyncio.get_running_loop().create_future()
+        with self._changed:
+            status = self.statuses.get(pipeline)
+            if status is not None and status not in ACTIVE_STATUSES:
+                return status
+            waiter = (asyncio.get_running_loop(), future)
+            self._waiters.setdefault(pipeline, []).append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._changed:
+                if waiter in self._waiters.get(pipeline, []):
+                    self._waiters[pipeline].remove(waiter)
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+
+    server: PipelineListener
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if not hmac.compare_digest(self.headers.get('X-Gitlab-Token', '').encode(), self.server.secret.encode()):
+            log.warning('Refused a webhook from %s without the secret token', self.client_address[0])
+            return self._send(401)
+        try:
+            event = json.loads(body)
+        except ValueError:
+            return self._send(400)
+        self._send(200)
+        if event.get('object_kind') == 'pipeline':
+            attributes = event.get('object_attributes', {})
+            self.server.record(attributes['id'], attributes['status'])
+            if self.server.on_final is not None and attributes['status'] not in ACTIVE_STATUSES:
+                try:
+                    self.server.on_final(event)
+                except Exception:
+                    log.exception('Handling the webhook of pipeline %s failed', attributes['id'])
+
+
+def pipeline_url(host: str, project: int, pipeline) -> str:
+    return f'{host}/api/v4/projects/{project}/pipelines/{pipeline}'
+
+
+@retry(error_codes=SERVER_ERRORS, errors={requests.exceptions.HTTPError, requests.exceptions.ConnectionError})
+def get_status(host: str, project: int, pipeline, token: str) -> str:
+    url = pipeline_url(host, project, pipeline)
+    response = get_session(url).get(url, headers={'PRIVATE-TOKEN': token})
+    response.raise_for_status()
+    return response.json()['status']
+
+
+@async_retry(error_codes=SERVER_ERRORS,
+             errors={aiohttp.ClientResponseError, aiohttp.ClientConnectionError, asyncio.TimeoutError})
+async def get_pipeline_async(session: aiohttp.ClientSession, host: str, project: int, pipeline, token: str) -> dict:
+    """A pipeline as the API describes it, e.g. its "status", "web_url" and the "user" who started it."""
+    async with session.get(pipeline_url(host, project, pipeline), headers={'PRIVATE-TOKEN': token}) as response:
+        response.raise_for_status()
+        return await response.json(content_type=None)
+
+
+async def get_status_async(session: aiohttp.ClientSession, host: str, project: int, pipeline, token: str) -> str:
+    return (await get_pipeline_async(session, host, project, pipeline, token))['status']
+
+
+def trigger_pipeline(host: str, project: int, ref: str, trigger_token: str,
+                     variables: Optional[Dict[str, str]] = None) -> dict:
+    """
+    Start a pipeline of ``ref`` with a trigger token, returning the new pipeline, with its "id" and "web_url".
+
+    Not retried: a trigger that failed on the server's side may still have started a pipeline.
+    """
+    url = f'{host}/api/v4/projects/{project}/trigger/pipeline'
+    data = {'token': trigger_token, 'ref': ref}
+    data.update({f'variables[{name}]': value for name, value in (variables or {}).items()})
+    response = get_session(url).post(url, data=data)
+    response.raise_for_status()
+    return response.json()
+
+
+def wait_for_pipelines(pipelines: Iterable[Pipeline], token: str,
+                       listener: Optional[PipelineListener] = None,
+                       fallback: float = 120,
+                       workers: int = 8,
+                       on_change: Optional[Callable[[Dict[Pipeline, str]], None]] = None) -> Dict[Pipeline, str]:
+    """
+    The final status of every pipeline, from one polling loop.
+
+    Each poll refreshes every pipeline that is still running in one concurrent round, on the
+    pooled session of each host; the interval backs off while no status changes.  With a
+    ``listener``, a webhook ends the wait between rounds, and the API is only polled every
+    ``fallback`` seconds.  A pipeline whose status can't be fetched keeps its last known
+    status until the next round.
+
+    :param on_change: Called with the statuses of all pipelines whenever any of them changes.
+    """
+    statuses: Dict[Pipeline, str] = {pipeline: 'created' for pipeline in pipelines}
+    for host in {host for host, _, _ in statuses}:
+        configure(host, pool_size=workers)
+    reported: Dict[Pipeline, str] = {}
+
+    def fetch(pipeline: Pipeline) -> Tuple[Pipeline, str]:
+        try:
+            return pipeline, get_status(*pipeline, token)
+        except Exception as e:
+            log.warning('Could not get the status of pipeline %s: %s', pipeline[2], e)
+            return pipeline, statuses[pipeline]
+
+    def refresh(poll: bool = True) -> Dict[Pipeline, str]:
+        running = [pipeline for pipeline, status in statuses.items() if status in ACTIVE_STATUSES]
+        if listener is not None:
+            for pipeline in running:
+                statuses[pipeline] = listener.final_status(pipeline[2]) or statuses[pipeline]
+            running = [pipeline for pipeline in running if statuses[pipeline] in ACTIVE_STATUSES]
+        if poll:
+            statuses.update(bounded_imap(fetch, running, workers=workers))
+        if on_change is not None and statuses != reported:
+            on_change(dict(statuses))
+            reported.update(statuses)
+        return statuses
+
+    def done(statuses: Dict[Pipeline, str]) -> bool:
+        return all(status not in ACTIVE_STATUSES for status in statuses.values())
+
+    if listener is None:
+        poller = Poller(timeout=None, initial=2, maximum=30)
+        poller.wait(refresh, done=done, state=lambda statuses: repr(sorted(statuses.values())))
+        return statuses
+
+    while True:
+        # Read before refreshing, so that a webhook arriving during the refresh isn't missed
+        seen = listener.events
+        if done(refresh()):
+            return statuses
+        # Until a webhook arrives, or it's time to poll in case one was missed
+        while listener.wait_for_event(seen, timeout=fallback):
+            seen = listener.events
+            if done(refresh(poll=False)):
+                return statuses
+
+
+def wait_for_pipeline(host: str, project: int, pipeline, token: str,
+                      listener: Optional[PipelineListener] = None,
+                      fallback: float = 120,
+                      on_poll: Optional[Callable[[str, float], None]] = None) -> str:
+    """
+    The final status of a pipeline.
+
+    With a ``listener``, returns as soon as a webhook reports a final status, and polls the API
+    only every ``fallback`` seconds.  Without one, polls with an adaptive Poller.
+
+    :param on_poll: Called with each non-final status and the seconds until the next check.
+    """
+    if listener is None:
+        poller = Poller(timeout=None, initial=2, maximum=30)
+        return poller.wait(lambda: get_status(host, project, pipeline, token),
+                           done=lambda status: status not in ACTIVE_STATUSES,
+                           on_poll=on_poll)
+    while True:
+        status = get_status(host, project, pipeline, token)
+        if status not in ACTIVE_STATUSES:
+            return status
+        if on_poll is not None:
+            on_poll(status, fallback)
+        status = listener.wait(pipeline, timeout=fallback)
+        if status is not None:
+            return status
+
+
+async def wait_for_pipeline_async(session: aiohttp.ClientSession, host: str, project: int, pipeline, token: str,
+                                  listener: Optional[PipelineListener] = None,
+                                  fallback: float = 120) -> str:
+    """wait_for_pipeline() as a coroutine, so that one event loop can wait for many pipelines."""
+    details = await _wait_for_pipeline_async(session, host, project, pipeline, token, listener, fallback)
+    return details['status']
+
+
+async def _wait_for_pipeline_async(session: aiohttp.ClientSession, host: str, project: int, pipeline, token: str,
+                                   listener: Optional[PipelineListener], fallback: float) -> dict:
+    # The pipeline as last fetched from the API, with the final status, which a webhook may have reported since
+    if listener is None:
+        poller = Poller(timeout=None, initial=2, maximum=30)
+        return await poller.wait_async(lambda: get_pipeline_async(session, host, project, pipeline, token),
+                                       done=lambda details: details['status'] not in ACTIVE_STATUSES,
+                                       state=lambda details: details['status'])
+    while True:
+        details = await get_pipeline_async(session, host, project, pipeline, token)
+        if details['status'] not in ACTIVE_STATUSES:
+            return details
+        status = await listener.wait_async(pipeline, timeout=fallback)
+        if status is not None:
+            return {**details, 'status': status}
+
+
+async def watch_pipelines(pipelines: Iterable[Pipeline], token: str,
+                          on_done: Callable[[Pipeline, dict], Awaitable[None]],
+                          listener: Optional[PipelineListener] = None,
+                          fallback: float = 120) -> Dict[Pipeline, str]:
+    """
+    Wait for every pipeline from one event loop, calling ``on_done`` as each one finishes.
+
+    ``on_done`` is given the pipeline as fetched while waiting (see get_pipeline_async()),
+    with its final "status".  A pipeline whose status can't be determined, or whose
+    ``on_done`` fails, is logged and reported with the status "error"; the others are unaffected.
+    :return: The final status of every pipeline.
+    """
+    async with client_session() as session:
+        async def watch(pipeline: Pipeline) -> Tuple[Pipeline, str]:
+            host, project, pipeline_id = pipeline
+            try:
+                details = await _wait_for_pipeline_async(session, host, project, pipeline_id, token,
+                                                         listener=listener, fallback=fallback)
+                status = details['status']
+                await on_done(pipeline, details)
+            except Exception:
+                log.exception('Could not wait for pipeline %s of project %s on %s', pipeline_id, project, host)
+                status = 'error'
+            return pipeline, status
+
+        return dict(await asyncio.gather(*[watch(pipeline) for pipeline in pipelines]))
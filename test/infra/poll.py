@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, Generic, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class Poller(Generic[T]):
+
+    """Call a function until its result is in a terminal state, backing off between calls
+
+    Polling starts every ``initial`` seconds and slows down by ``factor`` after each call, up
+    to every ``maximum`` seconds.  Whenever the observed state changes the interval drops back
+    to ``initial``, because a transition suggests that the next one may follow soon.  Each
+    interval is randomized by +/- ``jitter`` (a fraction) so that concurrent pollers spread out.
+
+    :param timeout: Seconds after which wait() raises a TimeoutError, or None to wait forever.
+
+    After wait() returns, ``dwell_times`` maps every observed state to the number of seconds
+    it was observed for, and ``polls`` is the number of calls that were made.
+    """
+
+    def __init__(self,
+                 timeout: Optional[float],
+                 initial: float = 1.0,
+                 maximum: float = 30.0,
+                 factor: float = 1.5,
+                 jitter: float = 0.1):
+        self.timeout = timeout
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.dwell_times: Dict[str, float] = {}
+        self.polls = 0
+
+    def _jittered(self, interval: float) -> float:
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _start(self):
+        self._started = time.monotonic()
+        self._deadline = None if self.timeout is None else self._started + self.timeout
+        self._interval = self.initial
+        self._previous_state, self._previous_time = None, self._started
+        self.dwell_times = {}
+        self.polls = 0
+
+    def _observe(self,
+                 result: T,
+                 done: Callable[[T], bool],
+                 state: Callable[[T], str],
+                 on_poll: Optional[Callable[[T, float], None]]) -> Optional[float]:
+        """Account for one result; return the seconds to wait before the next check, or None if it is terminal."""
+        self.polls += 1
+        now = time.monotonic()
+        current_state = state(result)
+        if self._previous_state is not None:
+            dwell = now - self._previous_time
+            self.dwell_times[self._previous_state] = self.dwell_times.get(self._previous_state, 0.0) + dwell
+        self.dwell_times.setdefault(current_state, 0.0)
+        if current_state != self._previous_state:
+            self._interval = self.initial
+        self._previous_state, self._previous_time = current_state, now
+
+        if done(result):
+            return None
+        if self._deadline is not None and now >= self._deadline:
+            raise TimeoutError(f'Still {current_state!r} after {now - self._started:.0f}s: {result!r}')
+
+        wait = self._jittered(self._interval)
+        if self._deadline is not None:
+            wait = min(wait, self._deadline - now)
+        if on_poll is not None:
+            on_poll(result, wait)
+        self._interval = min(self._interval * self.factor, self.maximum)
+        return wait
+
+    def wait(self,
+             check: Callable[[], T],
+             done: Callable[[T], bool],
+             state: Callable[[T], str] = str,
+             on_poll: Optional[Callable[[T, float], None]] = None) -> T:
+        """
+        :param check: Fetches the current result, e.g. a job's status.
+        :param done: Returns True if a result is terminal.
+        :param state: Names the state of a result, for dwell time reporting and backoff resets.
+        :param on_poll: Called with each non-terminal result and the seconds until the next check.
+        :return: The first terminal result.
+        :raises TimeoutError: No terminal result before the timeout.
+        """
+        self._start()
+        while True:
+            result = check()
+            wait = self._observe(result, done, state, on_poll)
+            if wait is None:
+                return result
+            time.sleep(wait)
+
+    async def wait_async(self,
+                         check: Callable[[], Awaitable[T]],
+                         done: Callable[[T], bool],
+                         state: Callable[[T], str] = str,
+                         on_poll: Optional[Callable[[T, float], None]] = None) -> T:
+        """Like wait(), for a coroutine function ``check``; sleeps without blocking the event loop."""
+        self._start()
+        while True:
+            result = await check()
+            wait = self._observe(result, done, state, on_poll)
+            if wait is None:
+                return result
+            await asyncio.sleep(wait)
+
+    def dwell_report(self) -> str:
+        """One line per state, e.g. "Pending: 12.0s", for logging."""
+        return '\n'.join(f'{state}: {seconds:.1f}s' for state, seconds in self.dwell_times.items())
@@ -0,0 +1,311 @@
+import datetime
+import email.utils
+import functools
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, Mapping, NamedTuple, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVALS = (1, 1, 2, 4, 8)
+
+# Responses with these status codes may tell us when to come back
+RETRY_AFTER_CODES = {429, 503}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of retrying a request to a host that has been failing persistently."""
+
+
+class CircuitBreaker:
+
+    """Track consecutive server-side failures per host and stop retrying hosts that keep failing
+
+    After ``threshold`` failures with no success in between, each within ``cooldown``
+    seconds of the previous one, the circuit of a host opens: for the next
+    ``cooldown`` seconds, calls that fail against that host are not retried but raise
+    CircuitOpenError right away.  After the cooldown, retries are allowed again and the
+    first success closes the circuit, while another failure reopens it.  This keeps every
+    test in a run from spending its whole retry schedule on a service that is down.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures: Dict[str, int] = {}
+        self._last_failure: Dict[str, float] = {}
+        self._opened_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def is_open(self, host: str) -> bool:
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+            return opened_at is not None and time.monotonic() < opened_at + self.cooldown
+
+    def record_failure(self, host: str):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_failure.get(host, now) > self.cooldown:
+                # Isolated failures, far apart, don't add up
+                self._failures[host] = 0
+            self._last_failure[host] = now
+            self._failures[host] = self._failures.get(host, 0) + 1
+            if self._failures[host] >= self.threshold:
+                if host not in self._opened_at:
+                    logger.warning('Opening the circuit for %s after %d consecutive failures',
+                                   host, self._failures[host])
+                self._opened_at[host] = now
+
+    def record_success(self, host: str):
+        with self._lock:
+            self._failures.pop(host, None)
+            if self._opened_at.pop(host, None) is not None:
+                logger.info('Closed the circuit for %s', host)
+
+    def reset(self):
+        with self._lock:
+            self._failures.clear()
+            self._last_failure.clear()
+            self._opened_at.clear()
+
+
+class RetryMetrics:
+
+    """Thread-safe counters of what the retry decorator did, per decorated function
+
+    Counted events are "calls", "retries", "exhausted" (gave up after the last interval),
+    "over_budget" (gave up because the time budget ran out), "circuit_open" (gave up
+    because the host's circuit was open) and "sleep_seconds".
+    """
+
+    def __init__(self):
+        self._counts: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str, event: str, amount: float = 1):
+        with self._lock:
+            self._counts.setdefault(name, Counter())[event] += amount
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._counts.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+breaker = CircuitBreaker()
+metrics = RetryMetrics()
+
+
+class Failure(NamedTuple):
+    """What the retry engine needs to know about an exception raised by a request"""
+    status_code: Optional[int]  # None for connection errors and timeouts
+    url: Optional[str]
+    headers: Mapping[str, str]
+
+
+def describe_requests_error(e: Exception) -> Optional[Failure]:
+    """Describe an exception from requests, or return None if ``e`` isn't from a request."""
+    if isinstance(e, HTTPError) and e.response is not None:
+        return Failure(e.response.status_code, e.response.url, e.response.headers)
+    elif isinstance(e, (ConnectionError, Timeout)):
+        return Failure(None, getattr(e.request, 'url', None), {})
+    return None
+
+
+def _failing_host(failure: Optional[Failure]) -> Optional[str]:
+    """The host a request failed against, if the failure suggests the host itself is in trouble."""
+    if failure is None or not failure.url or (failure.status_code is not None and failure.status_code < 500):
+        return None
+    return urlsplit(failure.url).netloc
+
+
+def retry_after(e: Exception, describe=describe_requests_error) -> Optional[float]:
+    """
+    Seconds to wait according to the Retry-After header of a 429 or 503, if any.
+
+    The header is either a number of seconds or an HTTP date.
+    """
+    failure = describe(e)
+    if failure is None or failure.status_code not in RETRY_AFTER_CODES:
+        return None
+    value = failure.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class Schedule:
+
+    """The retry state of a single call of a decorated function; see retry()
+
+    The sync and async decorators share this, and only differ in how they sleep.
+    """
+
+    def __init__(self,
+                 name: str,
+                 intervals: Tuple[float, ...],
+                 error_codes: Set[int],
+                 budget: Optional[float],
+                 jitter: bool,
+                 circuit_breaker: Optional[CircuitBreaker],
+                 describe: Callable[[Exception], Optional[Failure]]):
+        self.name = name
+        self.intervals = intervals
+        self.error_codes = error_codes
+        self.budget = budget
+        self.jitter = jitter
+        self.circuit_breaker = circuit_breaker
+        self.describe = describe
+        self.start = time.monotonic()
+        self.attempt = 0
+        self.failed_host: Optional[str] = None
+        metrics.count(name, 'calls')
+
+    def backoff(self, e: Exception) -> Optional[float]:
+        """
+        Seconds to wait before retrying after ``e``, or None if ``e`` should be raised instead.
+
+        :raises CircuitOpenError: The host that ``e`` came from keeps failing.
+        """
+        failure = self.describe(e)
+        if failure is not None and failure.status_code is not None:
+            if self.error_codes and failure.status_code not in self.error_codes:
+                return None
+        self.failed_host = _failing_host(failure)
+        if self.failed_host and self.circuit_breaker:
+            self.circuit_breaker.record_failure(self.failed_host)
+        if self.attempt == len(self.intervals):
+            metrics.count(self.name, 'exhausted')
+            return None
+        if self.failed_host and self.circuit_breaker and self.circuit_breaker.is_open(self.failed_host):
+            metrics.count(self.name, 'circuit_open')
+            raise CircuitOpenError(f'Not retrying {self.name}, {self.failed_host} keeps failing') from e
+
+        interval = self.intervals[self.attempt]
+        interval = random.uniform(0, interval) if self.jitter else interval
+        interval = max(interval, retry_after(e, self.describe) or 0.0)
+        if self.budget is not None and time.monotonic() + interval - self.start > self.budget:
+            metrics.count(self.name, 'over_budget')
+            return None
+        logger.warning('Error in %s: %s. Retrying after %.1f s...', self.name, e, interval)
+        metrics.count(self.name, 'retries')
+        metrics.count(self.name, 'sleep_seconds', interval)
+        self.attempt += 1
+        return interval
+
+    def succeeded(self):
+        if self.failed_host and self.circuit_breaker:
+            self.circuit_breaker.record_success(self.failed_host)
+
+
+def schedule_factory(intervals: Optional[Iterable[float]],
+                     errors: Optional[Set],
+                     error_codes: Optional[Set],
+                     budget: Optional[float],
+                     jitter: bool,
+                     circuit_breaker: Optional[CircuitBreaker],
+                     describe: Callable[[Exception], Optional[Failure]],
+                     default_errors: Set) -> Tuple[tuple, Callable[[str], Schedule]]:
+    """Apply retry()'s defaults, returning the errors to catch and a factory for per-call schedules."""
+    intervals = tuple(DEFAULT_INTERVALS if intervals is None else intervals)
+    if error_codes is None:
+        error_codes = set()
+    if not error_codes and not errors:
+        errors = {Exception}
+    if error_codes and not errors:
+        errors = default_errors
+    return tuple(errors), functools.partial(Schedule,
+                                            intervals=intervals,
+                                            error_codes=error_codes,
+                                            budget=budget,
+                                            jitter=jitter,
+                                            circuit_breaker=circuit_breaker,
+                                            describe=describe)
+
+
+def retry(intervals: Optional[Iterable[float]] = None,
+          errors: Optional[Set] = None,
+          error_codes: Optional[Set] = None,
+          budget: Optional[float] = None,
+          jitter: bool = True,
+          circuit_breaker: Optional[CircuitBreaker] = breaker):
+    """
+    Retry a function if it fails with any Exception defined in the "errors" set, backing off
+    by "intervals" between attempts.  If "error_codes" are specified, retry on the HTTPError
+    return codes defined in "error_codes".
+
+    Cases to consider:
+
+        error_codes ={} && errors={}
+            Retry on any Exception.
+
+        error_codes ={500} && errors={}
+        error_codes ={500} && errors={HTTPError}
+            Retry only on HTTPErrors that return status_code 500.
+
+        error_codes ={} && errors={HTTPError}
+            Retry on all HTTPErrors regardless of error code.
+
+        error_codes ={} && errors={AssertionError}
+            Only retry on AssertionErrors.
+
+    Every call starts with the full schedule, whatever happened to earlier calls or other threads.
+
+    :param intervals: The maximum time in seconds to wait before each retry; the function is
+        attempted once more than there are intervals.  Defaults to 1s, 1s, 2s, 4s, 8s.
+
+    :param errors: Exceptions to catch and retry on.
+
+    :param error_codes: HTTPError return codes to retry on.  The default is an empty set.
+
+    :param budget: Give up once this many seconds have passed since the first attempt,
+        rather than sleep past them.  The default is no limit beyond the intervals.
+
+    :param jitter: Wait a random time between zero and each interval ("full jitter"), so that
+        clients that failed together don't all retry together.  A Retry-After header on a
+        429 or 503 response is honoured as the minimum wait either way.
+
+    :param circuit_breaker: Consulted before retrying a 5xx, connection error or timeout; see
+        CircuitBreaker.  Defaults to one shared by the whole process, None disables it.
+
+    :return: The result of the wrapped function or raise.
+    """
+    errors, schedule = schedule_factory(intervals, errors, error_codes, budget, jitter, circuit_breaker,
+                                        describe=describe_requests_error, default_errors={HTTPError})
+
+    def decorate(func):
+        name = getattr(func, '__qualname__', repr(func))
+
+        @functools.wraps(func)
+        def call(*args, **kwargs):
+            attempts = schedule(name)
+            while True:
+                try:
+                    result = func(*args, **kwargs)
+                except errors as e:
+                    wait = attempts.backoff(e)
+                    if wait is None:
+                        raise
+                    time.sleep(wait)
+                else:
+                    attempts.succeeded()
+                    return result
+        return call
+    return decorate
@@ -1,14 +1,23 @@
+import codecs
+import collections
+import heapq
+import json
 import logging
+import statistics
 import os
 import random
 import string
-import time
 from datetime import datetime, timezone
 from enum import Enum, unique
-from typing import Optional, List
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
 
 import requests
 
+from test.infra.concurrency import bounded_imap
+from test.infra.poll import Poller
+from test.infra.sessions import PooledSession
+from test.metrics import MetricsBackend
+
 logger = logging.getLogger(__name__)
 
 BROKER_URL = os.getenv('BDCAT_SB_BROKER_URL', 'https://qa-broker.sbgenomics.com')
@@ -24,6 +33,237 @@ class SBEnv(Enum):
     production = 'ffc'
 
 
+READY_STATES = {'SUCCESS', 'FAILURE', 'REVOKED'}
+
+
+class TestPlan(NamedTuple):
+
+    """A test plan, or a subset of its tests, to run in one SevenBridges environment"""
+
+    sb_environment: SBEnv
+    test_plan: str
+    subset: Optional[List[str]] = None
+
+
+class PlanResult(NamedTuple):
+
+    """The outcome of running a TestPlan
+
+    ``state`` is the final state of the test run task, "TIMEOUT" if it wasn't ready in time,
+    or "ERROR" if it couldn't be started or its report couldn't be fetched (see ``error``).
+    ``summary`` is what ingest_report() found in the report of a successful run.
+    """
+
+    plan: TestPlan
+    task_id: Optional[str]
+    state: str
+    failed_tests: List[str] = []
+    error: Optional[str] = None
+    summary: Optional['ReportSummary'] = None
+
+    @property
+    def passed(self) -> bool:
+        return self.state == 'SUCCESS' and not self.failed_tests
+
+
+class TestTiming(NamedTuple):
+
+    """How long one test of a test run took, if its result says"""
+
+    test: str
+    state: str
+    seconds: Optional[float]
+
+
+class ReportSummary(NamedTuple):
+
+    """What ingest_report() found in a test run report"""
+
+    task_id: str
+    states: Dict[str, int]
+    failed_tests: List[str]
+    total_seconds: float
+    slowest: List[TestTiming]
+
+
+def test_timing(result: dict) -> TestTiming:
+    duration = result.get('duration')
+    return TestTiming(result['id'], result['state'], None if duration is None else float(duration))
+
+
+def report_durations(report: dict) -> Dict[str, float]:
+    """The seconds that each test of a report took, for the tests whose results say"""
+    timings = (test_timing(result) for result in report['results'])
+    return {timing.test: timing.seconds for timing in timings if timing.seconds is not None}
+
+
+def iter_json_array(chunks: Iterable[bytes], key: str) -> Iterator:
+    """
+    Decode the items of the array ``key`` of a JSON object one at a time, as its bytes arrive.
+
+    Only the item being decoded is held in memory, however long the array.  ``key`` is a key
+    of the top-level object; the values before it are stepped over without decoding them, so
+    a nested "results" key or a "results" string doesn't match.
+
+    >>> list(iter_json_array([b'{"id": "t", "resu', b'lts": [{"id": 1}, ', b'{"id": 2}]}'], 'results'))
+    [{'id': 1}, {'id': 2}]
+    >>> list(iter_json_array([b'{"name": "results", "plan": {"results": [0]}, "results": [1, 2]}'], 'results'))
+    [1, 2]
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer, pos = '', 0
+
+    def more() -> bool:
+        # Read until the buffer grows: a chunk may be empty, or end inside a multi-byte character
+        nonlocal buffer, pos
+        while True:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return False
+            text = utf8.decode(chunk)
+            if text:
+                buffer = buffer[pos:] + text
+                pos = 0
+                return True
+
+    def peek() -> str:
+        # The next character that isn't whitespace, or '' at the end of the document
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not more():
+                return ''
+
+    def decode():
+        nonlocal pos
+        if buffer[pos] not in '{["':
+            # A number, true, false or null ends at the next delimiter, which may be in a later chunk
+            while not any(c in ',]} \t\r\n' for c in buffer[pos:]) and more():
+                pass
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The value is cut off; decode it again with the next chunk
+                if not more():
+                    raise
+                continue
+            pos = end
+            return item
+
+    def skip():
+        # Step over an object, array or string character by character, so it's never held in memory
+        nonlocal pos
+        if peek() not in ('{', '[', '"'):
+            decode()
+            return
+        depth, in_string, escaped = 0, False, False
+        while True:
+            if pos == len(buffer) and not more():
+                raise ValueError('The document ends in the middle of a value')
+            c = buffer[pos]
+            pos += 1
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif c == '\\':
+                    escaped = True
+                elif c == '"':
+                    in_string = False
+                    if depth == 0:
+                        return
+            elif c == '"':
+                in_string = True
+            elif c in '{[':
+                depth += 1
+            elif c in '}]':
+                depth -= 1
+                if depth == 0:
+                    return
+
+    # Find the array among the members of the top-level object
+    if peek() != '{':
+        raise ValueError('The document is not a JSON object')
+    pos += 1
+    while True:
+        c = peek()
+        if c == ',':
+            pos += 1
+            continue
+        if c != '"':
+            raise ValueError(f'No {key!r} array in the document')
+        name = decode()
+        if peek() != ':':
+            raise ValueError(f'Expected a ":" after the key {name!r}')
+        pos += 1
+        if name == key:
+            break
+        skip()
+    if peek() != '[':
+        raise ValueError(f'{key!r} is not an array')
+    pos += 1
+
+    while True:
+        c = peek()
+        if c == ',':
+            pos += 1
+            continue
+        if c == ']':
+            return
+        if not c:
+            raise ValueError(f'The document ends in the middle of the {key!r} array')
+        yield decode()
+
+
+def shard(test_ids: Iterable[str], shards: int, durations: Optional[Dict[str, float]] = None) -> List[List[str]]:
+    """
+    Split tests into at most ``shards`` subsets that take about as long as each other.
+
+    Tests are dealt out longest first, each to the shard with the least work so far (the LPT
+    heuristic, within 4/3 of the best possible split).  Tests without a known duration count
+    as the median known duration, or all equally if none is known.
+
+    >>> shard(['a', 'b', 'c', 'd'], 2, {'a': 10, 'b': 6, 'c': 5, 'd': 1})
+    [['a', 'd'], ['b', 'c']]
+    >>> shard(['a', 'b', 'c'], 2)
+    [['a', 'c'], ['b']]
+    """
+    test_ids = list(dict.fromkeys(test_ids))
+    durations = durations or {}
+    known = [durations[t] for t in test_ids if t in durations]
+    default = statistics.median(known) if known else 1.0
+    weighted = sorted(test_ids, key=lambda t: durations.get(t, default), reverse=True)
+
+    # (work so far, shard number), so that ties go to the lower numbered shard
+    loads = [(0.0, i) for i in range(min(shards, len(test_ids)))]
+    subsets: List[List[str]] = [[] for _ in loads]
+    for test_id in weighted:
+        work, i = heapq.heappop(loads)
+        subsets[i].append(test_id)
+        heapq.heappush(loads, (work + durations.get(test_id, default), i))
+    return subsets
+
+
+def merge_summaries(summaries: Iterable[ReportSummary], top: int = 10) -> dict:
+    """One report of the summaries of several test runs, e.g. of the shards of a test plan"""
+    merged: dict = {'task_ids': [], 'states': collections.Counter(), 'failed_tests': [], 'total_seconds': 0.0}
+    slowest: List[TestTiming] = []
+    for summary in summaries:
+        merged['task_ids'].append(summary.task_id)
+        merged['states'].update(summary.states)
+        merged['failed_tests'].extend(summary.failed_tests)
+        merged['total_seconds'] += summary.total_seconds
+        slowest.extend(summary.slowest)
+    merged['states'] = dict(merged['states'])
+    merged['slowest'] = [timing._asdict() for timing in heapq.nlargest(top, slowest, key=lambda t: t.seconds)]
+    return merged
+
+
 def new_task_id(sb_environment: SBEnv, new_task: dict) -> str:
     """Generate a unique task ID for test runs"""
     date = datetime.now(tz=timezone.utc)
@@ -57,7 +297,7 @@ class SevenBridgesBrokerClient:
             self._headers = {}
 
         self._base_url = base_url
-        self._session = requests.Session()
+        self._session = PooledSession()
 
     @staticmethod
     def _check_response(resp, *, expected_code):
@@ -98,6 +338,17 @@ class SevenBridgesBrokerClient:
 
         return resp.json()
 
+    def refresh(self, task_id: str) -> dict:
+        """The current data of a task
+
+        :raises requests.HTTPError: Test run state could not be refreshed.
+        """
+        resp = self.request('GET', f'/tasks/{task_id}')
+        self._check_response(resp, expected_code=200)
+        task = resp.json()
+        logger.info('Test run %s is %s', task_id, task['state'])
+        return task
+
     def wait_until_done(self, task: dict, timeout=1800, poll_frequency=15) -> dict:
         """Wait for a task to be in a READY state
 
@@ -105,36 +356,29 @@ class SevenBridgesBrokerClient:
 
         :param task: Task data.
         :param timeout: How many seconds to wait before raising a TimeoutError.
-        :param poll_frequency: How often (in seconds) to check task state while waiting.
+        :param poll_frequency: The longest time (in seconds) between checks of the task state
+            while waiting; checks start more often and back off to this.
         :raises TimeoutError: Not in a READY state after the given amount of time.
         :raises requests.HTTPError: Test run state could not be refreshed.
         :raises RuntimeError: Test run task is failed or revoked for some reason.
         """
         task_id = task['id']
-        ready_states = {'SUCCESS', 'FAILURE', 'REVOKED'}
-        start_time = time.monotonic()
         logger.info('Waiting for test run %s to complete', task_id)
 
-        while time.monotonic() - start_time < timeout:
-            # Refresh task state
-            resp = self.request('GET', f'/tasks/{task_id}')
-            self._check_response(resp, expected_code=200)
-            task = resp.json()
-            logger.info('Test run %s is %s', task_id, task['state'])
-
-            if task['state'] in ready_states:
-                if task['state'] == 'SUCCESS':
-                    logger.info('Test run report: %s',
-                                f'{self._base_url}/reports/{task_id}')
-                    return task
-
-                raise RuntimeError('Test run {} is {}: {}'.format(
-                    task_id, task['state'], repr(task)
-                ))
+        poller = Poller(timeout=timeout, initial=min(2, poll_frequency), maximum=poll_frequency)
+        task = poller.wait(lambda: self.refresh(task_id),
+                           done=lambda t: t['state'] in READY_STATES,
+                           state=lambda t: t['state'])
+        logger.info('Test run %s time spent per state:\n%s', task_id, poller.dwell_report())
 
-            time.sleep(poll_frequency)
+        if task['state'] == 'SUCCESS':
+            logger.info('Test run report: %s',
+                        f'{self._base_url}/reports/{task_id}')
+            return task
 
-        raise TimeoutError(f'Task not ready after {timeout}s: {repr(task)}')
+        raise RuntimeError('Test run {} is {}: {}'.format(
+            task_id, task['state'], repr(task)
+        ))
 
     def assert_all_tests_passed(self, task: dict):
         """Get the test run report and assert that all tests have passed
@@ -142,24 +386,254 @@ class SevenBridgesBrokerClient:
         :param task: Task data.
         :raises requests.HTTPError: Could not get test run report.
         """
-        task_id = task['id']
-        resp = self.request('GET', f'/reports/{task_id}')
+        assert len(self.failed_tests(task['id'], self.iter_report_results(task['id']))) == 0
+
+    def iter_report_results(self, task_id: str) -> Iterator[dict]:
+        """Stream the test results of a test run report, without holding the whole report in memory
+
+        :raises requests.HTTPError: Could not get test run report.
+        """
+        with self._session.get(self._base_url + f'/reports/{task_id}', headers=self._headers, stream=True) as resp:
+            self._check_response(resp, expected_code=200)
+            yield from iter_json_array(resp.iter_content(chunk_size=64 * 1024), 'results')
+
+    def get_report_by_id(self, task_id: str) -> dict:
+        return self.get_report({'id': task_id})
+
+    def get_report(self, task: dict) -> dict:
+        """Get the test run report of a task
+
+        :param task: Task data.
+        :raises requests.HTTPError: Could not get test run report.
+        """
+        resp = self.request('GET', f"/reports/{task['id']}")
         self._check_response(resp, expected_code=200)
-        report = resp.json()
+        return resp.json()
 
+    @staticmethod
+    def failed_tests(task_id: str, results: Iterable[dict]) -> List[str]:
+        """The IDs of the tests in a report's results that neither passed nor were skipped"""
         failed_tests = []
-        for test_result in report['results']:
+        for test_result in results:
             if test_result['state'] not in ('PASSED', 'SKIPPED'):
                 failed_tests.append(test_result['id'])
                 logger.info('[%s] Failed test: %s', task_id, test_result['id'])
-
-        assert len(failed_tests) == 0
+        return failed_tests
+
+    def run_test_plans(self, plans: List[TestPlan], timeout=1800, poll_frequency=15,
+                       workers=8, metrics: Optional[MetricsBackend] = None,
+                       table_id: Optional[str] = None) -> List[PlanResult]:
+        """Run several test plans at once, waiting for all of them from one polling loop
+
+        The test runs are started concurrently.  Each poll then refreshes every task that isn't
+        ready yet in one concurrent batch, and the polling interval backs off while no task
+        changes state.  Finally the reports of the successful runs are streamed concurrently,
+        each once, through ingest_report().
+
+        :param plans: Test plans or subsets, in any of the SevenBridges environments.
+        :param timeout: How many seconds to wait for all of the test runs together.
+        :param poll_frequency: The longest time (in seconds) between polls.
+        :param workers: Requests to the broker to make at once.
+        :param metrics: Where ingest_report() records every test's timing, to ``table_id``.
+        :return: The result of each plan, in the order of ``plans``; never raises for a failed plan.
+        """
+        self._session.resize(workers)
+        results: Dict[int, PlanResult] = {}
+        tasks: Dict[int, dict] = {}
+
+        def start(i):
+            plan = plans[i]
+            try:
+                return i, self.new_test_run(plan.sb_environment, plan.test_plan, subset=plan.subset), None
+            except Exception as e:
+                logger.warning('Could not start a test run of %s: %s', plan.test_plan, e)
+                return i, None, f'{type(e).__name__}: {e}'
+
+        for i, task, error in bounded_imap(start, range(len(plans)), workers=workers):
+            if task is None:
+                results[i] = PlanResult(plans[i], None, 'ERROR', error=error)
+            else:
+                tasks[i] = task
+
+        def refresh(i):
+            try:
+                return i, self.refresh(tasks[i]['id'])
+            except requests.RequestException as e:
+                # Keep the last known state, the next poll tries again
+                logger.warning('Could not refresh test run %s: %s', tasks[i]['id'], e)
+                return i, tasks[i]
+
+        def refresh_all():
+            pending = [i for i, task in tasks.items() if task['state'] not in READY_STATES]
+            tasks.update(bounded_imap(refresh, pending, workers=workers))
+            return tasks
+
+        def summary(tasks):
+            counts = collections.Counter(task['state'] for task in tasks.values())
+            return ', '.join(f'{state}: {count}' for state, count in sorted(counts.items()))
+
+        if tasks:
+            poller = Poller(timeout=timeout, initial=min(2, poll_frequency), maximum=poll_frequency)
+            try:
+                poller.wait(refresh_all,
+                            done=lambda tasks: all(t['state'] in READY_STATES for t in tasks.values()),
+                            state=summary)
+            except TimeoutError:
+                logger.warning('Not all test runs were ready after %ss: %s', timeout, summary(tasks))
+            logger.info('Test runs: time spent per combination of states:\n%s', poller.dwell_report())
+
+        def report(i):
+            task = tasks[i]
+            if task['state'] not in READY_STATES:
+                return i, PlanResult(plans[i], task['id'], 'TIMEOUT')
+            if task['state'] != 'SUCCESS':
+                return i, PlanResult(plans[i], task['id'], task['state'], error=repr(task))
+            try:
+                summary = ingest_report(self, task['id'], plans[i].sb_environment, metrics, table_id)
+            except (requests.RequestException, ValueError) as e:
+                return i, PlanResult(plans[i], task['id'], 'ERROR', error=f'{type(e).__name__}: {e}')
+            logger.info('Test run report: %s', f"{self._base_url}/reports/{task['id']}")
+            return i, PlanResult(plans[i], task['id'], task['state'],
+                                 failed_tests=summary.failed_tests, summary=summary)
+
+        results.update(bounded_imap(report, list(tasks), workers=workers))
+        return [results[i] for i in range(len(plans))]
 
 
 def execute(sb_environment: SBEnv, test_plan: str,
-            subset: Optional[List[str]] = None):
+            subset: Optional[List[str]] = None,
+            metrics: Optional[MetricsBackend] = None, table_id: Optional[str] = None):
+    """Run a test plan and assert that all tests passed, recording each test's timing to ``metrics``"""
     broker = SevenBridgesBrokerClient()
 
     task = broker.new_test_run(sb_environment, test_plan, subset=subset)
     task = broker.wait_until_done(task)
-    broker.assert_all_tests_passed(task)
+    summary = ingest_report(broker, task['id'], sb_environment, metrics, table_id)
+    logger.info('Slowest tests of %s:\n%s', task['id'], format_ranking(summary))
+    assert len(summary.failed_tests) == 0, f'Failed tests: {summary.failed_tests}'
+
+
+def run_sharded(broker: SevenBridgesBrokerClient, sb_environment: SBEnv, test_plan: str, previous_task_id: str,
+                shards: int = 4, durations: Optional[Dict[str, float]] = None, timeout=1800,
+                metrics: Optional[MetricsBackend] = None, table_id: Optional[str] = None) -> List[PlanResult]:
+    """Run a test plan as ``shards`` concurrent subsets, split by the tests and durations of a previous run
+
+    :param previous_task_id: A test run of the same plan, whose report lists its tests.
+    :param durations: Seconds per test, overriding those of the previous report.
+    :param metrics: Where to record every test's timing, as in run_test_plans().
+    """
+    previous = broker.get_report_by_id(previous_task_id)
+    durations = {**report_durations(previous), **(durations or {})}
+    subsets = shard((result['id'] for result in previous['results']), shards, durations)
+    for i, subset in enumerate(subsets):
+        logger.info('Shard %d of %s: %d tests, ~%.0fs', i, test_plan, len(subset),
+                    sum(durations.get(t, 0) for t in subset))
+    return broker.run_test_plans([TestPlan(sb_environment, test_plan, subset) for subset in subsets], timeout=timeout,
+                                 metrics=metrics, table_id=table_id)
+
+
+def execute_sharded(sb_environment: SBEnv, test_plan: str, previous_task_id: str, shards: int = 4,
+                    timeout=1800, metrics: Optional[MetricsBackend] = None, table_id: Optional[str] = None) -> dict:
+    """Run a test plan in concurrent shards (see run_sharded), assert that all tests passed and
+    return the merged summary (see merge_summaries), recording each test's timing to ``metrics`` like execute()"""
+    broker = SevenBridgesBrokerClient()
+
+    results = run_sharded(broker, sb_environment, test_plan, previous_task_id, shards=shards, timeout=timeout,
+                          metrics=metrics, table_id=table_id)
+    logger.info('Test run results:\n%s', format_results(results))
+    for result in results:
+        if result.summary is not None:
+            logger.info('Slowest tests of %s:\n%s', result.task_id, format_ranking(result.summary))
+    failed = [result for result in results if not result.passed]
+    assert not failed, f'{len(failed)} of {len(results)} shards failed:\n{format_results(failed)}'
+    return merge_summaries(result.summary for result in results)
+
+
+def rerun_failed(sb_environment: SBEnv, test_plan: str, task_id: str, timeout=1800) -> Optional[PlanResult]:
+    """Run only the tests that failed in a previous test run, or nothing if none did"""
+    broker = SevenBridgesBrokerClient()
+
+    failed_tests = broker.failed_tests(task_id, broker.iter_report_results(task_id))
+    if not failed_tests:
+        logger.info('No tests failed in %s, nothing to rerun', task_id)
+        return None
+    [result] = broker.run_test_plans([TestPlan(sb_environment, test_plan, failed_tests)], timeout=timeout)
+    logger.info('Rerun of the failed tests of %s:\n%s', task_id, format_results([result]))
+    return result
+
+
+def ingest_report(broker: SevenBridgesBrokerClient, task_id: str, sb_environment: SBEnv,
+                  metrics: Optional[MetricsBackend] = None, table_id: Optional[str] = None,
+                  top: int = 10) -> ReportSummary:
+    """Stream a test run report, recording every test's state and duration and ranking the slowest tests
+
+    Each test is added to ``table_id`` of ``metrics`` (created if it doesn't exist) as a row keyed by
+    the task ID and environment, with its duration ``d`` in seconds; a buffering backend
+    (bq.get_sink()) batches the inserts.
+    A failure to record is logged, it never fails the caller.
+
+    :param top: How many of the slowest tests to rank.
+    """
+    states: Dict[str, int] = collections.Counter()
+    failed_tests, slowest = [], []
+    total_seconds = 0.0
+    timestamp = str(datetime.now())
+    recording = metrics is not None
+    if recording:
+        metrics.ensure_table(table_id, metrics.create_sb_test_timing_table)
+    for result in broker.iter_report_results(task_id):
+        timing = test_timing(result)
+        states[timing.state] += 1
+        if timing.state not in ('PASSED', 'SKIPPED'):
+            failed_tests.append(timing.test)
+        if timing.seconds is not None:
+            total_seconds += timing.seconds
+            # The running top N, so that memory doesn't grow with the report
+            entry = (timing.seconds, timing.test, timing)
+            if len(slowest) < top:
+                heapq.heappush(slowest, entry)
+            elif top:
+                heapq.heappushpop(slowest, entry)
+        if recording:
+            try:
+                metrics.add_row(table_id, {'t': timestamp, 'task_id': task_id, 'environment': sb_environment.name,
+                                           'test': timing.test, 'state': timing.state, 'd': timing.seconds})
+            except Exception:
+                logger.warning('Failed to record the test timings of %s, not recording the rest', task_id,
+                               exc_info=True)
+                recording = False
+    return ReportSummary(task_id, dict(states), failed_tests, total_seconds,
+                         [timing for _, _, timing in sorted(slowest, reverse=True)])
+
+
+def format_ranking(summary: ReportSummary) -> str:
+    """The slowest tests of a report with their share of the total test time, for logging."""
+    states = ', '.join(f'{state}: {count}' for state, count in sorted(summary.states.items()))
+    lines = [f'{summary.task_id}: {sum(summary.states.values())} tests, {summary.total_seconds:.0f}s in total, {states}']
+    for rank, timing in enumerate(summary.slowest, 1):
+        share = timing.seconds / summary.total_seconds if summary.total_seconds else 0
+        lines.append(f'{rank:>3}. {timing.seconds:8.1f}s {share:6.1%}  {timing.state:<8} {timing.test}')
+    return '\n'.join(lines)
+
+
+def format_results(results: List[PlanResult]) -> str:
+    """One line per plan, e.g. "PASSED  staging  sbgtests.plans.bdc  bdc-staging-...", for logging."""
+    lines = []
+    for result in results:
+        plan = result.plan
+        outcome = 'PASSED' if result.passed else result.state if result.state != 'SUCCESS' else 'FAILED'
+        name = plan.test_plan + (f' ({len(plan.subset)} tests)' if plan.subset else '')
+        detail = f"failed: {', '.join(result.failed_tests)}" if result.failed_tests else result.error or ''
+        lines.append('  '.join(filter(None, [outcome.ljust(7), plan.sb_environment.name.ljust(10), name,
+                                             result.task_id or '', detail])))
+    return '\n'.join(lines)
+
+
+def execute_many(plans: List[TestPlan], timeout=1800):
+    """Run several test plans at once and assert that all of their tests passed"""
+    broker = SevenBridgesBrokerClient()
+
+    results = broker.run_test_plans(plans, timeout=timeout)
+    logger.info('Test run results:\n%s', format_results(results))
+    failed = [result for result in results if not result.passed]
+    assert not failed, f'{len(failed)} of {len(results)} test runs failed:\n{format_results(failed)}'
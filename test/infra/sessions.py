@@ -0,0 +1,102 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+
+from test.infra.timing import TimedAdapter
+
+# Defaults apply to every domain unless overridden with configure()
+POOL_SIZE = int(os.environ.get('BDCAT_HTTP_POOL_SIZE', 10))
+CONNECT_TIMEOUT = float(os.environ.get('BDCAT_HTTP_CONNECT_TIMEOUT', 10))
+READ_TIMEOUT = float(os.environ.get('BDCAT_HTTP_READ_TIMEOUT', 120))
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class PooledSession(requests.Session):
+
+    """A requests.Session with a keep-alive connection pool and a default timeout
+
+    Every request made through the session reuses pooled connections to the same
+    host, so only the first request (per pooled connection) pays the TCP and TLS
+    handshake.  A timeout passed to an individual request overrides the default.
+    Connection setup can be timed with test.infra.timing.ConnectionTimer.
+    """
+
+    def __init__(self, pool_size: int = POOL_SIZE, timeout: Timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)):
+        super().__init__()
+        self.timeout = timeout
+        self.resize(pool_size)
+
+    def resize(self, pool_size: int):
+        """Replace the connection pool with one that keeps up to ``pool_size`` connections per host."""
+        replaced = set(self.adapters.values())
+        adapter = TimedAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        # Close the old pools' idle connections; ones in use are closed when they're released
+        for old in replaced:
+            old.close()
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+_sessions: Dict[str, PooledSession] = {}
+_settings: Dict[str, dict] = {}
+_lock = threading.Lock()
+
+
+def _key(domain: str) -> str:
+    # Accept both a bare domain and a full URL, e.g. a signed GCS url
+    parts = urlsplit(domain)
+    return (parts.netloc or parts.path).lower()
+
+
+def configure(domain: str, pool_size: Optional[int] = None, timeout: Optional[Timeout] = None):
+    """
+    Override the pool size and/or default timeout for one domain.
+
+    Applies to the domain's session whether or not it has been created yet; e.g. callers that
+    run many concurrent requests should size the pool to their worker count.
+    """
+    settings = {}
+    if pool_size is not None:
+        settings['pool_size'] = pool_size
+    if timeout is not None:
+        settings['timeout'] = timeout
+    key = _key(domain)
+    with _lock:
+        _settings.setdefault(key, {}).update(settings)
+        if key in _sessions:
+            if pool_size is not None:
+                _sessions[key].resize(pool_size)
+            if timeout is not None:
+                _sessions[key].timeout = timeout
+
+
+def get_session(domain: str) -> PooledSession:
+    """
+    Return the shared session for a domain (e.g. RAWLS_DOMAIN), creating it on first use.
+
+    :param domain: A domain like "https://rawls.dsde-alpha.broadinstitute.org" or any url on it.
+    """
+    key = _key(domain)
+    try:
+        return _sessions[key]
+    except KeyError:
+        with _lock:
+            if key not in _sessions:
+                _sessions[key] = PooledSession(**_settings.get(key, {}))
+            return _sessions[key]
+
+
+def close_all():
+    """Close every pooled session, e.g. at the end of a run."""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
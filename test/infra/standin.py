@@ -0,0 +1,454 @@
+"""
+An in-process stand-in for the Terra (Rawls, Orchestration) and Gen3 endpoints used by test/utils.py,
+for the SevenBridges QA broker used by test/infra/sb_broker.py and for the GitLab pipeline API used
+by scripts/run_integration_tests.py.
+
+Selected with BDCAT_STAGE=local, which points RAWLS_DOMAIN, ORC_DOMAIN and GEN3_DOMAIN at a
+stand-in started on a free local port, so that the client code (retries, polling, concurrency)
+can be exercised and benchmarked reproducibly with no network.  Its behaviour is configured with:
+
+    BDCAT_STANDIN_LATENCY       seconds added to every response (default 0)
+    BDCAT_STANDIN_ERROR_RATE    fraction of requests answered with a 503 (default 0)
+    BDCAT_STANDIN_STEP_SECONDS  seconds that submissions and PFB imports spend in each state (default 1)
+    BDCAT_STANDIN_URL           use an already running stand-in instead of starting one
+
+A stand-in can also be run on its own, e.g. to share it between processes:
+
+    python -m test.infra.standin --port 8080 --latency 0.05
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import jwt
+
+SUBMISSION_STATES = [('Submitted', 'Queued'), ('Running', 'Running'), ('Done', 'Succeeded')]
+PFB_STATES = ['Pending', 'Translating', 'ReadyForUpsert', 'Upserting', 'Done']
+BROKER_STATES = ['PENDING', 'STARTED', 'SUCCESS']
+PIPELINE_STATES = ['created', 'pending', 'running', 'success']
+MOCK_USER = 'biodata.integration.test.mule@gmail.com'
+OBJECT_SIZE = 1024
+# Rows of the "subject" table that every PFB import adds
+PFB_ENTITIES = 3
+# The ACLs that the records of /index/index cycle through: public, open to the test account, restricted
+INDEX_ACLS = (['*'], ['phs000888'], ['phs000007'])
+
+
+class StandIn(ThreadingHTTPServer):
+
+    """The stand-in server and the state of everything created through it
+
+    :param latency: Seconds added to every response.
+    :param error_rate: Fraction of requests answered with a 503.
+    :param step_seconds: Seconds that submissions and PFB import jobs spend in each state.
+    :param denied_guids: GUIDs that /user/data/download answers with a 401.
+    :param index_size: Records listed by /index/index.
+    :param revoked_tokens: Bearer tokens that every request is refused with a 401, as if they had expired.
+    :param token_accounts: The Google accounts of access tokens, by token, as told by /oauth2/v3/tokeninfo;
+        any other token is MOCK_USER's.
+    """
+
+    daemon_threads = True
+
+    def __init__(self,
+                 port: int = 0,
+                 latency: float = 0.0,
+                 error_rate: float = 0.0,
+                 step_seconds: float = 1.0,
+                 denied_guids=(),
+                 index_size: int = 1000,
+                 revoked_tokens=(),
+                 token_accounts=None,
+                 seed: Optional[int] = None):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.step_seconds = step_seconds
+        self.denied_guids = set(denied_guids)
+        self.index_size = index_size
+        self.revoked_tokens = set(revoked_tokens)
+        self.token_accounts = dict(token_accounts or {})
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.workspaces: Dict[Tuple[str, str], dict] = {}
+        self.method_configs: Dict[Tuple[str, str], Dict[Tuple[str, str], dict]] = {}
+        self.entities: Dict[Tuple[str, str], Dict[Tuple[str, str], dict]] = {}
+        self.submissions: Dict[str, float] = {}
+        self.pfb_jobs: Dict[str, float] = {}
+        self.broker_tasks: Dict[str, Tuple[float, dict]] = {}
+        self.pipelines: Dict[int, Tuple[float, str]] = {}
+        self.requests = 0
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self) -> 'StandIn':
+        threading.Thread(target=self.serve_forever, name='standin', daemon=True).start()
+        return self
+
+    def state(self, started: float, states: list):
+        step = int((time.time() - started) / self.step_seconds) if self.step_seconds else len(states)
+        return states[min(step, len(states) - 1)]
+
+
+def _workspace_path(rest: str = ''):
+    return re.compile(r'^/api/workspaces/(?P<ns>[^/]+)/(?P<ws>[^/]+)' + rest + '$')
+
+
+def _object_data() -> bytes:
+    """The content of every object the stand-in serves."""
+    return bytes(i % 256 for i in range(OBJECT_SIZE))
+
+
+def _indexd_record(guid: str, acl: list) -> dict:
+    data = _object_data()
+    return {'did': guid, 'size': len(data), 'acl': acl, 'urls': [f'gs://standin/{guid}'],
+            'hashes': {'md5': hashlib.md5(data).hexdigest(), 'crc': f'{zlib.crc32(data):08x}'}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    server: StandIn
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real services
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body=None, content_type='application/json', headers=None):
+        data = b'' if body is None else body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(data) if data else {}
+        except ValueError:
+            return parse_qs(data.decode('utf-8'))
+
+    def _dispatch(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fail = server.random.random() < server.error_rate
+        if server.latency:
+            time.sleep(server.latency)
+        if fail:
+            self._body()  # keeps the connection usable for the next request
+            return self._send(503, {'message': 'Stand-in injected error'})
+        authorization = self.headers.get('Authorization', '')
+        if authorization.startswith('Bearer ') and authorization[len('Bearer '):] in server.revoked_tokens:
+            self._body()
+            return self._send(401, {'message': 'Token expired'})
+
+        url = urlsplit(self.path)
+        for method, pattern, handler in _ROUTES:
+            if method == self.command or (method == 'GET' and self.command == 'HEAD'):
+                match = pattern.match(url.path)
+                if match:
+                    return handler(self, query=parse_qs(url.query), **match.groupdict())
+        self._send(404, {'message': f'No stand-in route for {self.command} {url.path}'})
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = _dispatch
+
+    # Orchestration
+
+    def status(self, query):
+        self._send(200, {'ok': True, 'systems': {'Rawls': {'ok': True}, 'Thurloe': {'ok': True}}})
+
+    def import_pfb(self, query, ns, ws):
+        if (ns, ws) not in self.server.workspaces:
+            return self._send(404, {'message': f'Workspace {ns}/{ws} not found'})
+        self._body()
+        job_id = str(uuid.uuid4())
+        with self.server.lock:
+            self.server.pfb_jobs[job_id] = time.time()
+        self._send(201, {'jobId': job_id})
+
+    def pfb_status(self, query, ns, ws, job_id):
+        if job_id not in self.server.pfb_jobs:
+            return self._send(404, {'message': f'Job {job_id} not found'})
+        status = self.server.state(self.server.pfb_jobs[job_id], PFB_STATES)
+        if status == 'Done':
+            # The imported rows, as if upserted by the import
+            with self.server.lock:
+                entities = self.server.entities.setdefault((ns, ws), {})
+                for i in range(PFB_ENTITIES):
+                    name = f'subject_{job_id[:8]}_{i}'
+                    entities[('subject', name)] = dict(entityType='subject', name=name, attributes={})
+        self._send(200, {'jobId': job_id, 'status': status})
+
+    # Rawls
+
+    def list_workspaces(self, query):
+        with self.server.lock:
+            self._send(200, [{'accessLevel': 'OWNER', 'workspace': w} for w in self.server.workspaces.values()])
+
+    def create_workspace(self, query):
+        body = self._body()
+        key = (body['namespace'], body['name'])
+        with self.server.lock:
+            if key in self.server.workspaces:
+                return self._send(409, {'message': f'Workspace {key[0]}/{key[1]} already exists'})
+            workspace = dict(namespace=key[0], name=key[1], workspaceId=str(uuid.uuid4()),
+                             createdBy=MOCK_USER, createdDate=time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+                             attributes=body.get('attributes', {}))
+            self.server.workspaces[key] = workspace
+        self._send(201, workspace)
+
+    def get_workspace(self, query, ns, ws):
+        workspace = self.server.workspaces.get((ns, ws))
+        self._send(200, {'workspace': workspace}) if workspace else self._send(404, {'message': 'Not found'})
+
+    def update_workspace(self, query, ns, ws):
+        updates = self._body()
+        with self.server.lock:
+            workspace = self.server.workspaces.get((ns, ws))
+            if workspace is None:
+                return self._send(404, {'message': 'Not found'})
+            for update in updates:
+                if update['op'] == 'AddUpdateAttribute':
+                    workspace['attributes'][update['attributeName']] = update['addUpdateAttribute']
+                elif update['op'] == 'RemoveAttribute':
+                    workspace['attributes'].pop(update['attributeName'], None)
+            self._send(200, workspace)
+
+    def delete_workspace(self, query, ns, ws):
+        with self.server.lock:
+            found = self.server.workspaces.pop((ns, ws), None)
+            self.server.method_configs.pop((ns, ws), None)
+            self.server.entities.pop((ns, ws), None)
+        self._send(202, b'', 'text/plain') if found else self._send(404, {'message': 'Not found'})
+
+    def create_method_config(self, query, ns, ws):
+        body = self._body()
+        key = (body['namespace'], body['name'])
+        with self.server.lock:
+            configs = self.server.method_configs.setdefault((ns, ws), {})
+            if key in configs:
+                return self._send(409, {'message': f'Method configuration {key[0]}/{key[1]} already exists'})
+            configs[key] = body
+        self._send(201, {'methodConfiguration': body, 'missingInputs': [], 'extraInputs': [],
+                         'validInputs': [], 'validOutputs': [], 'invalidInputs': {}, 'invalidOutputs': {}})
+
+    def list_method_configs(self, query, ns, ws):
+        with self.server.lock:
+            self._send(200, list(self.server.method_configs.get((ns, ws), {}).values()))
+
+    def delete_method_config(self, query, ns, ws, config_ns, config_name):
+        with self.server.lock:
+            found = self.server.method_configs.get((ns, ws), {}).pop((config_ns, config_name), None)
+        self._send(204) if found else self._send(404, {'message': 'Not found'})
+
+    def submit(self, query, ns, ws):
+        self._body()
+        submission_id = str(uuid.uuid4())
+        with self.server.lock:
+            self.server.submissions[submission_id] = time.time()
+        self._send(201, self._submission(submission_id))
+
+    def submission_status(self, query, ns, ws, submission_id):
+        if submission_id not in self.server.submissions:
+            return self._send(404, {'message': f'Submission {submission_id} not found'})
+        self._send(200, self._submission(submission_id))
+
+    def _submission(self, submission_id):
+        status, workflow_status = self.server.state(self.server.submissions[submission_id], SUBMISSION_STATES)
+        return {'submissionId': submission_id, 'status': status,
+                'workflows': [{'status': workflow_status,
+                               'inputResolutions': [{'inputName': 'md5sum.input_file',
+                                                     'value': 'drs://dg.712C/fa640b0e-9779-452f-99a6-16d833d15bd0'}]}]}
+
+    def list_entity_types(self, query, ns, ws):
+        with self.server.lock:
+            counts: Dict[str, int] = {}
+            for entity_type, _ in self.server.entities.get((ns, ws), {}):
+                counts[entity_type] = counts.get(entity_type, 0) + 1
+        self._send(200, {t: {'count': n, 'attributeNames': [], 'idName': f'{t}_id'} for t, n in counts.items()})
+
+    def list_entities(self, query, ns, ws, entity_type):
+        with self.server.lock:
+            entities = [e for (t, _), e in self.server.entities.get((ns, ws), {}).items() if t == entity_type]
+        self._send(200, entities)
+
+    def delete_entities(self, query, ns, ws):
+        body = self._body()
+        with self.server.lock:
+            entities = self.server.entities.get((ns, ws), {})
+            for entity in body:
+                entities.pop((entity['entityType'], entity['entityName']), None)
+        self._send(204)
+
+    # Gen3
+
+    def download(self, query, guid):
+        if 'Authorization' not in self.headers or guid in self.server.denied_guids:
+            return self._send(401, {'message': 'You don\'t have access to this data'})
+        expires = int(time.time()) + 3600
+        self._send(200, {'url': f'{self.server.url}/gcs/{guid}?GoogleAccessId=standin&Expires={expires}&Signature=x'})
+
+    def indexd_record(self, query, guid):
+        self._send(200, _indexd_record(guid, ['*']))
+
+    def indexd_list(self, query):
+        # Like indexd, pages are numbered from 0 and the last page is the first short one
+        limit = min(int(query.get('limit', ['100'])[0]), 1024)
+        page = int(query.get('page', ['0'])[0])
+        records = [_indexd_record(f'dg.712C/{i:08d}-0000-4000-8000-000000000000', INDEX_ACLS[i % len(INDEX_ACLS)])
+                   for i in range(page * limit, min((page + 1) * limit, self.server.index_size))]
+        self._send(200, {'records': records, 'limit': limit, 'page': page})
+
+    def gcs_object(self, query, guid):
+        # Objects named "empty..." have no bytes, so that no range of them can be satisfied
+        data = b'' if guid.startswith('empty') else _object_data()
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match and int(match.group(1)) >= len(data):
+            self._send(416, b'', 'text/plain', {'Content-Range': f'bytes */{len(data)}'})
+        elif match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+            self._send(206, data[start:end + 1], 'application/octet-stream',
+                       {'Content-Range': f'bytes {start}-{end}/{len(data)}'})
+        else:
+            self._send(200, data, 'application/octet-stream')
+
+    def access_token(self, query):
+        self._body()
+        token = jwt.encode({'exp': int(time.time()) + 1200, 'iss': f'{self.server.url}/user'}, 'standin')
+        self._send(200, {'access_token': token.decode('utf-8') if isinstance(token, bytes) else token})
+
+    def tokeninfo(self, query):
+        if 'access_token' not in query:
+            return self._send(400, {'error': 'invalid_request', 'error_description': 'Invalid Value'})
+        token = query['access_token'][0]
+        self._send(200, {'email': self.server.token_accounts.get(token, MOCK_USER), 'email_verified': 'true',
+                         'expires_in': '3600'})
+
+    def version(self, query):
+        self._send(200, {'commit': 'standin', 'version': '2022.01'})
+
+    # SevenBridges QA broker; tests with "fail" in their ID fail
+
+    def new_broker_task(self, query, task_id):
+        with self.server.lock:
+            self.server.broker_tasks[task_id] = (time.time(), self._body())
+        self._send(201, self._broker_task(task_id))
+
+    def broker_task(self, query, task_id):
+        if task_id not in self.server.broker_tasks:
+            return self._send(404, {'message': f'Task {task_id} not found'})
+        self._send(200, self._broker_task(task_id))
+
+    def broker_report(self, query, task_id):
+        if task_id not in self.server.broker_tasks:
+            return self._send(404, {'message': f'Report {task_id} not found'})
+        _, task = self.server.broker_tasks[task_id]
+        test_ids = task.get('test_ids') or [f"{task['test_plan_id']}.test_{i}" for i in range(8)]
+        self._send(200, {'id': task_id,
+                         'results': [{'id': test_id, 'state': 'FAILED' if 'fail' in test_id else 'PASSED',
+                                      'duration': 1 + zlib.crc32(test_id.encode('utf-8')) % 60}
+                                     for test_id in test_ids]})
+
+    def _broker_task(self, task_id):
+        started, task = self.server.broker_tasks[task_id]
+        return {'id': task_id, 'state': self.server.state(started, BROKER_STATES), **task}
+
+    # GitLab; pipelines of refs with "fail" in their name fail
+
+    def trigger_pipeline(self, query, project):
+        # The token, ref and variables may be sent as query parameters or as a form
+        form = self._body()
+        with self.server.lock:
+            pipeline_id = len(self.server.pipelines) + 1
+            self.server.pipelines[pipeline_id] = (time.time(), (query.get('ref') or form.get('ref') or ['master'])[0])
+        self._send(201, self._pipeline(project, pipeline_id))
+
+    def pipeline(self, query, project, pipeline_id):
+        if int(pipeline_id) not in self.server.pipelines:
+            return self._send(404, {'message': '404 Not found'})
+        self._send(200, self._pipeline(project, int(pipeline_id)))
+
+    def _pipeline(self, project, pipeline_id):
+        started, ref = self.server.pipelines[pipeline_id]
+        status = self.server.state(started, PIPELINE_STATES)
+        if status == 'success' and 'fail' in ref:
+            status = 'failed'
+        return {'id': pipeline_id, 'ref': ref, 'status': status,
+                'web_url': f'{self.server.url}/project-{project}/-/pipelines/{pipeline_id}',
+                'user': {'name': 'Integration Test Mule', 'username': 'mule'}}
+
+
+_ROUTES = [
+    ('GET', re.compile(r'^/status$'), _Handler.status),
+    ('POST', _workspace_path('/importPFB'), _Handler.import_pfb),
+    ('GET', _workspace_path('/importPFB/(?P<job_id>[^/]+)'), _Handler.pfb_status),
+    ('GET', re.compile(r'^/api/workspaces$'), _Handler.list_workspaces),
+    ('POST', re.compile(r'^/api/workspaces$'), _Handler.create_workspace),
+    ('GET', _workspace_path(), _Handler.get_workspace),
+    ('PATCH', _workspace_path(), _Handler.update_workspace),
+    ('DELETE', _workspace_path(), _Handler.delete_workspace),
+    ('POST', _workspace_path('/methodconfigs'), _Handler.create_method_config),
+    ('GET', _workspace_path('/methodconfigs'), _Handler.list_method_configs),
+    ('DELETE', _workspace_path('/methodconfigs/(?P<config_ns>[^/]+)/(?P<config_name>[^/]+)'),
+     _Handler.delete_method_config),
+    ('POST', _workspace_path('/submissions'), _Handler.submit),
+    ('GET', _workspace_path('/submissions/(?P<submission_id>[^/]+)'), _Handler.submission_status),
+    ('GET', _workspace_path('/entities'), _Handler.list_entity_types),
+    ('POST', _workspace_path('/entities/delete'), _Handler.delete_entities),
+    ('GET', _workspace_path('/entities/(?P<entity_type>[^/]+)'), _Handler.list_entities),
+    ('GET', re.compile(r'^/user/data/download/(?P<guid>.+)$'), _Handler.download),
+    ('GET', re.compile(r'^/gcs/(?P<guid>.+)$'), _Handler.gcs_object),
+    ('POST', re.compile(r'^/user/credentials/api/access_token$'), _Handler.access_token),
+    ('GET', re.compile(r'^/(index|user|api)/_version$'), _Handler.version),
+    ('GET', re.compile(r'^/oauth2/v3/tokeninfo$'), _Handler.tokeninfo),
+    ('GET', re.compile(r'^/index/index/?$'), _Handler.indexd_list),
+    ('POST', re.compile(r'^/api/v4/projects/(?P<project>\d+)/trigger/pipeline$'), _Handler.trigger_pipeline),
+    ('GET', re.compile(r'^/api/v4/projects/(?P<project>\d+)/pipelines/(?P<pipeline_id>\d+)$'), _Handler.pipeline),
+    ('PUT', re.compile(r'^/tasks/(?P<task_id>[^/]+)$'), _Handler.new_broker_task),
+    ('GET', re.compile(r'^/tasks/(?P<task_id>[^/]+)$'), _Handler.broker_task),
+    ('GET', re.compile(r'^/reports/(?P<task_id>[^/]+)$'), _Handler.broker_report),
+    ('GET', re.compile(r'^/index/(?P<guid>.+)$'), _Handler.indexd_record),
+]
+
+
+def start_standin(**kwargs) -> StandIn:
+    """Start a stand-in configured from the BDCAT_STANDIN_* environment variables, overridden by ``kwargs``."""
+    config = dict(latency=float(os.environ.get('BDCAT_STANDIN_LATENCY', 0)),
+                  error_rate=float(os.environ.get('BDCAT_STANDIN_ERROR_RATE', 0)),
+                  step_seconds=float(os.environ.get('BDCAT_STANDIN_STEP_SECONDS', 1)))
+    config.update(kwargs)
+    return StandIn(**config).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a stand-in for the Terra and Gen3 endpoints.')
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--step-seconds", type=float, default=1.0)
+    args = parser.parse_args(argv)
+    server = StandIn(port=args.port, latency=args.latency, error_rate=args.error_rate, step_seconds=args.step_seconds)
+    print(f'Stand-in listening on {server.url}; use BDCAT_STAGE=local BDCAT_STANDIN_URL={server.url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
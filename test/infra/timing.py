@@ -0,0 +1,154 @@
+import socket
+import threading
+import time
+from typing import Optional
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import create_connection
+
+_local = threading.local()
+
+
+class ConnectionTimer:
+
+    """Record where the time goes in requests made on the current thread
+
+    Use as a context manager around requests made through a session with a TimedAdapter
+    mounted (every PooledSession has one)::
+
+        with ConnectionTimer() as timer:
+            resp = session.get(url)
+        timer.dns_seconds, timer.connect_seconds, timer.tls_seconds, timer.ttfb_seconds
+
+    dns_seconds, connect_seconds and tls_seconds stay at zero when the request reused a
+    pooled connection.  ttfb_seconds is the time from the request having been sent to the
+    response headers having arrived, i.e. excluding connection setup.  Timings add up over
+    all requests made in the context.  Outside of the context manager the adapter behaves
+    exactly like a plain HTTPAdapter.
+    """
+
+    def __init__(self):
+        self.connections = 0
+        self.dns_seconds = 0.0
+        self.connect_seconds = 0.0
+        self.tls_seconds = 0.0
+        self.ttfb_seconds = 0.0
+
+    def __enter__(self) -> 'ConnectionTimer':
+        self._outer = getattr(_local, 'timer', None)
+        _local.timer = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.timer = self._outer
+
+
+def _active_timer() -> Optional[ConnectionTimer]:
+    return getattr(_local, 'timer', None)
+
+
+class _TimedConnectionMixin:
+
+    # Only attributes that urllib3 1.26 and 2.x connections both have are used here:
+    # host, port, timeout, source_address and socket_options, plus _new_conn(), which both
+    # call from connect() to open the socket, and is the one place where DNS can be timed apart
+    # from the TCP connect.
+
+    _sent_at: Optional[float] = None
+
+    def _new_conn(self):
+        timer = _active_timer()
+        if timer is None:
+            return super()._new_conn()
+
+        # Resolve the host ourselves so that DNS and TCP connect times can be told apart
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)
+        except socket.gaierror:
+            addresses = None
+        if not addresses:
+            # Let urllib3 raise its usual error
+            return super()._new_conn()
+        resolved = time.perf_counter()
+        timer.dns_seconds += resolved - start
+
+        extra_kw = {}
+        if self.source_address:
+            extra_kw['source_address'] = self.source_address
+        if self.socket_options:
+            extra_kw['socket_options'] = self.socket_options
+
+        error = None
+        for *_, sockaddr in addresses:
+            try:
+                conn = create_connection((sockaddr[0], self.port), self.timeout, **extra_kw)
+                break
+            except socket.timeout:
+                raise ConnectTimeoutError(self, f'Connection to {self.host} timed out. '
+                                                f'(connect timeout={self.timeout})')
+            except OSError as e:
+                error = e
+        else:
+            raise NewConnectionError(self, f'Failed to establish a new connection: {error}')
+        timer.connect_seconds += time.perf_counter() - resolved
+        timer.connections += 1
+        return conn
+
+    def connect(self):
+        timer = _active_timer()
+        if timer is None:
+            return super().connect()
+        start = time.perf_counter()
+        setup_seconds = timer.dns_seconds + timer.connect_seconds
+        super().connect()
+        # Whatever connect() spent beyond resolving and connecting is the TLS handshake
+        setup_seconds = timer.dns_seconds + timer.connect_seconds - setup_seconds
+        timer.tls_seconds += max(0.0, time.perf_counter() - start - setup_seconds)
+
+    # request() and getresponse() are http.client's public interface, which urllib3 keeps
+
+    def request(self, *args, **kwargs):
+        super().request(*args, **kwargs)
+        self._sent_at = time.perf_counter() if _active_timer() is not None else None
+
+    def request_chunked(self, *args, **kwargs):
+        # Only urllib3 < 2 sends chunked bodies with this
+        super().request_chunked(*args, **kwargs)
+        self._sent_at = time.perf_counter() if _active_timer() is not None else None
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        timer, sent_at, self._sent_at = _active_timer(), self._sent_at, None
+        if timer is not None and sent_at is not None:
+            timer.ttfb_seconds += time.perf_counter() - sent_at
+        return response
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedAdapter(HTTPAdapter):
+
+    """An HTTPAdapter whose new connections report their timings to an active ConnectionTimer"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _TimedHTTPConnectionPool,
+                                                   'https': _TimedHTTPSConnectionPool}
@@ -0,0 +1,377 @@
+"""
+Metrics backends: where test results and timings are recorded.
+
+bq.Client records to BigQuery.  The local backends here have the same surface and need no
+network or credentials, so runs on offline machines and dev laptops still record timings:
+
+    BDCAT_METRICS_BACKEND=sqlite BDCAT_METRICS_PATH=metrics.sqlite python test/test_basic_submission.py
+
+BDCAT_METRICS_BACKEND is one of "bigquery" (the default), "sqlite" or "jsonl"; see bq.get_client().
+"""
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Union
+
+log = logging.getLogger(__name__)
+
+# Mirrors the attributes of google.cloud.bigquery.SchemaField that backends use
+Field = namedtuple('Field', ['name', 'field_type', 'mode'], defaults=['NULLABLE'])
+
+# Columns of the drs_hop_latency_* tables, see test.drs.check_drs_access
+DRS_HOPS = ('gen3', 'gs')
+DRS_HOP_FIELDS = ('status_code', 'attempts', 'retry_seconds',
+                  'dns_seconds', 'connect_seconds', 'tls_seconds', 'ttfb_seconds', 'total_seconds')
+
+
+def _schema_json(schema: List[Field]) -> list:
+    # Accepts bigquery.SchemaFields as well as Fields
+    return [[field.name, field.field_type, field.mode] for field in schema]
+
+
+_ensure_lock = threading.Lock()
+
+
+def parse_timestamp(t) -> datetime.datetime:
+    """Timestamps are datetimes from BigQuery, but str(datetime) strings from the local backends."""
+    if isinstance(t, str):
+        t = datetime.datetime.fromisoformat(t)
+    # Compare everything as naive datetimes
+    return t.replace(tzinfo=None)
+
+
+def _since(rows: List[dict], since: Optional[datetime.datetime]) -> List[dict]:
+    rows = sorted(rows, key=lambda row: parse_timestamp(row['t']))
+    if since is not None:
+        rows = [row for row in rows if parse_timestamp(row['t']) >= since]
+    return rows
+
+
+class MetricsBackend:
+
+    """The table-of-rows interface shared by every metrics backend"""
+
+    def add_row(self, table_id: str, row: dict):
+        self.add_rows(table_id, [row])
+
+    def add_rows(self, table_id: str, rows: List[dict]):
+        raise NotImplementedError()
+
+    def is_transient(self, error: Exception) -> bool:
+        """Whether add_rows() failing with ``error`` might succeed later: connection errors, timeouts, 429s and 5xx."""
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+        if status_code is not None:
+            return status_code == 429 or status_code >= 500
+        return isinstance(error, OSError)
+
+    def list_table(self, table_id, limit=10) -> list:
+        raise NotImplementedError()
+
+    def read_table(self, table_id, since: Optional[datetime.datetime] = None) -> List[dict]:
+        """Every row of a table, oldest first, optionally only those with a timestamp ``t`` >= ``since``."""
+        raise NotImplementedError()
+
+    def create_table(self, table_id, schema: List[Field]):
+        raise NotImplementedError()
+
+    def ensure_table(self, table_id: str, create: Callable[[str], None]):
+        """
+        Create a table with ``create``, e.g. self.create_test_duration_table, unless this backend
+        already has in this process.  The table may exist already, which create_table() allows.
+        """
+        with _ensure_lock:
+            ensured = self.__dict__.setdefault('_ensured_tables', set())
+            if table_id in ensured:
+                return
+            ensured.add(table_id)
+        try:
+            create(table_id)
+        except Exception:
+            # Rows for a missing table are dead-lettered by BufferedClient, not lost
+            log.warning('Could not create table %s', table_id, exc_info=True)
+
+    def create_test_table(self, table_id):
+        schema = [
+            Field('t', 'TIMESTAMP', mode='REQUIRED'),
+            Field('u', 'INTEGER', mode='REQUIRED'),
+            Field('d', 'INTEGER', mode='REQUIRED'),
+            Field('m', 'INTEGER', mode='REQUIRED')
+        ]
+        self.create_table(table_id, schema)
+
+    def create_drs_hop_table(self, table_id):
+        schema = [
+            Field('t', 'TIMESTAMP', mode='REQUIRED'),
+            Field('uri', 'STRING', mode='REQUIRED'),
+            Field('status', 'STRING', mode='REQUIRED'),
+            Field('error', 'STRING'),
+            Field('signed_url_host', 'STRING')
+        ]
+        for hop in DRS_HOPS:
+            for field in DRS_HOP_FIELDS:
+                field_type = 'INTEGER' if field in ('status_code', 'attempts') else 'FLOAT'
+                schema.append(Field(f'{hop}_{field}', field_type))
+        self.create_table(table_id, schema)
+
+    def create_test_duration_table(self, table_id):
+        schema = [
+            Field('t', 'TIMESTAMP', mode='REQUIRED'),
+            Field('test', 'STRING', mode='REQUIRED'),
+            Field('d', 'FLOAT', mode='REQUIRED')
+        ]
+        self.create_table(table_id, schema)
+
+    def create_sb_test_timing_table(self, table_id):
+        schema = [
+            Field('t', 'TIMESTAMP', mode='REQUIRED'),
+            Field('task_id', 'STRING', mode='REQUIRED'),
+            Field('environment', 'STRING', mode='REQUIRED'),
+            Field('test', 'STRING', mode='REQUIRED'),
+            Field('state', 'STRING', mode='REQUIRED'),
+            Field('d', 'FLOAT')
+        ]
+        self.create_table(table_id, schema)
+
+    def log_test_duration(self, test_name, stage, duration, timestamp):
+        """Record how long a test took, in minutes like bq.log_duration, for test/trends.py."""
+        table_id = f'platform-dev-178517.bdc.integration_test_durations_{stage}'
+        self.ensure_table(table_id, self.create_test_duration_table)
+        self.add_row(table_id, {'t': str(timestamp), 'test': test_name, 'd': duration / 60})
+
+    def log_test_results(self, test_name, status, timestamp, create=False):
+        table_id = f'platform-dev-178517.bdc.integration_tests_{test_name}'
+        if status != 'skip':
+            if status == 'success':
+                field = 'u'
+            elif status in ('failure', 'error'):
+                field = 'd'
+            else:
+                raise ValueError(f'Unexpected status: {status!r} for test: {test_name!r}')
+            row = {f: (1 if f == field else 0) for f in ('u', 'd', 'm')}
+            row['t'] = str(timestamp)
+            if create:
+                self.create_test_table(table_id)
+            self.add_row(table_id, row)
+
+
+class SQLiteBackend(MetricsBackend):
+
+    """Record rows in a local SQLite database; safe to share between processes
+
+    Rows are stored as JSON, keyed by the same table IDs used for BigQuery, so no
+    per-table DDL is needed and create_table() only records the schema.
+    """
+
+    def __init__(self, path='metrics.sqlite'):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS metric_tables (table_id TEXT PRIMARY KEY, schema TEXT)')
+            conn.execute('CREATE TABLE IF NOT EXISTS metric_rows '
+                         '(id INTEGER PRIMARY KEY AUTOINCREMENT, table_id TEXT NOT NULL, row TEXT NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS metric_rows_table_id ON metric_rows (table_id)')
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # A connection per call keeps this usable from several threads and processes
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:  # commits, or rolls back on error
+                yield conn
+        finally:
+            conn.close()
+
+    def add_rows(self, table_id: str, rows: List[dict]):
+        with self._connect() as conn:
+            conn.executemany('INSERT INTO metric_rows (table_id, row) VALUES (?, ?)',
+                             [(table_id, json.dumps(row)) for row in rows])
+
+    def list_table(self, table_id, limit=10) -> List[dict]:
+        with self._connect() as conn:
+            cursor = conn.execute('SELECT row FROM metric_rows WHERE table_id = ? ORDER BY id LIMIT ?',
+                                  (table_id, limit))
+            return [json.loads(row) for row, in cursor]
+
+    def read_table(self, table_id, since: Optional[datetime.datetime] = None) -> List[dict]:
+        with self._connect() as conn:
+            cursor = conn.execute('SELECT row FROM metric_rows WHERE table_id = ? ORDER BY id', (table_id,))
+            return _since([json.loads(row) for row, in cursor], since)
+
+    def create_table(self, table_id, schema: List[Field]):
+        with self._connect() as conn:
+            cursor = conn.execute('INSERT OR IGNORE INTO metric_tables (table_id, schema) VALUES (?, ?)',
+                                  (table_id, json.dumps(_schema_json(schema))))
+        if cursor.rowcount:
+            log.info(f'Created table {table_id}')
+        else:
+            log.warning(f'Table {table_id} already exists')
+
+
+class JSONLBackend(MetricsBackend):
+
+    """Record rows as append-only JSON lines, one file per table, in a local directory"""
+
+    def __init__(self, path='metrics'):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, table_id, suffix='.jsonl'):
+        return os.path.join(self.path, table_id + suffix)
+
+    def add_rows(self, table_id: str, rows: List[dict]):
+        # One write per batch, so concurrent appends don't interleave within a line
+        data = ''.join(json.dumps(row) + '\n' for row in rows)
+        with self._lock, open(self._file(table_id), 'a') as f:
+            f.write(data)
+
+    def list_table(self, table_id, limit=10) -> List[dict]:
+        rows = []
+        if os.path.exists(self._file(table_id)):
+            with open(self._file(table_id)) as f:
+                for line in f:
+                    if len(rows) >= limit:
+                        break
+                    if line.strip():
+                        rows.append(json.loads(line))
+        return rows
+
+    def read_table(self, table_id, since: Optional[datetime.datetime] = None) -> List[dict]:
+        return _since(self.list_table(table_id, limit=sys.maxsize), since)
+
+    def create_table(self, table_id, schema: List[Field]):
+        try:
+            with open(self._file(table_id, '.schema.json'), 'x') as f:
+                json.dump(_schema_json(schema), f)
+            log.info(f'Created table {table_id}')
+        except FileExistsError:
+            log.warning(f'Table {table_id} already exists')
+
+
+class BufferedClient(MetricsBackend):
+
+    """A metrics backend whose add_row() collects rows per table and inserts them in bulk
+
+    Rows are flushed when ``max_rows`` are buffered, when the oldest buffered row is more than
+    ``max_seconds`` old (checked as rows are added), on flush() and, for bq.get_sink(), at
+    interpreter exit.  A batch that fails with a transient error (see MetricsBackend.is_transient),
+    e.g. because BigQuery is unreachable, is appended to ``spool_path`` as JSON lines and retried
+    on the next flush, from this or a later run.  A batch that fails for good, e.g. because the
+    table doesn't exist or BigQuery rejects its rows, is appended to ``dead_letter_path`` with the
+    error instead, and never retried.
+
+    :param client: The backend to insert rows with, or a function returning it, called on first use.
+    """
+
+    def __init__(self,
+                 client: Union[MetricsBackend, Callable[[], MetricsBackend]],
+                 max_rows: int = 500,
+                 max_seconds: float = 60,
+                 spool_path: str = os.environ.get('BDCAT_BQ_SPOOL', 'bq_spool.jsonl'),
+                 dead_letter_path: str = os.environ.get('BDCAT_BQ_DEAD_LETTER', 'bq_rejected.jsonl')):
+        self._unbuffered = client
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.spool_path = spool_path
+        self.dead_letter_path = dead_letter_path
+        self._rows: Dict[str, List[dict]] = {}
+        self._oldest: Optional[float] = None
+        self._lock = threading.RLock()
+
+    @property
+    def unbuffered(self) -> MetricsBackend:
+        if not isinstance(self._unbuffered, MetricsBackend):
+            self._unbuffered = self._unbuffered()
+        return self._unbuffered
+
+    def is_transient(self, error: Exception) -> bool:
+        return self.unbuffered.is_transient(error)
+
+    def create_table(self, table_id, schema):
+        self.unbuffered.create_table(table_id, schema)
+
+    def list_table(self, table_id, limit=10):
+        self.flush()
+        return self.unbuffered.list_table(table_id, limit=limit)
+
+    def read_table(self, table_id, since: Optional[datetime.datetime] = None) -> List[dict]:
+        self.flush()
+        return self.unbuffered.read_table(table_id, since=since)
+
+    def add_rows(self, table_id: str, rows: List[dict]):
+        with self._lock:
+            self._rows.setdefault(table_id, []).extend(rows)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            buffered = sum(len(rows) for rows in self._rows.values())
+            if buffered >= self.max_rows or time.monotonic() - self._oldest >= self.max_seconds:
+                self.flush()
+
+    def _read_spool(self) -> Dict[str, List[dict]]:
+        rows: Dict[str, List[dict]] = {}
+        if os.path.exists(self.spool_path):
+            with open(self.spool_path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        rows.setdefault(entry['table_id'], []).append(entry['row'])
+            os.remove(self.spool_path)
+            log.info('Retrying %d spooled rows from %s', sum(map(len, rows.values())), self.spool_path)
+        return rows
+
+    def _append(self, path: str, table_id: str, rows: List[dict], **extra):
+        with open(path, 'a') as f:
+            for row in rows:
+                f.write(json.dumps(dict(table_id=table_id, row=row, **extra)) + '\n')
+
+    def flush(self):
+        """Insert every buffered (and previously spooled) row.  Never raises."""
+        with self._lock:
+            try:
+                pending = self._read_spool()
+            except Exception:
+                log.warning('Could not read the spool file %s', self.spool_path, exc_info=True)
+                pending = {}
+            for table_id, rows in self._rows.items():
+                pending.setdefault(table_id, []).extend(rows)
+            self._rows = {}
+            self._oldest = None
+
+            for table_id, rows in pending.items():
+                for i in range(0, len(rows), self.max_rows):
+                    batch = rows[i:i + self.max_rows]
+                    try:
+                        self.unbuffered.add_rows(table_id, batch)
+                    except Exception as e:
+                        try:
+                            if self.is_transient(e):
+                                log.warning('Failed to insert %d rows into %s, spooling them to %s',
+                                            len(batch), table_id, self.spool_path, exc_info=True)
+                                self._append(self.spool_path, table_id, batch)
+                            else:
+                                log.error('Could not insert %d rows into %s, moving them to %s',
+                                          len(batch), table_id, self.dead_letter_path, exc_info=True)
+                                self._append(self.dead_letter_path, table_id, batch, error=str(e))
+                        except OSError:
+                            log.error('Could not save rows for %s, they are lost', table_id, exc_info=True)
+
+
+def local_backend(kind: str, path=None) -> MetricsBackend:
+    """
+    :param kind: "sqlite" or "jsonl".
+    :param path: The database file or directory; defaults to BDCAT_METRICS_PATH, then to
+        "metrics.sqlite" or "metrics/" in the working directory.
+    """
+    path = path or os.environ.get('BDCAT_METRICS_PATH')
+    if kind == 'sqlite':
+        return SQLiteBackend(path or 'metrics.sqlite')
+    elif kind == 'jsonl':
+        return JSONLBackend(path or 'metrics')
+    else:
+        raise ValueError(f'Unknown metrics backend: {kind!r}.  Please use "bigquery", "sqlite" or "jsonl".')
@@ -5,6 +5,7 @@ import unittest
 import os
 import json
 import time
+import threading
 from typing import Dict
 from unittest import TextTestRunner, TextTestResult
 
@@ -19,7 +20,10 @@ import terra_notebook_utils as tnu
 pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))  # noqa
 sys.path.insert(0, pkg_root)  # noqa
 
-from test.bq import log_duration, Client
+from test.bq import log_duration, get_sink
+from test.indexd import select_drs_uris
+from test.infra.concurrency import ConcurrentSuite
+from test.infra.poll import Poller
 from test.infra.testmode import staging_only
 from test.utils import (run_workflow,
                         create_terra_workspace,
@@ -35,6 +39,7 @@ from test.utils import (run_workflow,
                         import_drs_with_direct_gen3_access_token,
                         BILLING_PROJECT,
                         STAGE)
+from test.workspace_pool import WorkspacePool, reap
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +60,10 @@ class TestGen3DataAccess(unittest.TestCase):
         with open(os.path.expanduser('~/.config/gcloud/application_default_credentials.json'), 'w') as f:
             f.write(base64.decodebytes(os.environ['TEST_MULE_CREDS'].encode('utf-8')).decode('utf-8'))
         print(f'Terra [{STAGE}] Health Status:\n\n{json.dumps(check_terra_health(), indent=4)}')
+        # Clean up after earlier runs that crashed before deleting their workspaces
+        reaped = reap()
+        if reaped:
+            print(f'Deleted {len(reaped)} leftover workspaces: {reaped}')
 
     @classmethod
     def tearDownClass(cls) -> None:
@@ -126,35 +135,36 @@ class TestGen3DataAccess(unittest.TestCase):
         # md5sum should run for about 4 minutes, but may take far longer(?); give a generous timeout
         # also configurable manually via MD5SUM_TEST_TIMEOUT if held in a pending state
         start = time.time()
-        deadline = start + int(os.environ.get('MD5SUM_TEST_TIMEOUT', 60 * 60))
+        poller = Poller(timeout=int(os.environ.get('MD5SUM_TEST_TIMEOUT', 60 * 60)), initial=5, maximum=60)
         table = f'platform-dev-178517.bdc.terra_md5_latency_min_{STAGE}'
-        while True:
-            response = check_workflow_status(submission_id=submission_id)
-            status = response['status']
-            if response['workflows'][0]['status'] == "Failed":
-                log_duration(table, time.time() - start)
-                raise RuntimeError(f'The md5sum workflow did not succeed:\n{json.dumps(response, indent=4)}')
-            elif status == 'Done':
-                break
-            else:
-                now = time.time()
-                if now < deadline:
-                    print(f"md5sum workflow state is: {response['workflows'][0]['status']}. "
-                          f"Checking again in 20 seconds.")
-                    time.sleep(20)
-                else:
-                    print(json.dumps(response, indent=4))
-                    log_duration(table, time.time() - start)
-                    raise RuntimeError('The md5sum workflow run timed out.  '
-                                       f'Expected 4 minutes, but took longer than '
-                                       f'{float(now - start) / 60.0} minutes.')
+        try:
+            response = poller.wait(lambda: check_workflow_status(submission_id=submission_id),
+                                   done=lambda r: r['status'] == 'Done' or r['workflows'][0]['status'] == 'Failed',
+                                   state=lambda r: r['workflows'][0]['status'],
+                                   on_poll=lambda r, wait: print(f"md5sum workflow state is: {r['workflows'][0]['status']}. "
+                                                                 f"Checking again in {wait:.0f} seconds."))
+        except TimeoutError:
+            log_duration(table, time.time() - start)
+            raise RuntimeError('The md5sum workflow run timed out.  '
+                               f'Expected 4 minutes, but took longer than '
+                               f'{float(time.time() - start) / 60.0} minutes.')
+        finally:
+            print(f'md5sum workflow time spent per state:\n{poller.dwell_report()}')
 
         log_duration(table, time.time() - start)
+        if response['workflows'][0]['status'] == "Failed":
+            raise RuntimeError(f'The md5sum workflow did not succeed:\n{json.dumps(response, indent=4)}')
         with self.subTest('Dockstore Workflow Run Completed Successfully'):
             if response['workflows'][0]['status'] != "Succeeded":
                 raise RuntimeError(f'The md5sum workflow did not succeed:\n{json.dumps(response, indent=4)}')
 
     def test_pfb_handoff_from_gen3_to_terra(self):
+        if os.environ.get('BDCAT_WORKSPACE_POOL'):
+            # Lease a pooled workspace instead of creating and deleting one, see test/workspace_pool.py
+            with WorkspacePool().lease() as workspace_name:
+                self._import_and_check_pfb(workspace_name)
+            return
+
         time_stamp = datetime.datetime.now().strftime("%Y_%m_%d_%H%M%S")
         workspace_name = f'integration_test_pfb_gen3_to_terra_{time_stamp}_delete_me'
 
@@ -163,20 +173,7 @@ class TestGen3DataAccess(unittest.TestCase):
             self.assertTrue('workspaceId' in response)
             self.assertTrue(response['createdBy'] == 'biodata.integration.test.mule@gmail.com')
 
-        with self.subTest('Import static pfb into the terra workspace.'):
-            response = import_pfb(workspace=workspace_name,
-                                  pfb_file='https://cdistest-public-test-bucket.s3.amazonaws.com/export_2020-06-02T17_33_36.avro')
-            self.assertTrue('jobId' in response)
-
-        with self.subTest('Check on the import static pfb job status.'):
-            response = pfb_job_status_in_terra(workspace=workspace_name, job_id=response['jobId'])
-            # this should take < 60 seconds
-            while response['status'] in ['Translating', 'ReadyForUpsert', 'Upserting', 'Pending']:
-                time.sleep(2)
-                response = pfb_job_status_in_terra(workspace=workspace_name, job_id=response['jobId'])
-            self.assertTrue(response['status'] == 'Done',
-                            msg=f'Expecting status: "Done" but got "{response["status"]}".\n'
-                                f'Full response: {json.dumps(response, indent=4)}')
+        self._import_and_check_pfb(workspace_name)
 
         with self.subTest('Delete the terra workspace.'):
             response = delete_terra_workspace(workspace=workspace_name)
@@ -188,6 +185,24 @@ class TestGen3DataAccess(unittest.TestCase):
             response = delete_terra_workspace(workspace=workspace_name)
             self.assertTrue(response.status_code == 404)
 
+    def _import_and_check_pfb(self, workspace_name):
+        with self.subTest('Import static pfb into the terra workspace.'):
+            response = import_pfb(workspace=workspace_name,
+                                  pfb_file='https://cdistest-public-test-bucket.s3.amazonaws.com/export_2020-06-02T17_33_36.avro')
+            self.assertTrue('jobId' in response)
+
+        with self.subTest('Check on the import static pfb job status.'):
+            job_id = response['jobId']
+            # this should take < 60 seconds
+            poller = Poller(timeout=30 * 60, initial=1, maximum=10)
+            response = poller.wait(lambda: pfb_job_status_in_terra(workspace=workspace_name, job_id=job_id),
+                                   done=lambda r: r['status'] not in ['Translating', 'ReadyForUpsert', 'Upserting', 'Pending'],
+                                   state=lambda r: r['status'])
+            print(f'PFB import time spent per state:\n{poller.dwell_report()}')
+            self.assertTrue(response['status'] == 'Done',
+                            msg=f'Expecting status: "Done" but got "{response["status"]}".\n'
+                                f'Full response: {json.dumps(response, indent=4)}')
+
     @staging_only
     def test_public_data_access(self):
         # this DRS URI only exists on staging/alpha and requires os.environ['TERRA_DEPLOYMENT_ENV'] = 'alpha'
@@ -255,28 +270,16 @@ class TestGen3DataAccess(unittest.TestCase):
 
     @staging_only
     def test_import_drs_from_gen3(self):
-        # TODO: This commented out section SHOULD be how we check for the ACL and DRS files we don't
-        #  have access to, but this is giving problems, so have to hardcode known restricted files.
-        # public_uris = ['drs://dg.712C/60df2552-3d67-4f21-b637-5b53684fe444',
-        #                'drs://dg.712C/a83118b2-8fdc-42de-9de2-5ddb27efb8eb',
-        #                'drs://dg.712C/a84c1bcf-1975-402f-a973-ff7a307a2e90',
-        #                'drs://dg.712C/b7a10338-6fb6-4201-adde-0ee933e069bc',
-        #                'drs://dg.712C/2d9692bb-2050-4742-b7ae-42a83de6129e',
-        #                'drs://dg.712C/39474412-fc6d-4dbc-81c2-176db2403130']
-        #
-        # response = requests.get(
-        #     'https://staging.gen3.biodatacatalyst.nhlbi.nih.gov/index/index?'
-        #     'negate_params={"acl":["*","admin","topmed",'
-        #     '"phs000888", "phs000681", "phs001014", "phs001095", "phs001215", '
-        #     '"phs001544", "phs001395", "phs000169", "phs000636", "phs000820", '
-        #     '"phs000971", "phs000984", "phs000292", "phs000997", "phs000944", '
-        #     '"phs000304", "phs000209", "phs000538", "phs000353"]}')
-        # restricted_records = [r['did'] for r in response.json()['records'] if r['did'] not in public_uris]
-        # drs_uri = random.choice(restricted_records)
+        # A restricted file, picked at random from a crawl of indexd (see scripts/crawl_indexd.py) if there is
+        # one, otherwise a known restricted file
+        crawled = os.environ.get('BDCAT_INDEXD_RECORDS')
+        restricted = select_drs_uris(crawled, 'restricted') if crawled else []
+        drs_uri = restricted[0] if restricted else 'drs://dg.712C/01229405-6ce4-4ad7-aa04-19124afadebc'
+        logger.info('Checking that access to %s is denied', drs_uri)
 
         # first try to download the file and we should be denied
         # only downloads the first byte even if successful to keep it short
-        response = import_drs_with_direct_gen3_access_token('drs://dg.712C/01229405-6ce4-4ad7-aa04-19124afadebc')
+        response = import_drs_with_direct_gen3_access_token(drs_uri)
         self.assertEqual(response.status_code, 401)  # not a 403?
 
     # @staging_only
@@ -295,51 +298,83 @@ class SaveResult(TextTestResult):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.tests_run: Dict[unittest.TestCase, str] = {}
+        self.durations: Dict[unittest.TestCase, float] = {}
+        self._started: Dict[unittest.TestCase, float] = {}
+        # Tests may report concurrently, see ConcurrentSuite
+        self._lock = threading.RLock()
 
     def startTest(self, test):
-        super().startTest(test)
-        self.tests_run[test] = 'started'
+        with self._lock:
+            super().startTest(test)
+            self.tests_run[test] = 'started'
+            self._started[test] = time.monotonic()
+
+    def stopTest(self, test):
+        with self._lock:
+            super().stopTest(test)
+            self.durations[test] = time.monotonic() - self._started.pop(test)
 
     def addSuccess(self, test) -> None:
-        super().addSuccess(test)
-        self.tests_run[test] = 'success'
+        with self._lock:
+            super().addSuccess(test)
+            self.tests_run[test] = 'success'
 
     def addFailure(self, test, err) -> None:
-        super().addFailure(test, err)
-        self.tests_run[test] = 'failure'
+        with self._lock:
+            super().addFailure(test, err)
+            self.tests_run[test] = 'failure'
 
     def addError(self, test, err) -> None:
-        super().addError(test, err)
-        self.tests_run[test] = 'error'
+        with self._lock:
+            super().addError(test, err)
+            self.tests_run[test] = 'error'
 
     def addSkip(self, test, reason) -> None:
-        super().addSkip(test, reason)
-        self.tests_run[test] = 'skip'
+        with self._lock:
+            super().addSkip(test, reason)
+            self.tests_run[test] = 'skip'
 
     def addUnexpectedSuccess(self, test) -> None:
-        super().addUnexpectedSuccess(test)
-        self.tests_run[test] = 'failure'
+        with self._lock:
+            super().addUnexpectedSuccess(test)
+            self.tests_run[test] = 'failure'
 
     def addExpectedFailure(self, test, err) -> None:
-        super().addExpectedFailure(test, err)
-        self.tests_run[test] = 'success'
+        with self._lock:
+            super().addExpectedFailure(test, err)
+            self.tests_run[test] = 'success'
+
+    def addSubTest(self, test, subtest, err) -> None:
+        with self._lock:
+            super().addSubTest(test, subtest, err)
 
 
 class SaveResultRunner(TextTestRunner):
     resultclass = SaveResult
 
+    # Set BDCAT_TEST_WORKERS to more than 1 to run the test methods concurrently
+    workers = int(os.environ.get('BDCAT_TEST_WORKERS', 1))
+
+    def run(self, test):
+        if self.workers > 1:
+            test = ConcurrentSuite(test, workers=self.workers)
+        return super().run(test)
+
 
 if __name__ == "__main__":
     test_run = unittest.main(verbosity=2, exit=False, testRunner=SaveResultRunner)
     results: SaveResult = test_run.result
     timestamp = datetime.datetime.now()
-    client = Client()
+    client = get_sink()
     for test, status in results.tests_run.items():
         # Unfortunately this is the only way to get the test method name from the TestCase
         test_name = test._testMethodName
         try:
             # To create tables, skip all tests and set create to True:
             client.log_test_results(test_name, status, timestamp, create=False)
+            if status in ('success', 'failure', 'error'):
+                client.log_test_duration(test_name, STAGE, results.durations[test], timestamp)
         except Exception as e:
             logger.exception('Failed to log test %r', test, exc_info=e)
+    client.flush()
     sys.exit(not results.wasSuccessful())
@@ -0,0 +1,1418 @@
+#!/usr/bin/env python3
+"""Offline tests for the harness itself (test/infra); these need no credentials or network."""
+import asyncio
+import base64
+import contextlib
+import os
+import datetime
+import doctest
+import hashlib
+import importlib.util
+import io
+import json
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+import zlib
+from unittest import mock
+
+import aiohttp
+import jwt
+import requests
+
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
+
+from test.infra.aio import async_retry, client_session
+from test.infra.auth import AccessTokenCache, Gen3Credentials
+from test.infra.checksums import compare, hash_file, hash_url
+from test.infra.concurrency import ConcurrentSuite
+from test.infra import drs_cache, gitlab
+from test.infra.drs_cache import SignedURLCache
+from test.infra.poll import Poller
+from test.infra import sb_broker
+from test.infra.sb_broker import SBEnv, SevenBridgesBrokerClient, TestPlan, format_results
+from test.infra.retry import CircuitBreaker, CircuitOpenError, RetryMetrics, retry, retry_after
+from test.infra import sessions
+from test.infra.sessions import PooledSession
+from test.infra.timing import ConnectionTimer
+from test.infra.standin import MOCK_USER, StandIn
+from test import gen3_versions, indexd, trends
+from test.metrics import BufferedClient, JSONLBackend, SQLiteBackend
+from test.trends import Series, analyze, mann_whitney_p
+
+
+class TestPoller(unittest.TestCase):
+    def test_waits_for_terminal_state(self):
+        states = iter(['Pending', 'Pending', 'Running', 'Done'])
+        seen = []
+        poller = Poller(timeout=10, initial=0.001, maximum=0.01)
+        result = poller.wait(lambda: next(states),
+                             done=lambda s: s == 'Done',
+                             on_poll=lambda s, wait: seen.append(s))
+        self.assertEqual(result, 'Done')
+        self.assertEqual(seen, ['Pending', 'Pending', 'Running'])
+        self.assertEqual(poller.polls, 4)
+        self.assertEqual(set(poller.dwell_times), {'Pending', 'Running', 'Done'})
+        self.assertGreater(poller.dwell_times['Pending'], 0)
+
+    def test_backs_off_and_resets_on_state_change(self):
+        states = iter(['A', 'A', 'A', 'B', 'B', 'C'])
+        waits = []
+        poller = Poller(timeout=10, initial=0.001, maximum=0.004, factor=2, jitter=0)
+        poller.wait(lambda: next(states), done=lambda s: s == 'C', on_poll=lambda s, wait: waits.append(wait))
+        self.assertEqual(waits, [0.001, 0.002, 0.004, 0.001, 0.002])
+
+    def test_timeout(self):
+        poller = Poller(timeout=0.01, initial=0.001, maximum=0.001)
+        with self.assertRaises(TimeoutError):
+            poller.wait(lambda: 'Pending', done=lambda s: False)
+
+
+def http_error(status_code, url='https://rawls.test/api', headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = url
+    response.headers.update(headers or {})
+    return requests.exceptions.HTTPError(response=response)
+
+
+@mock.patch('test.infra.retry.time.sleep')
+class TestRetry(unittest.TestCase):
+    def test_every_call_gets_every_retry(self, sleep):
+        attempts = []
+
+        @retry(intervals=[1, 1])
+        def fails_twice(n):
+            attempts.append(n)
+            if attempts.count(n) <= 2:
+                raise ValueError(n)
+            return n
+
+        self.assertEqual([fails_twice(1), fails_twice(2)], [1, 2])
+        self.assertEqual(len(attempts), 6)
+        self.assertEqual(sleep.call_count, 4)
+        self.assertTrue(all(0 <= call.args[0] <= 1 for call in sleep.call_args_list))
+
+    def test_gives_up(self, sleep):
+        @retry(intervals=[1, 1], jitter=False)
+        def always_fails():
+            raise ValueError()
+
+        self.assertRaises(ValueError, always_fails)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [1, 1])
+
+    def test_error_codes(self, sleep):
+        @retry(error_codes={503}, circuit_breaker=None)
+        def not_found():
+            raise http_error(404)
+
+        self.assertRaises(requests.exceptions.HTTPError, not_found)
+        sleep.assert_not_called()
+
+    def test_retry_after(self, sleep):
+        self.assertEqual(retry_after(http_error(429, headers={'Retry-After': '7'})), 7.0)
+        self.assertEqual(retry_after(http_error(500, headers={'Retry-After': '7'})), None)
+        self.assertEqual(retry_after(http_error(503, headers={'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})), 0.0)
+        errors = iter([http_error(503, headers={'Retry-After': '3'})])
+
+        @retry(error_codes={503}, intervals=[1], circuit_breaker=None)
+        def throttled():
+            for e in errors:
+                raise e
+
+        throttled()
+        self.assertEqual(sleep.call_args.args[0], 3.0)
+
+    def test_budget(self, sleep):
+        @retry(error_codes={429}, intervals=[1, 1], budget=5, circuit_breaker=None)
+        def throttled():
+            raise http_error(429, headers={'Retry-After': '60'})
+
+        self.assertRaises(requests.exceptions.HTTPError, throttled)
+        sleep.assert_not_called()
+
+    def test_circuit_breaker(self, sleep):
+        breaker = CircuitBreaker(threshold=3, cooldown=60)
+
+        @retry(error_codes={502}, intervals=[1] * 10, circuit_breaker=breaker)
+        def down():
+            raise http_error(502)
+
+        self.assertRaises(CircuitOpenError, down)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertTrue(breaker.is_open('rawls.test'))
+        self.assertFalse(breaker.is_open('orc.test'))
+        breaker.record_success('rawls.test')
+        self.assertFalse(breaker.is_open('rawls.test'))
+
+    def test_custom_schedule_without_breaker(self, sleep):
+        intervals = [1, 1, 2, 4, 8, 16, 32, 64]
+        breaker = CircuitBreaker(threshold=3, cooldown=60)
+        # Other calls have opened the circuit of the host
+        for _ in range(3):
+            breaker.record_failure('rawls.test')
+
+        def job_status(failures):
+            for e in failures:
+                raise e
+            return 'Done'
+
+        with_breaker = retry(error_codes={503}, intervals=intervals, jitter=False, circuit_breaker=breaker)(job_status)
+        self.assertRaises(CircuitOpenError, with_breaker, iter([http_error(503)]))
+        sleep.assert_not_called()
+
+        # Like test.utils.pfb_job_status_in_terra, which must wait out its whole schedule
+        without_breaker = retry(error_codes={503}, intervals=intervals, jitter=False, circuit_breaker=None)(job_status)
+        self.assertEqual(without_breaker(iter([http_error(503)] * len(intervals))), 'Done')
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], intervals)
+
+    def test_metrics(self, sleep):
+        from test.infra import retry as retry_module
+        with mock.patch.object(retry_module, 'metrics', RetryMetrics()):
+            @retry(intervals=[1, 1], jitter=False)
+            def fails_once(calls=[]):
+                calls.append(1)
+                if len(calls) == 1:
+                    raise ValueError()
+
+            fails_once()
+            counts = retry_module.metrics.snapshot()
+        self.assertEqual(counts, {fails_once.__qualname__: {'calls': 1, 'retries': 1, 'sleep_seconds': 1}})
+
+
+class TestAio(unittest.TestCase):
+    def setUp(self):
+        self.server = StandIn().start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_async_retry(self):
+        statuses = []
+
+        @async_retry(error_codes={503}, intervals=[0.01] * 5, circuit_breaker=None)
+        async def health(session):
+            async with session.get(f'{self.server.url}/status') as resp:
+                statuses.append(resp.status)
+                # Recover after the first failure
+                self.server.error_rate = 0.0
+                resp.raise_for_status()
+                return await resp.json()
+
+        async def main():
+            async with client_session() as session:
+                return await health(session)
+
+        self.server.error_rate = 1.0
+        self.assertTrue(asyncio.run(main())['ok'])
+        self.assertEqual(statuses, [503, 200])
+
+    def test_poller_wait_async(self):
+        states = iter(['Pending', 'Running', 'Done'])
+
+        async def check():
+            return next(states)
+
+        poller = Poller(timeout=10, initial=0.001, maximum=0.01)
+        self.assertEqual(asyncio.run(poller.wait_async(check, done=lambda s: s == 'Done')), 'Done')
+        self.assertEqual(poller.polls, 3)
+
+
+class TestChecksums(unittest.TestCase):
+    def test_hash_file(self):
+        data = os.urandom(100_000)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            checksums = hash_file(f.name, ['md5', 'sha256', 'crc'], chunk_size=4096)
+        self.assertEqual(checksums, {'md5': hashlib.md5(data).hexdigest(),
+                                     'sha256': hashlib.sha256(data).hexdigest(),
+                                     'crc': f'{zlib.crc32(data):08x}'})
+
+    def test_hash_empty_file(self):
+        with tempfile.NamedTemporaryFile() as f:
+            self.assertEqual(hash_file(f.name, ['md5', 'crc32c']),
+                             {'md5': hashlib.md5(b'').hexdigest(), 'crc32c': '00000000'})
+
+    def test_hash_url(self):
+        server = StandIn().start()
+        try:
+            record = requests.get(f'{server.url}/index/dg.712C/abc').json()
+            for size in (None, record['size']):
+                checksums = hash_url(f'{server.url}/gcs/abc', ['md5', 'crc', 'crc32c'], size=size, chunk_size=100, workers=3)
+                self.assertEqual(compare(checksums, record['hashes']), {'md5': True, 'crc': True})
+            with self.assertRaises(RuntimeError):
+                hash_url(f'{server.url}/gcs/abc', size=record['size'] + 1, chunk_size=100)
+
+            # An empty object, whose size is known or answered with a 416
+            empty = {'md5': hashlib.md5(b'').hexdigest(), 'crc32c': '00000000'}
+            requests_made = server.requests
+            self.assertEqual(hash_url(f'{server.url}/gcs/empty', size=0), empty)
+            self.assertEqual(server.requests, requests_made)
+            self.assertEqual(hash_url(f'{server.url}/gcs/empty'), empty)
+
+            # A transient server error is retried
+            def recover(seconds):
+                server.error_rate = 0.0
+
+            server.error_rate = 1.0
+            with mock.patch('test.infra.retry.time.sleep', side_effect=recover) as sleep:
+                checksums = hash_url(f'{server.url}/gcs/abc', ['md5', 'crc'], chunk_size=100, workers=3)
+            self.assertEqual(compare(checksums, record['hashes']), {'md5': True, 'crc': True})
+            self.assertEqual(sleep.call_count, 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestIndexdCrawl(unittest.TestCase):
+    def setUp(self):
+        self.server = StandIn(index_size=250).start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'records.jsonl')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_crawl(self):
+        self.assertEqual(indexd.crawl(self.path, self.server.url, limit=20, workers=4), 250)
+        dids = [record['did'] for record in indexd.read_records(self.path)]
+        self.assertEqual(len(set(dids)), 250)
+        self.assertEqual(dids, sorted(dids), 'Expected pages to be written in order')
+
+        requests_made = self.server.requests
+        self.assertEqual(indexd.crawl(self.path, self.server.url, limit=20), 250)
+        self.assertEqual(self.server.requests, requests_made, 'Expected a finished crawl not to be repeated')
+
+    def test_resume(self):
+        real_fetch_page = indexd.fetch_page
+
+        def fetch_page(gen3_domain, page, *args):
+            if page == 5:
+                raise RuntimeError('interrupted')
+            return real_fetch_page(gen3_domain, page, *args)
+
+        with mock.patch.object(indexd, 'fetch_page', fetch_page):
+            with self.assertRaises(RuntimeError):
+                indexd.crawl(self.path, self.server.url, limit=20, workers=2)
+        self.assertEqual(len(list(indexd.read_records(self.path))), 5 * 20)
+        with open(self.path, 'a') as f:
+            f.write('{"did": "partly written')
+        self.assertEqual(indexd.crawl(self.path, self.server.url, limit=20, workers=2), 250)
+        self.assertEqual(len({r['did'] for r in indexd.read_records(self.path)}), 250)
+        with self.assertRaises(ValueError):
+            indexd.crawl(self.path, self.server.url, limit=50)
+
+    def test_select_drs_uris(self):
+        indexd.crawl(self.path, self.server.url, limit=100)
+        uris = indexd.select_drs_uris(self.path, 'restricted', count=5, seed=1)
+        self.assertEqual(len(uris), 5)
+        for uri in uris:
+            number = int(uri.split('/')[-1].split('-')[0])
+            self.assertEqual(number % 3, 2, 'Expected only phs000007 records')
+        self.assertEqual(len(indexd.select_drs_uris(self.path, 'public', count=1000)), 84)
+        self.assertEqual(doctest.testmod(indexd).failed, 0)
+
+
+class TestSignedURLCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'drs_cache.sqlite')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_expiry(self):
+        cache = SignedURLCache(self.path, margin=60)
+        now = int(time.time())
+        fresh = f'https://storage.googleapis.com/b/o?GoogleAccessId=x&Expires={now + 3600}&Signature=y'
+        self.assertTrue(cache.put('gen3', 'me', 'dg.712C/a', fresh))
+        self.assertFalse(cache.put('gen3', 'me', 'dg.712C/b', fresh.replace(str(now + 3600), str(now + 30))))
+        self.assertFalse(cache.put('gen3', 'me', 'dg.712C/c', 'https://storage.googleapis.com/b/o'))
+
+        # Another process sees the same entries
+        other = SignedURLCache(self.path, margin=60)
+        self.assertEqual(other.get_entry('gen3', 'me', 'dg.712C/a'), dict(url=fresh, expires=now + 3600))
+        self.assertIsNone(other.get('other-gen3', 'me', 'dg.712C/a'))
+        self.assertIsNone(other.get('gen3', 'me', 'dg.712C/b'))
+        self.assertEqual((other.hits, other.misses), (1, 2))
+
+        self.assertIsNone(SignedURLCache(self.path, margin=7200).get('gen3', 'me', 'dg.712C/a'))
+        cache.invalidate('gen3', 'me', 'dg.712C/a')
+        self.assertIsNone(other.get('gen3', 'me', 'dg.712C/a'))
+
+    def test_identity(self):
+        cache = SignedURLCache(self.path)
+        url = f'https://storage.googleapis.com/b/o?Expires={int(time.time()) + 3600}'
+        me, you = drs_cache.fingerprint('my-token'), drs_cache.fingerprint('your-token')
+        self.assertNotEqual(me, you)
+        cache.put('gen3', me, 'dg.712C/a', url)
+        self.assertEqual(cache.get('gen3', me, 'dg.712C/a'), url)
+        # A URL fence signed for one user is never handed to another
+        self.assertIsNone(cache.get('gen3', you, 'dg.712C/a'))
+        cache.invalidate('gen3', you, 'dg.712C/a')
+        self.assertEqual(cache.get('gen3', me, 'dg.712C/a'), url)
+
+    def test_older_schema_kept(self):
+        url = f'https://storage.googleapis.com/b/o?Expires={int(time.time()) + 3600}'
+        with sqlite3.connect(self.path) as conn:
+            conn.execute('CREATE TABLE signed_urls (domain TEXT NOT NULL, guid TEXT NOT NULL, url TEXT NOT NULL, '
+                         'expires REAL NOT NULL, metadata TEXT, PRIMARY KEY (domain, guid))')
+            conn.execute('INSERT INTO signed_urls VALUES (?, ?, ?, ?, NULL)', ('gen3', 'dg.712C/a', url, time.time() + 3600))
+        conn.close()
+        cache = SignedURLCache(self.path)
+        # Whom the older entries belong to is unknown, so they aren't handed out, but neither are they deleted
+        self.assertIsNone(cache.get('gen3', 'me', 'dg.712C/a'))
+        self.assertTrue(cache.put('gen3', 'me', 'dg.712C/a', url))
+        with sqlite3.connect(self.path) as conn:
+            self.assertEqual(conn.execute('SELECT guid, url FROM signed_urls').fetchall(), [('dg.712C/a', url)])
+        conn.close()
+
+    def test_doctests(self):
+        self.assertEqual(doctest.testmod(drs_cache).failed, 0)
+
+
+class TestSevenBridgesBroker(unittest.TestCase):
+    def setUp(self):
+        self.server = StandIn(step_seconds=0.1).start()
+        self.broker = SevenBridgesBrokerClient(token='token', base_url=self.server.url)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_run_test_plans(self):
+        plans = [TestPlan(SBEnv.staging, 'sbgtests.plans.bdc'),
+                 TestPlan(SBEnv.production, 'sbgtests.plans.bdc'),
+                 TestPlan(SBEnv.staging, 'sbgtests.plans.bdc', subset=['test_a', 'test_fails'])]
+        start = time.monotonic()
+        with mock.patch.object(self.broker, 'iter_report_results', wraps=self.broker.iter_report_results) as stream:
+            results = self.broker.run_test_plans(plans, timeout=10, poll_frequency=0.1)
+        self.assertLess(time.monotonic() - start, 2, 'Expected the plans to run at once')
+        self.assertEqual([result.plan for result in results], plans)
+        self.assertEqual([result.passed for result in results], [True, True, False])
+        self.assertEqual(results[2].failed_tests, ['test_fails'])
+        self.assertEqual(results[2].summary.states, {'PASSED': 1, 'FAILED': 1})
+        # Each report is streamed once
+        self.assertEqual(sorted(call[0][0] for call in stream.call_args_list), sorted(r.task_id for r in results))
+        self.assertIn('failed: test_fails', format_results(results))
+
+    def test_run_sharded(self):
+        [previous] = self.broker.run_test_plans([TestPlan(SBEnv.staging, 'sbgtests.plans.bdc')], poll_frequency=0.1)
+        durations = sb_broker.report_durations(self.broker.get_report_by_id(previous.task_id))
+        results = sb_broker.run_sharded(self.broker, SBEnv.staging, 'sbgtests.plans.bdc', previous.task_id, shards=3)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(result.passed for result in results))
+        subsets = [result.plan.subset for result in results]
+        self.assertEqual(sorted(sum(subsets, [])), sorted(durations))
+        loads = [sum(durations[t] for t in subset) for subset in subsets]
+        self.assertLessEqual(max(loads) - min(loads), max(durations.values()))
+
+        merged = sb_broker.merge_summaries((result.summary for result in results), top=2)
+        self.assertEqual(merged['states'], {'PASSED': len(durations)})
+        self.assertEqual(merged['task_ids'], [result.task_id for result in results])
+        self.assertAlmostEqual(merged['total_seconds'], sum(durations.values()))
+        self.assertEqual([timing['test'] for timing in merged['slowest']],
+                         sorted(durations, key=durations.get, reverse=True)[:2])
+        json.dumps(merged)
+
+    def test_execute_sharded(self):
+        [previous] = self.broker.run_test_plans([TestPlan(SBEnv.staging, 'sbgtests.plans.bdc')], poll_frequency=0.1)
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(sb_broker, 'SevenBridgesBrokerClient', return_value=self.broker):
+            backend = JSONLBackend(tmp)
+            merged = sb_broker.execute_sharded(SBEnv.staging, 'sbgtests.plans.bdc', previous.task_id, shards=3,
+                                               metrics=backend, table_id='sb_test_timings')
+            rows = backend.read_table('sb_test_timings')
+        # Every test of every shard is recorded
+        previous_report = self.broker.get_report_by_id(previous.task_id)
+        self.assertEqual(sorted(row['test'] for row in rows), sorted(result['id'] for result in previous_report['results']))
+        self.assertEqual({row['task_id'] for row in rows}, set(merged['task_ids']))
+
+    def test_shard(self):
+        self.assertEqual(sb_broker.shard(['a', 'b'], 4), [['a'], ['b']])
+        self.assertEqual(sb_broker.shard([], 4), [])
+        self.assertEqual(doctest.testmod(sb_broker).failed, 0)
+
+    def test_ingest_report(self):
+        [result] = self.broker.run_test_plans([TestPlan(SBEnv.staging, 'sbgtests.plans.bdc', subset=['a', 'b_fails', 'c'])],
+                                              poll_frequency=0.1)
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = JSONLBackend(tmp)
+            with mock.patch.object(backend, 'create_table', wraps=backend.create_table) as create_table:
+                summary = sb_broker.ingest_report(self.broker, result.task_id, SBEnv.staging, backend, 'sb_test_timings',
+                                                  top=2)
+            rows = backend.list_table('sb_test_timings', limit=10)
+        # The table is created before the first row
+        [(table_id, schema), _] = create_table.call_args
+        self.assertEqual((table_id, [field.name for field in schema]),
+                         ('sb_test_timings', ['t', 'task_id', 'environment', 'test', 'state', 'd']))
+        durations = sb_broker.report_durations(self.broker.get_report_by_id(result.task_id))
+        self.assertEqual(summary.states, {'PASSED': 2, 'FAILED': 1})
+        self.assertEqual(summary.failed_tests, ['b_fails'])
+        self.assertEqual(summary.total_seconds, sum(durations.values()))
+        self.assertEqual([timing.test for timing in summary.slowest], sorted(durations, key=durations.get, reverse=True)[:2])
+        self.assertEqual([(row['task_id'], row['environment'], row['test']) for row in rows],
+                         [(result.task_id, 'staging', test) for test in ('a', 'b_fails', 'c')])
+        self.assertIn(f'1. {summary.slowest[0].seconds:8.1f}s', sb_broker.format_ranking(summary))
+
+    def test_iter_json_array(self):
+        report = {'id': 'task', 'meta': {'results_url': 'x'},
+                  'results': [{'id': f'test_{i}', 'state': 'PASSED', 'duration': i * 1.5, 'name': 'é ü'} for i in range(50)]}
+        data = json.dumps(report, ensure_ascii=False).encode('utf-8')
+        for size in (1, 7, 64, len(data)):
+            chunks = (data[i:i + size] for i in range(0, len(data), size))
+            self.assertEqual(list(sb_broker.iter_json_array(chunks, 'results')), report['results'])
+        self.assertEqual(list(sb_broker.iter_json_array([b'{"results": [1, 23', b'4, 5]}'], 'results')), [1, 234, 5])
+        with self.assertRaises(ValueError):
+            list(sb_broker.iter_json_array([b'{"other": []}'], 'results'))
+
+        # A chunk that ends inside a multi-byte character, or is empty, decodes to nothing
+        data = '{"zz": "ünï", "results": [{}]}'.encode('utf-8')
+        split = data.index(b'\xc3') + 1
+        self.assertEqual(list(sb_broker.iter_json_array([data[:split], data[split:]], 'results')), [{}])
+        self.assertEqual(list(sb_broker.iter_json_array([b'{"results": [1', b'', b']}'], 'results')), [1])
+
+        # Only the key of the top-level object counts, not an earlier value or nested key
+        decoys = {'name': 'results', 'note': '"results": [', 'plan': {'results': [0], 'x': '\\"]}'}, 'n': -1.5e3,
+                  'ok': True, 'results': [1, {'results': [2]}]}
+        data = json.dumps(decoys).encode('utf-8')
+        for size in (1, 5, len(data)):
+            chunks = (data[i:i + size] for i in range(0, len(data), size))
+            self.assertEqual(list(sb_broker.iter_json_array(chunks, 'results')), [1, {'results': [2]}])
+        with self.assertRaises(ValueError):
+            list(sb_broker.iter_json_array([b'{"name": "results", "plan": {"results": [0]}}'], 'results'))
+
+    def test_timeout(self):
+        self.server.step_seconds = 60
+        [result] = self.broker.run_test_plans([TestPlan(SBEnv.staging, 'sbgtests.plans.bdc')],
+                                              timeout=0.3, poll_frequency=0.1)
+        self.assertEqual((result.state, result.passed), ('TIMEOUT', False))
+
+
+class TestPipelineListener(unittest.TestCase):
+    def setUp(self):
+        self.server = StandIn(step_seconds=60).start()
+        self.finished = []
+        self.listener = gitlab.PipelineListener(secret='s3cret', on_final=self.finished.append).start()
+
+    def tearDown(self):
+        self.listener.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def webhook(self, pipeline_id, status, token='s3cret'):
+        event = {'object_kind': 'pipeline', 'object_attributes': {'id': pipeline_id, 'status': status}}
+        return requests.post(self.listener.url, json=event, headers={'X-Gitlab-Token': token})
+
+    def trigger(self) -> str:
+        return str(requests.post(f'{self.server.url}/api/v4/projects/3/trigger/pipeline?token=t&ref=master').json()['id'])
+
+    def test_secret_required(self):
+        for secret in (None, ''):
+            with self.assertRaises(ValueError):
+                gitlab.PipelineListener(secret=secret)
+        self.assertEqual(self.listener.server_address[0], '127.0.0.1')
+
+    def test_refuses_webhooks_without_secret(self):
+        event = {'object_kind': 'pipeline', 'object_attributes': {'id': 1, 'status': 'success'}}
+        self.assertEqual(requests.post(self.listener.url, json=event).status_code, 401)
+        for token in ('wrong', 's3cre', 's3cret2'):
+            self.assertEqual(self.webhook(1, 'success', token=token).status_code, 401)
+        self.assertEqual((self.listener.events, self.listener.statuses, self.finished), (0, {}, []))
+        self.assertIsNone(self.listener.wait(1, timeout=0.1))
+
+    def test_webhooks(self):
+        self.assertEqual(self.webhook(1, 'success', token='wrong').status_code, 401)
+        self.assertIsNone(self.listener.wait(1, timeout=0.1))
+        self.assertEqual(self.webhook(1, 'running').status_code, 200)
+        self.assertIsNone(self.listener.wait(1, timeout=0.1))
+        self.webhook(1, 'failed')
+        self.assertEqual(self.listener.wait(1, timeout=0.1), 'failed')
+        self.assertEqual([event['object_attributes']['status'] for event in self.finished], ['failed'])
+
+    def test_wait_for_pipeline(self):
+        pipeline = self.trigger()
+        threading.Timer(0.2, self.webhook, args=(pipeline, 'success')).start()
+        start = time.monotonic()
+        status = gitlab.wait_for_pipeline(self.server.url, 3, pipeline, 'token', listener=self.listener, fallback=30)
+        self.assertEqual(status, 'success')
+        self.assertLess(time.monotonic() - start, 5, 'Expected the webhook to end the wait')
+
+        # Without a webhook, polling finds the final status
+        self.server.step_seconds = 0.1
+        pipeline = self.trigger()
+        status = gitlab.wait_for_pipeline(self.server.url, 3, pipeline, 'token', listener=self.listener, fallback=0.1)
+        self.assertEqual(status, 'success')
+
+    def test_wait_for_pipelines(self):
+        self.server.step_seconds = 0.1
+        pipelines = [(self.server.url, 3, str(gitlab.trigger_pipeline(self.server.url, 3, ref, 'token')['id']))
+                     for ref in ('master', 'fail', 'release')]
+        changes = []
+        statuses = gitlab.wait_for_pipelines(pipelines, 'token', on_change=changes.append)
+        self.assertEqual([statuses[p] for p in pipelines], ['success', 'failed', 'success'])
+        self.assertEqual(changes[-1], statuses)
+
+        # A webhook ends the wait long before the next poll
+        self.server.step_seconds = 60
+        pipelines = [(self.server.url, 3, self.trigger()) for _ in range(2)]
+        for i, (_, _, pipeline_id) in enumerate(pipelines):
+            threading.Timer(0.1 * (i + 1), self.webhook, args=(pipeline_id, 'success')).start()
+        start = time.monotonic()
+        statuses = gitlab.wait_for_pipelines(pipelines, 'token', listener=self.listener, fallback=30)
+        self.assertEqual(set(statuses.values()), {'success'})
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_watch_pipelines(self):
+        pipelines = [(self.server.url, 3, self.trigger()) for _ in range(3)]
+        notified = []
+
+        async def on_done(pipeline, details):
+            notified.append((pipeline, details))
+
+        async def watch():
+            loop = asyncio.get_running_loop()
+            for i, (_, _, pipeline_id) in enumerate(pipelines):
+                loop.call_later(0.1 * (i + 1), self.webhook, pipeline_id, 'success' if i else 'canceled')
+            return await gitlab.watch_pipelines(pipelines + [missing], 'token', on_done,
+                                                listener=self.listener, fallback=30)
+
+        missing = (self.server.url, 3, '999')
+        statuses = asyncio.run(watch())
+        self.assertEqual([statuses[p] for p in pipelines], ['canceled', 'success', 'success'])
+        self.assertEqual([pipeline for pipeline, _ in notified], pipelines)
+        self.assertEqual(statuses[missing], 'error')
+        # With the final status from the webhook, and the rest of the pipeline from the API
+        _, details = notified[0]
+        self.assertEqual(details['status'], 'canceled')
+        self.assertEqual(details['web_url'], f'{self.server.url}/project-3/-/pipelines/{pipelines[0][2]}')
+        self.assertEqual(details['user']['name'], 'Integration Test Mule')
+
+
+class TestRunIntegrationTests(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.dict(os.environ, GITLAB_READ_TOKEN='read', GITLAB_TRIGGER_TOKEN='trigger'):
+            self.script = load_script('run_integration_tests')
+        self.server = StandIn(step_seconds=0.05).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_targets(self):
+        Target = self.script.Target
+        self.assertEqual(self.script.targets([3], [], []), [Target(3, 'master')])
+        # Each stage runs on the branch whose pipelines run its jobs
+        self.assertEqual(self.script.targets([3], [], ['staging', 'prod']),
+                         [Target(3, 'master', 'staging'), Target(3, 'prod', 'prod')])
+        self.assertEqual(self.script.targets([3, 4], ['feature'], ['prod']),
+                         [Target(3, 'feature', 'prod'), Target(4, 'feature', 'prod')])
+        for branch, stage in (('master', 'prod'), ('staging', 'prod'), ('prod', 'staging')):
+            with self.assertRaises(ValueError):
+                self.script.targets([3], [branch], [stage])
+        # Each pipeline once
+        self.assertEqual(self.script.targets([3, 3], ['feature', 'feature'], ['prod', 'prod']),
+                         [Target(3, 'feature', 'prod')])
+        with self.assertRaises(ValueError):
+            self.script.targets([3], ['feature'], ['staging', 'prod'])
+
+    def test_stages(self):
+        with mock.patch.object(self.script.gitlab, 'trigger_pipeline', wraps=self.script.gitlab.trigger_pipeline) as trigger, \
+                self.assertRaises(SystemExit) as e, contextlib.redirect_stdout(io.StringIO()):
+            self.script.main(['--host', self.server.url, '--stage', 'staging', '--stage', 'prod'])
+        self.assertEqual(e.exception.code, 0)
+        self.assertEqual(sorted(ref for _, ref in self.server.pipelines.values()), ['master', 'prod'])
+        # The jobs set BDCAT_STAGE themselves
+        self.assertEqual([call.kwargs.get('variables') for call in trigger.call_args_list], [None, None])
+
+        with self.assertRaises(SystemExit) as e, contextlib.redirect_stderr(io.StringIO()):
+            self.script.main(['--host', self.server.url, '--stage', 'prod', '--branch', 'master'])
+        self.assertEqual(e.exception.code, 2)
+
+    def test_exit_code(self):
+        # A single pipeline fails unless it succeeds, like several do
+        for status in ('failed', 'canceled', 'skipped'):
+            with mock.patch.object(self.script.gitlab, 'wait_for_pipeline', return_value=status), \
+                    contextlib.redirect_stdout(io.StringIO()):
+                with self.assertRaises(RuntimeError):
+                    self.script.main(['--host', self.server.url])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.script.main(['--host', self.server.url])
+
+
+class TestGen3Versions(unittest.TestCase):
+    def setUp(self):
+        self.server = StandIn().start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_fetch_versions(self):
+        commons = {'local': self.server.url, 'down': 'http://127.0.0.1:1'}
+        versions = gen3_versions.fetch_versions(commons, timeout=2)
+        self.assertEqual(len(versions), 2 * len(gen3_versions.SERVICES))
+        self.assertEqual(versions[('local', 'indexd')].version, gen3_versions.Version('2022.1'))
+        self.assertIsNotNone(versions[('down', 'indexd')].error)
+        self.assertIn('2022.01', gen3_versions.format_matrix(versions))
+
+        requests_made = self.server.requests
+        gen3_versions.fetch_versions({'local': self.server.url})
+        self.assertEqual(self.server.requests, requests_made, 'Expected the versions to be cached')
+
+    def test_semver_precedence(self):
+        # The example of the SemVer spec, plus build metadata and numeric identifiers past 9
+        ordered = ['1.0.0-alpha', '1.0.0-alpha.1', '1.0.0-alpha.beta', '1.0.0-beta', '1.0.0-beta.2',
+                   '1.0.0-beta.11', '1.0.0-rc.1', '1.0.0-rc.2', '1.0.0-rc.10', '1.0.0', '1.0.1']
+        versions = [gen3_versions.Version(v) for v in ordered]
+        self.assertEqual(sorted(reversed(versions)), versions)
+        build = gen3_versions.Version('1.0.0+build.7')
+        self.assertEqual((build, hash(build), build.pre_release, build.build),
+                         (versions[-2], hash(versions[-2]), None, 'build.7'))
+        self.assertEqual(gen3_versions.Version('1.0.0-rc.1+build').pre_release, 'rc.1')
+
+    def test_doctests(self):
+        self.assertEqual(doctest.testmod(gen3_versions).failed, 0)
+
+
+class TestLocalMetricsBackends(unittest.TestCase):
+    def check_backend(self, backend):
+        table_id = 'platform-dev-178517.bdc.integration_tests_test_example'
+        backend.create_test_table(table_id)
+        backend.create_test_table(table_id)  # already exists, which is fine
+        backend.log_test_results('test_example', 'success', '2022-01-01 00:00:00')
+        backend.log_test_results('test_example', 'skip', '2022-01-02 00:00:00')
+        backend.add_rows(table_id, [{'t': '2022-01-03 00:00:00', 'u': 0, 'd': 1, 'm': 0}])
+        self.assertEqual(backend.list_table(table_id),
+                         [{'u': 1, 'd': 0, 'm': 0, 't': '2022-01-01 00:00:00'},
+                          {'t': '2022-01-03 00:00:00', 'u': 0, 'd': 1, 'm': 0}])
+        self.assertEqual(len(backend.list_table(table_id, limit=1)), 1)
+        self.assertEqual(backend.list_table('missing'), [])
+
+    def test_sqlite(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.check_backend(SQLiteBackend(os.path.join(tmp, 'metrics.sqlite')))
+
+    def test_log_test_duration_creates_its_table(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = JSONLBackend(tmp)
+            with mock.patch.object(backend, 'create_table', wraps=backend.create_table) as create_table:
+                for test_name in ('test_a', 'test_b'):
+                    backend.log_test_duration(test_name, 'staging', 90, '2022-01-01 00:00:00')
+            table_id = 'platform-dev-178517.bdc.integration_test_durations_staging'
+            self.assertEqual([call.args[0] for call in create_table.call_args_list], [table_id])
+            self.assertTrue(os.path.exists(os.path.join(tmp, table_id + '.schema.json')))
+            self.assertEqual([row['d'] for row in backend.list_table(table_id)], [1.5, 1.5])
+
+    def test_jsonl(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.check_backend(JSONLBackend(tmp))
+
+
+class TestBufferedClient(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backend = SQLiteBackend(os.path.join(self.tmp.name, 'metrics.sqlite'))
+        self.error = None
+        add_rows = self.backend.add_rows
+
+        def flaky_add_rows(table_id, rows):
+            if self.error is not None:
+                raise self.error
+            add_rows(table_id, rows)
+
+        self.backend.add_rows = flaky_add_rows
+        self.spool_path = os.path.join(self.tmp.name, 'spool.jsonl')
+        self.dead_letter_path = os.path.join(self.tmp.name, 'rejected.jsonl')
+        self.client = BufferedClient(lambda: self.backend, max_rows=3,
+                                     spool_path=self.spool_path, dead_letter_path=self.dead_letter_path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read_lines(self, path):
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_batches(self):
+        self.client.add_rows('t', [{'i': 0}, {'i': 1}])
+        self.assertEqual(self.backend.list_table('t'), [])
+        self.client.add_row('t', {'i': 2})
+        self.assertEqual(len(self.backend.list_table('t')), 3)
+
+    def test_spools_transient_errors(self):
+        self.client.add_row('t', {'i': 0})
+        for error in (requests.exceptions.ConnectionError(), http_error(503), http_error(429)):
+            self.error = error
+            self.client.flush()
+            self.assertEqual(len(self.read_lines(self.spool_path)), 1)
+        self.assertEqual(self.read_lines(self.dead_letter_path), [])
+        self.error = None
+        self.client.flush()
+        self.assertEqual(self.backend.list_table('t'), [{'i': 0}])
+        self.assertFalse(os.path.exists(self.spool_path))
+
+    def test_drops_permanent_errors(self):
+        for error in (http_error(404), http_error(400), RuntimeError('Encountered errors while inserting rows')):
+            self.error = error
+            self.client.add_row('t', {'error': str(error)})
+            self.client.flush()
+        self.assertFalse(os.path.exists(self.spool_path))
+        rejected = self.read_lines(self.dead_letter_path)
+        self.assertEqual([entry['row'] for entry in rejected], [{'error': entry['error']} for entry in rejected])
+        self.assertEqual(len(rejected), 3)
+        # Never retried
+        self.error = None
+        self.client.flush()
+        self.assertEqual(self.backend.list_table('t'), [])
+
+
+class TestTrends(unittest.TestCase):
+    now = datetime.datetime(2022, 3, 1)
+
+    def backend_with(self, tmp, baseline, current):
+        backend = SQLiteBackend(os.path.join(tmp, 'metrics.sqlite'))
+        rows = [{'t': str(self.now - datetime.timedelta(days=8 + i % 20, hours=i)), 'd': d} for i, d in enumerate(baseline)]
+        rows += [{'t': str(self.now - datetime.timedelta(days=i % 6, hours=i)), 'd': d} for i, d in enumerate(current)]
+        backend.add_rows('durations', rows)
+        return backend
+
+    def test_mann_whitney(self):
+        self.assertLess(mann_whitney_p([1, 2, 3, 4, 5, 6], [7, 8, 9, 10, 11, 12]), 0.01)
+        self.assertGreater(mann_whitney_p([7, 8, 9, 10, 11, 12], [1, 2, 3, 4, 5, 6]), 0.99)
+        self.assertEqual(mann_whitney_p([1, 1, 1], [1, 1, 1]), 1.0)
+
+    def test_flags_regression(self):
+        rng = random.Random(42)
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = self.backend_with(tmp,
+                                        baseline=[rng.gauss(4, 0.3) for _ in range(40)],
+                                        current=[rng.gauss(6, 0.3) for _ in range(10)])
+            [report] = analyze(backend, Series('durations', 'd'), now=self.now)
+            self.assertTrue(report['regression'])
+            self.assertGreater(report['median_ratio'], 1.3)
+
+    def test_ignores_noise(self):
+        rng = random.Random(42)
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = self.backend_with(tmp,
+                                        baseline=[rng.gauss(4, 0.3) for _ in range(40)],
+                                        current=[rng.gauss(4, 0.3) for _ in range(10)])
+            [report] = analyze(backend, Series('durations', 'd'), now=self.now)
+            self.assertFalse(report['regression'])
+
+    def test_default_series(self):
+        # Only tables that every CI run writes to, so that the gate never fails on a missing one
+        tables = {series.table_id for series in trends.default_series('prod')}
+        self.assertEqual(tables, {'platform-dev-178517.bdc.terra_md5_latency_min_prod',
+                                  'platform-dev-178517.bdc.integration_test_durations_prod'})
+        self.assertEqual({series.column for series in trends.drs_hop_series('prod')},
+                         {'gen3_total_seconds', 'gs_total_seconds'})
+
+    def test_doctests(self):
+        self.assertEqual(doctest.testmod(trends).failed, 0)
+
+
+class TestAccessTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.fetches = 0
+        self.fetch_lock = threading.Lock()
+
+    def fetch(self, ttl=3600, delay=0.0):
+        time.sleep(delay)
+        with self.fetch_lock:
+            self.fetches += 1
+            return f'token-{self.fetches}', time.time() + ttl
+
+    def test_single_flight_refresh(self):
+        cache = AccessTokenCache(lambda: self.fetch(delay=0.1))
+        barrier = threading.Barrier(8)
+        tokens = []
+
+        def get():
+            barrier.wait()
+            tokens.append(cache.get())
+
+        threads = [threading.Thread(target=get) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(tokens, ['token-1'] * 8)
+        self.assertEqual(self.fetches, 1)
+
+    def test_refreshes_near_expiry(self):
+        cache = AccessTokenCache(lambda: self.fetch(ttl=10), refresh_margin=60)
+        self.assertEqual([cache.get(), cache.get()], ['token-1', 'token-2'])
+        cache = AccessTokenCache(lambda: self.fetch(ttl=120), refresh_margin=60)
+        self.assertEqual([cache.get(), cache.get()], ['token-3', 'token-3'])
+
+    def test_invalidate(self):
+        cache = AccessTokenCache(self.fetch)
+        self.assertEqual(cache.headers({'Accept': 'text/plain'}),
+                         {'Accept': 'text/plain', 'Authorization': 'Bearer token-1'})
+        cache.invalidate()
+        self.assertEqual([cache.get(), cache.get()], ['token-2', 'token-2'])
+
+    def test_invalidate_refused_token(self):
+        cache = AccessTokenCache(self.fetch)
+        self.assertEqual(cache.get(), 'token-1')
+        cache.invalidate('token-1')
+        self.assertEqual(cache.get(), 'token-2')
+        # Another caller refused the old token doesn't drop the new one
+        cache.invalidate('token-1')
+        self.assertEqual(cache.get(), 'token-2')
+
+    def test_invalidate_after_refresh(self):
+        cache = AccessTokenCache(self.fetch)
+
+        class InvalidatingLock:
+            """Invalidates the cache as soon as the refresh releases the lock, before get() returns"""
+            armed = True
+            lock = threading.Lock()
+
+            def __enter__(self):
+                self.lock.acquire()
+
+            def __exit__(self, *exc_info):
+                self.lock.release()
+                if self.armed:
+                    self.armed = False
+                    cache.invalidate()
+
+        cache._lock = InvalidatingLock()
+        self.assertEqual(cache.get(), 'token-1')
+        self.assertEqual(cache.get(), 'token-2')
+
+
+class TestGen3Credentials(unittest.TestCase):
+    def setUp(self):
+        self.server = StandIn().start()
+        api_key = jwt.encode({'iss': f'{self.server.url}/user'}, 'test')
+        api_key = api_key.decode('utf-8') if isinstance(api_key, bytes) else api_key
+        self.credentials = Gen3Credentials(base64.encodebytes(api_key.encode('utf-8')).decode('utf-8'))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_hostname(self):
+        self.assertEqual(self.credentials.hostname, self.server.url)
+
+    def test_mints_once(self):
+        threads = [threading.Thread(target=self.credentials.access_token) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        token = self.credentials.access_token()
+        self.assertEqual(self.server.requests, 1)
+        self.assertGreater(jwt.decode(token, verify=False)['exp'], time.time())
+        self.assertEqual(self.credentials.headers(), {'Authorization': f'Bearer {token}'})
+        self.credentials.invalidate()
+        self.credentials.access_token()
+        self.assertEqual(self.server.requests, 2)
+
+
+class TestConcurrentSuite(unittest.TestCase):
+    def test_fixtures_and_output(self):
+        events = []
+        module = types.ModuleType('concurrent_suite_fixtures')
+        module.setUpModule = lambda: events.append('setUpModule')
+        module.tearDownModule = lambda: events.append('tearDownModule')
+        sys.modules[module.__name__] = module
+        self.addCleanup(sys.modules.pop, module.__name__)
+        # Only passed if the three tests run at once
+        barrier = threading.Barrier(3, timeout=10)
+
+        class Cases(unittest.TestCase):
+            @classmethod
+            def setUpClass(cls):
+                events.append('setUpClass')
+
+            @classmethod
+            def tearDownClass(cls):
+                events.append('tearDownClass')
+
+            def run_case(self):
+                print(f'{self._testMethodName} started')
+                barrier.wait()
+                print(f'{self._testMethodName} finished')
+                events.append(self._testMethodName)
+
+            test_a = test_b = test_c = run_case
+
+        class Broken(unittest.TestCase):
+            @classmethod
+            def setUpClass(cls):
+                raise RuntimeError('setUpClass failed')
+
+            def test_never_runs(self):
+                events.append('test_never_runs')
+
+        Cases.__module__ = Broken.__module__ = module.__name__
+        loader = unittest.defaultTestLoader
+        suite = unittest.TestSuite([loader.loadTestsFromTestCase(Cases), loader.loadTestsFromTestCase(Broken)])
+        stream = io.StringIO()
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            result = unittest.TextTestRunner(stream=stream, verbosity=2).run(ConcurrentSuite(suite, workers=3))
+
+        self.assertEqual(events[:2], ['setUpModule', 'setUpClass'])
+        self.assertEqual(sorted(events[2:5]), ['test_a', 'test_b', 'test_c'])
+        self.assertEqual(events[5:], ['tearDownClass', 'tearDownModule'])
+        self.assertEqual(result.testsRun, 3)
+        [(error, _)] = result.errors
+        self.assertIn('setUpClass', str(error))
+        for name in ('test_a', 'test_b', 'test_c'):
+            self.assertIn(f'{name} started\n{name} finished\n', stdout.getvalue())
+            self.assertRegex(stream.getvalue(), rf'(?m)^{name} \(.*\) \.\.\. ok$')
+
+
+class TestSessions(unittest.TestCase):
+    def setUp(self):
+        self.server = StandIn().start()
+
+    def tearDown(self):
+        sessions.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuses_connections(self):
+        session = sessions.get_session(self.server.url)
+        with ConnectionTimer() as timer:
+            for _ in range(3):
+                session.get(f'{self.server.url}/status').raise_for_status()
+        self.assertEqual(timer.connections, 1)
+
+    def test_one_session_per_domain(self):
+        session = sessions.get_session(f'{self.server.url}/api/workspaces')
+        self.assertIs(sessions.get_session(self.server.url.upper()), session)
+        self.assertIsNot(sessions.get_session('https://other.test'), session)
+
+    def test_configure(self):
+        sessions.configure('https://configured.test', pool_size=3, timeout=5)
+        session = sessions.get_session('https://configured.test/path')
+        self.assertEqual((session.adapters['https://']._pool_maxsize, session.timeout), (3, 5))
+
+    def test_resize_closes_replaced_pools(self):
+        session = sessions.get_session(self.server.url)
+        session.get(f'{self.server.url}/status').raise_for_status()
+        old = session.adapters['http://']
+        self.assertEqual(len(old.poolmanager.pools), 1)
+        sessions.configure(self.server.url, pool_size=2)
+        new = session.adapters['http://']
+        self.assertIsNot(new, old)
+        self.assertIs(session.adapters['https://'], new)
+        self.assertEqual(new._pool_maxsize, 2)
+        self.assertEqual(len(old.poolmanager.pools), 0)
+        session.get(f'{self.server.url}/status').raise_for_status()
+
+
+class TestConnectionTimer(unittest.TestCase):
+    def test_phases(self):
+        server = StandIn(latency=0.05).start()
+        try:
+            session = PooledSession()
+            phases = ('dns_seconds', 'connect_seconds', 'tls_seconds', 'ttfb_seconds')
+            with ConnectionTimer() as first:
+                session.get(f'{server.url}/status').raise_for_status()
+            self.assertEqual(first.connections, 1)
+            self.assertTrue(all(getattr(first, phase) >= 0 for phase in phases))
+            self.assertGreater(first.dns_seconds + first.connect_seconds, 0)
+            self.assertGreaterEqual(first.ttfb_seconds, 0.05)
+            with ConnectionTimer() as reused:
+                session.get(f'{server.url}/status').raise_for_status()
+                session.get(f'{server.url}/status').raise_for_status()
+            self.assertEqual((reused.connections, reused.dns_seconds, reused.connect_seconds, reused.tls_seconds),
+                             (0, 0.0, 0.0, 0.0))
+            self.assertGreaterEqual(reused.ttfb_seconds, 0.1)
+            # Outside of a timer nothing is recorded
+            session.get(f'{server.url}/status').raise_for_status()
+            self.assertEqual(reused.connections, 0)
+            session.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def installed(module: str) -> bool:
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ImportError:  # a parent package is missing
+        return False
+
+
+def load_script(name: str) -> types.ModuleType:
+    """Import one of the scripts/, which aren't a package."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(pkg_root, 'scripts', f'{name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestBenchmarks(unittest.TestCase):
+    def run_benchmarks(self, *args) -> dict:
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'benchmarks.json')
+            # In a process of its own, since the script sets BDCAT_STAGE=local before test.utils is imported
+            process = subprocess.run([sys.executable, os.path.join(pkg_root, 'scripts', 'run_benchmarks.py'),
+                                      '-n', '10', '--workers', '2', '--output', output, *args],
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=120)
+            self.assertEqual(process.returncode, 0, process.stderr)
+            with open(output) as f:
+                report = json.load(f)
+            if '--compare' not in args:
+                # Compare the run with itself
+                self.assertEqual(self.run_benchmarks(*args, '--compare', output)['config'], report['config'])
+            else:
+                self.assertIn('(x', process.stderr)
+            return report
+
+    def test_harness_benchmarks(self):
+        report = self.run_benchmarks('--benchmark', 'retry_overhead', '--benchmark', 'poller_wakeup')
+        self.assertEqual(report['config'], dict(n=10, workers=2, latency=0.0))
+        results = report['results']
+        self.assertEqual(set(results), {'retry_overhead', 'poller_wakeup'})
+        self.assertEqual(results['retry_overhead']['decorated']['n'], 1000)
+        self.assertEqual(results['retry_overhead']['one_retry']['n'], 10)
+        self.assertEqual(results['poller_wakeup']['lateness']['n'], 2)
+
+    @unittest.skipUnless(installed('terra_notebook_utils'), 'test.utils needs terra_notebook_utils')
+    def test_helper_benchmarks(self):
+        results = self.run_benchmarks('--benchmark', 'helpers', '--benchmark', 'tokens', '--latency', '0.001')['results']
+        self.assertEqual(set(results['helpers']), {'check_terra_health', 'check_workflow_status',
+                                                   'pfb_job_status_in_terra', 'import_drs_from_gen3'})
+        for helper in results['helpers'].values():
+            self.assertEqual((helper['serial']['n'], helper['concurrent']['n']), (10, 10))
+        self.assertEqual(results['tokens']['gen3_exchange']['n'], 10)
+
+    @unittest.skipUnless(installed('terra_notebook_utils') and installed('google.cloud.bigquery'),
+                         'test_basic_submission needs terra_notebook_utils and google-cloud-bigquery')
+    def test_save_result_benchmark(self):
+        results = self.run_benchmarks('--benchmark', 'save_result')['results']
+        self.assertEqual((results['save_result']['serial']['n'], results['save_result']['concurrent']['workers']), (100, 2))
+
+
+@unittest.skipUnless(installed('terra_notebook_utils'), 'test.async_utils needs terra_notebook_utils')
+class TestAsyncClient(unittest.TestCase):
+    def setUp(self):
+        from test import async_utils
+        self.async_utils = async_utils
+        self.server = StandIn(step_seconds=0).start()
+        self.fetches = 0
+        self.token = AccessTokenCache(self.fetch_token)
+        patcher = mock.patch.multiple(async_utils, RAWLS_DOMAIN=self.server.url, ORC_DOMAIN=self.server.url,
+                                      GEN3_DOMAIN=self.server.url, BILLING_PROJECT='ns', terra_token=self.token)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fetch_token(self):
+        self.fetches += 1
+        return f'token-{self.fetches}', time.time() + 3600
+
+    def run_client(self, coroutine_function):
+        async def main():
+            async with self.async_utils.AsyncClient() as client:
+                return client, await coroutine_function(client)
+        return asyncio.run(main())
+
+    def test_requests(self):
+        async def lifecycle(client):
+            await client.create_terra_workspace('ws')
+            job_id = (await client.import_pfb('ws', 'gs://bucket/test.avro'))['jobId']
+            status = await client.wait_for_pfb_import('ws', job_id, Poller(timeout=10, initial=0.01, maximum=0.1))
+            drs_bytes = await client.import_drs_from_gen3('drs://dg.712C/abc')
+            return status['status'], drs_bytes, [await client.delete_terra_workspace('ws') for _ in range(2)]
+
+        client, result = self.run_client(lifecycle)
+        self.assertEqual(result, ('Done', b'\x00\x01', [202, 404]))
+        self.assertTrue(client.session.closed)
+
+    def test_session_required(self):
+        client = self.async_utils.AsyncClient()
+        with self.assertRaises(RuntimeError):
+            client.session
+
+    @mock.patch('test.infra.aio.asyncio.sleep')
+    def test_retries_server_errors(self, sleep):
+        async def recover(seconds):
+            self.server.error_rate = 0.0
+
+        sleep.side_effect = recover
+        self.server.error_rate = 1.0
+        _, health = self.run_client(lambda client: client.check_terra_health())
+        self.assertTrue(health['ok'])
+        self.assertEqual((self.server.requests, sleep.call_count), (2, 1))
+
+        # Client errors are not retried
+        with self.assertRaises(aiohttp.ClientResponseError) as e:
+            self.run_client(lambda client: client.import_pfb('missing', 'gs://bucket/test.avro'))
+        self.assertEqual(e.exception.status, 404)
+        self.assertEqual(sleep.call_count, 1)
+
+    @mock.patch('test.infra.aio.asyncio.sleep')
+    def test_pfb_status_schedule(self, sleep):
+        intervals = [1, 1, 2, 4, 8, 16, 32, 64]
+
+        async def recover_last(seconds):
+            if sleep.call_count == len(intervals):
+                self.server.error_rate = 0.0
+
+        async def status(client):
+            await client.create_terra_workspace('ws')
+            job_id = (await client.import_pfb('ws', 'gs://bucket/test.avro'))['jobId']
+            self.server.error_rate = 1.0
+            return await client.pfb_job_status_in_terra('ws', job_id)
+
+        sleep.side_effect = recover_last
+        # Like utils.pfb_job_status_in_terra: every interval in full, past the point the shared breaker opens
+        _, result = self.run_client(status)
+        self.assertEqual(result['status'], 'Done')
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], intervals)
+
+    def test_refreshes_token_on_401(self):
+        self.assertEqual(self.token.get(), 'token-1')
+        self.server.revoked_tokens.add('token-1')
+
+        async def create(client):
+            # Every request is refused the same token at once, and one new token is minted
+            return await asyncio.gather(*[client.create_terra_workspace(f'ws{i}') for i in range(4)])
+
+        self.run_client(create)
+        self.assertEqual(self.fetches, 2)
+        self.assertEqual(len(self.server.workspaces), 4)
+        # If the new token is refused too, the 401 is raised
+        self.server.revoked_tokens.update({'token-2', 'token-3'})
+        with self.assertRaises(aiohttp.ClientResponseError) as e:
+            self.run_client(lambda client: client.check_workflow_status('missing'))
+        self.assertEqual((e.exception.status, self.fetches), (401, 3))
+
+    def test_pfb_load_test_cleans_up(self):
+        pfb_load_test = load_script('pfb_load_test')
+        args = types.SimpleNamespace(workspaces=4, pfbs=1, pfb=['gs://bucket/test.avro'], concurrency=4,
+                                     timeout=10, poll_initial=0.01, poll_maximum=0.1)
+        create, calls = self.async_utils.AsyncClient.create_terra_workspace, []
+
+        async def lose_response(client, workspace):
+            # The second workspace is created, but the response is lost on the way back
+            calls.append(workspace)
+            await create(client, workspace)
+            if workspace == calls[1]:
+                raise aiohttp.ServerDisconnectedError()
+
+        with mock.patch.object(self.async_utils.AsyncClient, 'create_terra_workspace', lose_response):
+            with self.assertRaises(aiohttp.ServerDisconnectedError):
+                asyncio.run(pfb_load_test.load_test(args))
+        self.assertEqual(self.server.workspaces, {})
+
+        # And after a successful run
+        result = asyncio.run(pfb_load_test.load_test(args))
+        self.assertEqual((result['summary']['done'], self.server.workspaces), (4, {}))
+
+
+@unittest.skipUnless(installed('terra_notebook_utils'), 'test.utils needs terra_notebook_utils')
+class TestWorkspacePool(unittest.TestCase):
+    def setUp(self):
+        from test import utils, workspace_pool
+        self.workspace_pool = workspace_pool
+        self.server = StandIn().start()
+        patcher = mock.patch.multiple(utils, RAWLS_DOMAIN=self.server.url, BILLING_PROJECT='ns',
+                                      terra_token=AccessTokenCache(lambda: ('token', time.time() + 3600)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pools = [workspace_pool.WorkspacePool(prefix='pool_', settle_seconds=0) for _ in range(2)]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def lease(self, name: str) -> str:
+        return self.server.workspaces[('ns', name)]['attributes'].get(self.workspace_pool.LEASE_ATTRIBUTE, '')
+
+    def test_stale_listing(self):
+        a, b = self.pools
+        a.release(a.acquire())
+        list_workspaces, leased = self.workspace_pool.list_terra_workspaces, []
+
+        def list_then_lease():
+            # a lists the free workspace, then b leases it before a gets to write its lease
+            listing = list_workspaces()
+            if not leased:
+                leased.append(None)
+                leased.append(b.acquire())
+            return listing
+
+        with mock.patch.object(self.workspace_pool, 'list_terra_workspaces', list_then_lease):
+            name = a.acquire()
+        self.assertNotEqual(name, leased[1])
+        self.assertTrue(self.lease(leased[1]).startswith(b.owner + '@'))
+        self.assertTrue(self.lease(name).startswith(a.owner + '@'))
+        b.release(leased[1])
+        self.assertEqual(self.lease(leased[1]), '')
+
+    def test_concurrent_leases(self):
+        a, b = self.pools
+        a.release(a.acquire())
+        leased = []
+
+        def settle(seconds):
+            # b tries to lease the workspace while a waits to confirm its own lease
+            if not leased:
+                leased.append(None)
+                leased.append(b.acquire())
+
+        with mock.patch.object(self.workspace_pool, 'time', types.SimpleNamespace(time=time.time, sleep=settle)):
+            name = a.acquire()
+        self.assertNotEqual(name, leased[1])
+        self.assertTrue(self.lease(name).startswith(a.owner + '@'))
+        self.assertTrue(self.lease(leased[1]).startswith(b.owner + '@'))
+        # Both pooled workspaces are leased now
+        with self.assertRaises(RuntimeError):
+            self.workspace_pool.WorkspacePool(prefix='pool_', max_size=2, settle_seconds=0).acquire()
+
+
+@unittest.skipUnless(installed('terra_notebook_utils'), 'test.utils needs terra_notebook_utils')
+class TestCheckDrsAccess(unittest.TestCase):
+    def test_checksums(self):
+        from test import drs
+        uris = [f'drs://dg.712C/{i}' for i in range(4)] + ['drs://dg.712C/denied', 'drs://dg.712C/mismatch', '']
+        # Every accessible object is verified at once, so this only passes if the workers verify them
+        verifying = threading.Barrier(5, timeout=10)
+
+        def check_drs_access(uri):
+            return dict(uri=uri, status='gen3_failed' if uri.endswith('denied') else 'ok')
+
+        def verify_drs_checksums(uri):
+            verifying.wait()
+            if uri.endswith('3'):
+                raise requests.HTTPError('403 Client Error')
+            return dict(uri=uri, ok=not uri.endswith('mismatch'))
+
+        with mock.patch.multiple(drs, check_drs_access=check_drs_access, verify_drs_checksums=verify_drs_checksums):
+            records = {r['uri']: r for r in drs.check_drs_access_many(uris, workers=8, checksums=True)}
+            self.assertNotIn('checksums', next(drs.check_drs_access_many(uris[:1], workers=1)))
+        self.assertEqual({uri: r['status'] for uri, r in records.items()},
+                         {'drs://dg.712C/0': 'ok', 'drs://dg.712C/1': 'ok', 'drs://dg.712C/2': 'ok',
+                          'drs://dg.712C/3': 'error', 'drs://dg.712C/denied': 'gen3_failed',
+                          'drs://dg.712C/mismatch': 'checksum_mismatch'})
+        for uri, record in records.items():
+            if record['status'] in ('ok', 'checksum_mismatch'):
+                self.assertEqual(record['checksums']['uri'], uri)
+        self.assertIn('403', records['drs://dg.712C/3']['error'])
+
+
+@unittest.skipUnless(installed('terra_notebook_utils'), 'test.utils needs terra_notebook_utils')
+class TestDrsCache(unittest.TestCase):
+    def setUp(self):
+        from test import utils
+        self.utils = utils
+        self.tmp = tempfile.TemporaryDirectory()
+        self.server = StandIn(token_accounts={'your-token': 'someone.else@example.org'}).start()
+        self.token = 'my-token'
+        patcher = mock.patch.multiple(utils, GEN3_DOMAIN=self.server.url,
+                                      TOKENINFO_URL=f'{self.server.url}/oauth2/v3/tokeninfo',
+                                      _drs_cache_identities={},
+                                      drs_cache=SignedURLCache(os.path.join(self.tmp.name, 'drs_cache.sqlite')),
+                                      terra_token=AccessTokenCache(lambda: (self.token, time.time() + 3600)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_access_checks_ask_fence(self):
+        self.assertEqual(self.utils.import_drs_from_gen3('drs://dg.712C/abc').content, b'\x00\x01')
+        self.assertEqual(self.utils.signed_url_from_gen3('dg.712C/abc'),
+                         self.utils.drs_cache.get(self.server.url, drs_cache.fingerprint(MOCK_USER), 'dg.712C/abc'))
+        # Access is revoked, but the cached URL is still valid
+        self.server.denied_guids.add('dg.712C/abc')
+        requests_before = self.server.requests
+        self.assertTrue(self.utils.signed_url_from_gen3('dg.712C/abc'))
+        self.assertEqual(self.server.requests, requests_before)
+        self.assertEqual(self.utils.import_drs_from_gen3('drs://dg.712C/abc', raise_for_status=False).status_code, 401)
+
+    def test_cache_per_identity(self):
+        self.assertTrue(self.utils.signed_url_from_gen3('dg.712C/abc'))
+        self.server.denied_guids.add('dg.712C/abc')
+        # Someone else doesn't get the URL that fence signed for the first user
+        self.utils.terra_token.invalidate()
+        self.token = 'your-token'
+        with self.assertRaises(requests.HTTPError):
+            self.utils.signed_url_from_gen3('dg.712C/abc')
+
+    def test_cache_per_account(self):
+        url = self.utils.signed_url_from_gen3('dg.712C/abc')
+        self.server.denied_guids.add('dg.712C/abc')
+        # The same account, with a refreshed token, in another process
+        self.utils.terra_token.invalidate()
+        self.token = 'my-refreshed-token'
+        self.utils._drs_cache_identities.clear()
+        self.assertEqual(self.utils.signed_url_from_gen3('dg.712C/abc'), url)
+        self.assertEqual(self.utils.drs_cache_identity(), drs_cache.fingerprint(MOCK_USER))
+
+    def test_unknown_account(self):
+        self.utils.TOKENINFO_URL = f'{self.server.url}/no-tokeninfo'
+        with self.assertLogs('test.utils', 'WARNING'):
+            self.assertEqual(self.utils.drs_cache_identity(), drs_cache.fingerprint('my-token'))
+
+
+class TestStandIn(unittest.TestCase):
+    def setUp(self):
+        self.server = StandIn(step_seconds=0.05).start()
+        self.session = PooledSession()
+        self.headers = {'Authorization': 'Bearer local-access-token'}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.session.close()
+
+    def test_workspace_lifecycle(self):
+        # Jobs stay in their first state until step_seconds is lowered
+        self.server.step_seconds = 3600
+        url = f'{self.server.url}/api/workspaces'
+        resp = self.session.post(url, json=dict(namespace='ns', name='ws'), headers=self.headers)
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(self.session.post(url, json=dict(namespace='ns', name='ws')).status_code, 409)
+        job_id = self.session.post(f'{url}/ns/ws/importPFB', json=dict(url='x')).json()['jobId']
+        self.assertEqual(self.session.get(f'{url}/ns/ws/importPFB/{job_id}').json()['status'], 'Pending')
+        # Without steps every job is in its last state
+        self.server.step_seconds = 0
+        self.assertEqual(self.session.get(f'{url}/ns/ws/importPFB/{job_id}').json()['status'], 'Done')
+        self.assertEqual(self.session.delete(f'{url}/ns/ws').status_code, 202)
+        self.assertEqual(self.session.delete(f'{url}/ns/ws').status_code, 404)
+
+    def test_drs_hops(self):
+        resp = self.session.get(f'{self.server.url}/user/data/download/dg.712C/abc', headers=self.headers)
+        signed_url = resp.json()['url']
+        self.assertIn('Expires=', signed_url)
+        resp = self.session.get(signed_url + '&userProject=p', headers={'Range': 'bytes=0-1'})
+        self.assertEqual((resp.status_code, resp.content), (206, b'\x00\x01'))
+        self.assertEqual(self.session.get(f'{self.server.url}/user/data/download/abc').status_code, 401)
+
+    def test_error_rate(self):
+        self.server.error_rate = 1.0
+        self.assertEqual(self.session.get(f'{self.server.url}/status').status_code, 503)
+
+
+if __name__ == "__main__":
+    unittest.main()
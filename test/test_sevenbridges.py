@@ -7,12 +7,26 @@ import unittest
 pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))  # noqa
 sys.path.insert(0, pkg_root)  # noqa
 
+from test.bq import SB_TEST_TIMINGS_TABLE, get_sink
 from test.infra.testmode import staging_only, production_only, uses_sb_broker
 from test.infra import sb_broker
 
 logger = logging.getLogger(__name__)
 
 
+# Given a previous test run of the plan, run it in this many concurrent shards instead
+SHARD_FROM = os.environ.get('BDCAT_SB_SHARD_FROM')
+SHARDS = int(os.environ.get('BDCAT_SB_SHARDS', 4))
+
+
+def execute(sb_environment: sb_broker.SBEnv, test_plan: str):
+    if SHARD_FROM:
+        sb_broker.execute_sharded(sb_environment, test_plan, SHARD_FROM, shards=SHARDS,
+                                  metrics=get_sink(), table_id=SB_TEST_TIMINGS_TABLE)
+    else:
+        sb_broker.execute(sb_environment, test_plan, metrics=get_sink(), table_id=SB_TEST_TIMINGS_TABLE)
+
+
 class TestBDCIntegration(unittest.TestCase):
 
     """Test SevenBridges integration with BDC"""
@@ -20,12 +34,12 @@ class TestBDCIntegration(unittest.TestCase):
     @staging_only
     @uses_sb_broker
     def test_bdc_staging(self):
-        sb_broker.execute(sb_broker.SBEnv.staging, 'sbgtests.plans.bdc')
+        execute(sb_broker.SBEnv.staging, 'sbgtests.plans.bdc')
 
     @production_only
     @uses_sb_broker
     def test_bdc_production(self):
-        sb_broker.execute(sb_broker.SBEnv.production, 'sbgtests.plans.bdc')
+        execute(sb_broker.SBEnv.production, 'sbgtests.plans.bdc')
 
 
 if __name__ == "__main__":
@@ -1,18 +1,25 @@
 #!/usr/bin/env python3
 import logging
 import os
-import requests
+import sys
 import unittest
 
-logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
-log = logging.getLogger(__name__)
+pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))  # noqa
+sys.path.insert(0, pkg_root)  # noqa
 
+from test.gen3_versions import COMMONS, Version, fetch_versions, format_matrix
 
-bdcat_prod_url = "https://gen3.biodatacatalyst.nhlbi.nih.gov"
-bdcat_staging_url = "https://staging.gen3.biodatacatalyst.nhlbi.nih.gov"
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger(__name__)
 
 
 class TestGen3VersionsAcrossEnvironments(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        log.info("checking the gen3 service versions on %s...", ', '.join(COMMONS))
+        cls.versions = fetch_versions()
+        log.info("gen3 service versions:\n%s", format_matrix(cls.versions))
+
     def test_staging_versus_prod_version(self):
         '''
         Assertions around release versions.
@@ -22,33 +29,25 @@ class TestGen3VersionsAcrossEnvironments(unittest.TestCase):
         If PROD is updated before staging, that means a new version
         has been released without proper cross-org testing.
 
-        >>> bdcat_prod_version = "2021.12"
-        >>> bdcat_staging_version = "2022.01"
+        >>> bdcat_prod_version = Version("2021.12")
+        >>> bdcat_staging_version = Version("2022.01")
         >>> bdcat_staging_version >= bdcat_prod_version
         True
-        >>> bdcat_prod_version = "2021.05"
-        >>> bdcat_staging_version = "2021.04"
+        >>> bdcat_prod_version = Version("2021.05")
+        >>> bdcat_staging_version = Version("2021.04")
         >>> bdcat_staging_version >= bdcat_prod_version
         False
-        >>> bdcat_staging_version = "2021.06"
-        >>> bdcat_prod_version = "2021.05"
+        >>> bdcat_staging_version = Version("2021.10")
+        >>> bdcat_prod_version = Version("2021.9")
         >>> bdcat_staging_version >= bdcat_prod_version
         True
         '''
-        log.info("checking the gen3 release version on bdcat prod...")
-        bdcat_prod_version_json = requests.get(
-            f"{bdcat_prod_url}/index/_version"
-        ).json()
-        # extract version from json payload
-        bdcat_prod_version = bdcat_prod_version_json['version']
-
-        log.info("checking the gen3 release version on bdcat staging...")
-        bdcat_staging_version_json = requests.get(
-            f"{bdcat_staging_url}/index/_version"
-        ).json()
-        bdcat_staging_version = bdcat_staging_version_json['version']
-
-        self.assertGreaterEqual(bdcat_staging_version, bdcat_prod_version)
+        bdcat_prod = self.versions[('bdcat_prod', 'indexd')]
+        bdcat_staging = self.versions[('bdcat_staging', 'indexd')]
+        self.assertIsNone(bdcat_prod.error, msg=f'{bdcat_prod.url}: {bdcat_prod.error}')
+        self.assertIsNone(bdcat_staging.error, msg=f'{bdcat_staging.url}: {bdcat_staging.error}')
+
+        self.assertGreaterEqual(bdcat_staging.version, bdcat_prod.version)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+"""
+Latency trends and regression detection over recorded durations.
+
+Reads the series written by bq.log_duration, bq.log_drs_hop_timings and the per-test
+durations of test_basic_submission.py back from any metrics backend (see test/metrics.py),
+summarizes them per window and flags statistically significant slowdowns.
+"""
+import datetime
+import math
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from test.metrics import MetricsBackend, parse_timestamp
+
+
+class Series(NamedTuple):
+    """A time series of durations: the ``column`` of ``table_id``, split by the value of ``group_by`` if given."""
+    table_id: str
+    column: str
+    group_by: Optional[str] = None
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Series':
+        """Parse "TABLE:COLUMN" or "TABLE:COLUMN:GROUP_BY"."""
+        parts = spec.split(':')
+        if len(parts) not in (2, 3):
+            raise ValueError(f'Expected TABLE:COLUMN[:GROUP_BY], not: {spec}')
+        return cls(*parts)
+
+
+def default_series(stage: str) -> List[Series]:
+    """The series that every CI run of ``stage`` records to."""
+    return [
+        Series(f'platform-dev-178517.bdc.terra_md5_latency_min_{stage}', 'd'),
+        Series(f'platform-dev-178517.bdc.integration_test_durations_{stage}', 'd', 'test'),
+    ]
+
+
+def drs_hop_series(stage: str) -> List[Series]:
+    """The series of check_drs_access.py --bigquery, which only exist once it has been run for ``stage``."""
+    return [
+        Series(f'platform-dev-178517.bdc.drs_hop_latency_{stage}', 'gen3_total_seconds'),
+        Series(f'platform-dev-178517.bdc.drs_hop_latency_{stage}', 'gs_total_seconds'),
+    ]
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """
+    The q-th percentile (0 <= q <= 100) of values, interpolating linearly between ranks.
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2.5
+    >>> percentile([1, 2, 3, 4], 100)
+    4.0
+    """
+    values = sorted(values)
+    rank = (len(values) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def summarize(values: Sequence[float]) -> dict:
+    return dict(n=len(values),
+                p50=percentile(values, 50),
+                p95=percentile(values, 95),
+                p99=percentile(values, 99))
+
+
+def mann_whitney_p(baseline: Sequence[float], current: Sequence[float]) -> float:
+    """
+    One-sided p-value of the Mann-Whitney U test that ``current`` tends to be larger than ``baseline``.
+
+    Uses the normal approximation with a tie correction, which is reasonable from about
+    five samples per side.  Being rank based, a handful of outliers (e.g. one run that hit
+    a retry storm) doesn't make a regression on its own.
+    """
+    n1, n2 = len(baseline), len(current)
+    ranked = sorted([(v, 0) for v in baseline] + [(v, 1) for v in current])
+    rank_sum, ties, i = 0.0, 0.0, 0
+    while i < len(ranked):
+        j = i
+        while j < len(ranked) and ranked[j][0] == ranked[i][0]:
+            j += 1
+        # Tied values share the average of their ranks (ranks are 1-based)
+        average_rank = (i + j + 1) / 2
+        rank_sum += average_rank * sum(1 for _, side in ranked[i:j] if side == 1)
+        ties += (j - i) ** 3 - (j - i)
+        i = j
+    u = rank_sum - n2 * (n2 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)  # with continuity correction
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def windows(rows: List[dict], column: str, days: int, now: datetime.datetime) -> Dict[datetime.date, List[float]]:
+    """Group the values of ``column`` into consecutive ``days``-long windows ending at ``now``, keyed by start date."""
+    grouped: Dict[datetime.date, List[float]] = {}
+    for row in rows:
+        if row.get(column) is None:
+            continue
+        age = (now - parse_timestamp(row['t'])).total_seconds() / 86400
+        start = (now - datetime.timedelta(days=days * (math.floor(age / days) + 1))).date()
+        grouped.setdefault(start, []).append(float(row[column]))
+    return dict(sorted(grouped.items()))
+
+
+def analyze(backend: MetricsBackend,
+            series: Series,
+            window_days: int = 7,
+            baseline_windows: int = 4,
+            history_windows: int = 8,
+            alpha: float = 0.01,
+            min_ratio: float = 1.1,
+            min_samples: int = 5,
+            now: Optional[datetime.datetime] = None) -> List[dict]:
+    """
+    Summarize one series per window and test the latest window against the ones before it.
+
+    The latest ``window_days`` are compared with the ``baseline_windows`` windows before them.
+    A group regressed if its latest values are significantly larger (p < ``alpha``) and its
+    median grew by at least ``min_ratio``.  Groups with fewer than ``min_samples`` values on
+    either side are never flagged.
+
+    :return: One report per group, with its per-window percentiles and the verdict.
+    """
+    now = now or datetime.datetime.now()
+    since = now - datetime.timedelta(days=window_days * max(history_windows, baseline_windows + 1))
+    groups: Dict[Optional[str], List[dict]] = {}
+    for row in backend.read_table(series.table_id, since=since):
+        groups.setdefault(row.get(series.group_by) if series.group_by else None, []).append(row)
+
+    reports = []
+    for group, rows in sorted(groups.items(), key=lambda item: str(item[0])):
+        by_window = windows(rows, series.column, window_days, now)
+        current_start = (now - datetime.timedelta(days=window_days)).date()
+        current = by_window.get(current_start, [])
+        baseline_start = (now - datetime.timedelta(days=window_days * (baseline_windows + 1))).date()
+        baseline = [v for start, values in by_window.items()
+                    if baseline_start <= start < current_start for v in values]
+
+        report = dict(table_id=series.table_id, column=series.column, group=group,
+                      windows={str(start): summarize(values) for start, values in by_window.items()},
+                      regression=False)
+        if len(current) >= min_samples and len(baseline) >= min_samples:
+            p_value = mann_whitney_p(baseline, current)
+            ratio = percentile(current, 50) / percentile(baseline, 50) if percentile(baseline, 50) else math.inf
+            report.update(p_value=p_value, median_ratio=ratio,
+                          regression=p_value < alpha and ratio >= min_ratio)
+        reports.append(report)
+    return reports
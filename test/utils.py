@@ -1,17 +1,23 @@
 import os
 import json
+import logging
 import requests
-import hashlib
-import functools
 import time
-import jwt
-import base64
 
-from typing import List, Set, Optional
-from requests.exceptions import HTTPError, ConnectionError
+from requests.exceptions import HTTPError, ConnectionError, RequestException
+from typing import Dict
 
 from terra_notebook_utils import gs
 
+from test.infra.auth import AccessTokenCache, Gen3Credentials
+from test.infra.checksums import hash_file
+from test.infra.drs_cache import SignedURLCache, fingerprint
+from test.infra.retry import retry
+from test.infra.sessions import get_session
+from test.infra.standin import start_standin
+
+log = logging.getLogger(__name__)
+
 STAGE = os.environ.get('BDCAT_STAGE', 'staging')
 
 if STAGE == 'prod':
@@ -24,77 +30,67 @@ elif STAGE == 'staging':
     RAWLS_DOMAIN = 'https://rawls.dsde-alpha.broadinstitute.org'
     ORC_DOMAIN = 'https://firecloud-orchestration.dsde-alpha.broadinstitute.org'
     BILLING_PROJECT = 'drs-billing-project'
+elif STAGE == 'local':
+    # An in-process stand-in for every service, for offline benchmarking; see test/infra/standin.py
+    LOCAL_DOMAIN = os.environ.get('BDCAT_STANDIN_URL') or start_standin().url
+    GEN3_DOMAIN = RAWLS_DOMAIN = ORC_DOMAIN = LOCAL_DOMAIN
+    BILLING_PROJECT = 'local-billing-project'
 else:
-    raise ValueError('Please set BDCAT_STAGE to "prod" or "staging".')
+    raise ValueError('Please set BDCAT_STAGE to "prod", "staging" or "local".')
 
+# Pooled, keep-alive sessions shared by every helper below; see test/infra/sessions.py
+rawls = get_session(RAWLS_DOMAIN)
+orc = get_session(ORC_DOMAIN)
+gen3 = get_session(GEN3_DOMAIN)
 
-def retry(intervals: Optional[List] = None,
-          errors: Optional[Set] = None,
-          error_codes: Optional[Set] = None):
-    """
-    Retry a function if it fails with any Exception defined in the "errors" set, every x seconds,
-    where x is defined by a list of floats in "intervals".  If "error_codes" are specified,
-    retry on the HTTPError return codes defined in "error_codes".
+# Says which Google account an access token belongs to
+TOKENINFO_URL = f'{LOCAL_DOMAIN}/oauth2/v3/tokeninfo' if STAGE == 'local' else 'https://oauth2.googleapis.com/tokeninfo'
 
-    Cases to consider:
-
-        error_codes ={} && errors={}
-            Retry on any Exception.
+# gs.get_access_token() doesn't report an expiry, but Google access tokens are valid for an hour
+TERRA_TOKEN_TTL = int(os.environ.get('BDCAT_TERRA_TOKEN_TTL', 60 * 60))
+if STAGE == 'local':
+    # The stand-in only checks that an Authorization header is present
+    terra_token = AccessTokenCache(lambda: ('local-access-token', time.time() + TERRA_TOKEN_TTL))
+else:
+    terra_token = AccessTokenCache(lambda: (gs.get_access_token(), time.time() + TERRA_TOKEN_TTL))
 
-        error_codes ={500} && errors={}
-        error_codes ={500} && errors={HTTPError}
-            Retry only on HTTPErrors that return status_code 500.
+# Decodes GEN3_API_KEY lazily, so it is only required by helpers that use it
+gen3_credentials = Gen3Credentials()
 
-        error_codes ={} && errors={HTTPError}
-            Retry on all HTTPErrors regardless of error code.
+# The signed URLs that gen3 resolved DRS GUIDs to, reused until they expire by every process that
+# sets BDCAT_DRS_CACHE to the same SQLite file; see test/infra/drs_cache.py
+drs_cache = SignedURLCache(os.environ['BDCAT_DRS_CACHE']) if os.environ.get('BDCAT_DRS_CACHE') else None
 
-        error_codes ={} && errors={AssertionError}
-            Only retry on AssertionErrors.
 
-    :param List[float] intervals: A list of times in seconds we keep retrying until returning failure.
-        Defaults to retrying with the following exponential backoff before failing:
-            1s, 1s, 2s, 4s, 8s
+# drs_cache_identity() by Terra token, so that Google is asked once per token
+_drs_cache_identities: Dict[str, str] = {}
 
-    :param errors: Exceptions to catch and retry on.
 
-    :param error_codes: HTTPError return codes to retry on.  The default is an empty set.
+def drs_cache_identity() -> str:
+    """
+    Whom gen3 resolves DRS GUIDs for: signed URLs are shared between runs as the same Google account.
 
-    :return: The result of the wrapped function or raise.
+    That's the account of the Terra token, which unlike the token stays the same across refreshes
+    and processes; if Google can't say whose the token is, the token itself is the identity.
     """
-    if intervals is None:
-        intervals = [1, 1, 2, 4, 8]
-    if error_codes is None:
-        error_codes = set()
-    if not error_codes and not errors:
-        errors = {Exception}
-    if error_codes and not errors:
-        errors = {HTTPError}
-
-    def decorate(func):
-        @functools.wraps(func)
-        def call(*args, **kwargs):
-            while True:
-                try:
-                    return func(*args, **kwargs)
-                except tuple(errors) as e:
-                    if not intervals:
-                        raise
-                    interval = intervals.pop(0)
-                    if isinstance(e, HTTPError):
-                        if error_codes and e.response.status_code not in error_codes:
-                            raise
-                    print(f"Error in {func}: {e}. Retrying after {interval} s...")
-                    time.sleep(interval)
-        return call
-    return decorate
+    token = terra_token.get()
+    if token not in _drs_cache_identities:
+        try:
+            resp = requests.get(TOKENINFO_URL, params={'access_token': token}, timeout=30)
+            resp.raise_for_status()
+            info = resp.json()
+            # Service account tokens without the email scope only carry their client ID
+            account = info.get('email') or info.get('sub') or info['azp']
+        except (RequestException, ValueError, KeyError) as e:
+            log.warning('Could not tell whose the Terra token is, so cached signed URLs are only '
+                        'reused while it is: %s', e)
+            account = token
+        _drs_cache_identities[token] = fingerprint(account)
+    return _drs_cache_identities[token]
 
 
 def md5sum(file_name):
-    hash = hashlib.md5()
-    with open(file_name, 'rb') as f:
-        for block in iter(lambda: f.read(size=100000), b''):
-            hash.update(block)
-    return hash.hexdigest()
+    return hash_file(file_name, ['md5'])['md5']
 
 
 @retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
@@ -102,10 +98,8 @@ def run_workflow():
     workspace = 'DRS-Test-Workspace'
     endpoint = f'{RAWLS_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}/submissions'
 
-    token = gs.get_access_token()
-    headers = {'Content-Type': 'application/json',
-               'Accept': 'application/json',
-               'Authorization': f'Bearer {token}'}
+    headers = terra_token.headers({'Content-Type': 'application/json',
+                                   'Accept': 'application/json'})
 
     # staging input: https://gen3.biodatacatalyst.nhlbi.nih.gov/files/dg.712C/fa640b0e-9779-452f-99a6-16d833d15bd0
     # md5sum: e87ecd9c771524dcc646c8baf6f8d3e2
@@ -125,7 +119,7 @@ def run_workflow():
         del data["entityType"]
         del data["entityName"]
 
-    resp = requests.post(endpoint, headers=headers, data=json.dumps(data))
+    resp = rawls.post(endpoint, headers=headers, data=json.dumps(data))
     resp.raise_for_status()
     return resp.json()
 
@@ -135,10 +129,8 @@ def import_dockstore_wf_into_terra():
     workspace = 'BDC_Dockstore_Import_Test'
     endpoint = f'{RAWLS_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}/methodconfigs'
 
-    token = gs.get_access_token()
-    headers = {'Content-Type': 'application/json',
-               'Accept': 'application/json',
-               'Authorization': f'Bearer {token}'}
+    headers = terra_token.headers({'Content-Type': 'application/json',
+                                   'Accept': 'application/json'})
 
     data = {
         "namespace": BILLING_PROJECT,
@@ -156,7 +148,7 @@ def import_dockstore_wf_into_terra():
         "deleted": False
     }
 
-    resp = requests.post(endpoint, headers=headers, data=json.dumps(data))
+    resp = rawls.post(endpoint, headers=headers, data=json.dumps(data))
     resp.raise_for_status()
     return resp.json()
 
@@ -166,11 +158,9 @@ def check_workflow_presence_in_terra_workspace():
     workspace = 'BDC_Dockstore_Import_Test'
     endpoint = f'{RAWLS_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}/methodconfigs?allRepos=true'
 
-    token = gs.get_access_token()
-    headers = {'Accept': 'application/json',
-               'Authorization': f'Bearer {token}'}
+    headers = terra_token.headers({'Accept': 'application/json'})
 
-    resp = requests.get(endpoint, headers=headers)
+    resp = rawls.get(endpoint, headers=headers)
     resp.raise_for_status()
     return resp.json()
 
@@ -181,11 +171,9 @@ def delete_workflow_presence_in_terra_workspace():
     workflow = 'UM_aligner_wdl'
     endpoint = f'{RAWLS_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}/methodconfigs/{BILLING_PROJECT}/{workflow}'
 
-    token = gs.get_access_token()
-    headers = {'Accept': 'application/json',
-               'Authorization': f'Bearer {token}'}
+    headers = terra_token.headers({'Accept': 'application/json'})
 
-    resp = requests.delete(endpoint, headers=headers)
+    resp = rawls.delete(endpoint, headers=headers)
     resp.raise_for_status()
     return {}
 
@@ -195,11 +183,9 @@ def check_workflow_status(submission_id):
     workspace = 'DRS-Test-Workspace'
     endpoint = f'{RAWLS_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}/submissions/{submission_id}'
 
-    token = gs.get_access_token()
-    headers = {'Accept': 'application/json',
-               'Authorization': f'Bearer {token}'}
+    headers = terra_token.headers({'Accept': 'application/json'})
 
-    resp = requests.get(endpoint, headers=headers)
+    resp = rawls.get(endpoint, headers=headers)
     resp.raise_for_status()
     return resp.json()
 
@@ -209,7 +195,7 @@ def check_terra_health():
     # note: the same endpoint seems to be at: https://api.alpha.firecloud.org/status
     endpoint = f'{ORC_DOMAIN}/status'
 
-    resp = requests.get(endpoint)
+    resp = orc.get(endpoint)
     resp.raise_for_status()
     return resp.json()
 
@@ -218,10 +204,8 @@ def check_terra_health():
 def create_terra_workspace(workspace):
     endpoint = f'{RAWLS_DOMAIN}/api/workspaces'
 
-    token = gs.get_access_token()
-    headers = {'Content-Type': 'application/json',
-               'Accept': 'application/json',
-               'Authorization': f'Bearer {token}'}
+    headers = terra_token.headers({'Content-Type': 'application/json',
+                                   'Accept': 'application/json'})
 
     data = dict(namespace=BILLING_PROJECT,
                 name=workspace,
@@ -229,7 +213,7 @@ def create_terra_workspace(workspace):
                 attributes={'description': ''},
                 copyFilesWithPrefix='notebooks/')
 
-    resp = requests.post(endpoint, headers=headers, data=json.dumps(data))
+    resp = rawls.post(endpoint, headers=headers, data=json.dumps(data))
 
     if resp.ok:
         return resp.json()
@@ -242,26 +226,93 @@ def create_terra_workspace(workspace):
 def delete_terra_workspace(workspace):
     endpoint = f'{RAWLS_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}'
 
-    token = gs.get_access_token()
-    headers = {'Accept': 'text/plain',
-               'Authorization': f'Bearer {token}'}
+    headers = terra_token.headers({'Accept': 'text/plain'})
 
-    resp = requests.delete(endpoint, headers=headers)
+    resp = rawls.delete(endpoint, headers=headers)
 
     return resp
 
 
+@retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
+def list_terra_workspaces():
+    endpoint = f'{RAWLS_DOMAIN}/api/workspaces'
+
+    headers = terra_token.headers({'Accept': 'application/json'})
+
+    resp = rawls.get(endpoint, headers=headers)
+    resp.raise_for_status()
+    return [w['workspace'] for w in resp.json() if w['workspace']['namespace'] == BILLING_PROJECT]
+
+
+@retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
+def get_terra_workspace(workspace):
+    endpoint = f'{RAWLS_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}'
+
+    headers = terra_token.headers({'Accept': 'application/json'})
+
+    resp = rawls.get(endpoint, headers=headers)
+    resp.raise_for_status()
+    return resp.json()['workspace']
+
+
+@retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
+def update_terra_workspace_attributes(workspace, updates: dict, removals=()):
+    endpoint = f'{RAWLS_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}'
+
+    headers = terra_token.headers({'Content-Type': 'application/json',
+                                   'Accept': 'application/json'})
+    data = [dict(op='AddUpdateAttribute', attributeName=k, addUpdateAttribute=v) for k, v in updates.items()]
+    data += [dict(op='RemoveAttribute', attributeName=k) for k in removals]
+
+    resp = rawls.patch(endpoint, headers=headers, data=json.dumps(data))
+    resp.raise_for_status()
+    return resp.json()
+
+
+@retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
+def list_entity_types(workspace):
+    endpoint = f'{RAWLS_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}/entities'
+
+    headers = terra_token.headers({'Accept': 'application/json'})
+
+    resp = rawls.get(endpoint, headers=headers)
+    resp.raise_for_status()
+    return resp.json()
+
+
+@retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
+def list_entities(workspace, entity_type):
+    endpoint = f'{RAWLS_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}/entities/{entity_type}'
+
+    headers = terra_token.headers({'Accept': 'application/json'})
+
+    resp = rawls.get(endpoint, headers=headers)
+    resp.raise_for_status()
+    return resp.json()
+
+
+@retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
+def delete_entities(workspace, entities):
+    """:param entities: (entity type, entity name) pairs."""
+    endpoint = f'{RAWLS_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}/entities/delete'
+
+    headers = terra_token.headers({'Content-Type': 'application/json'})
+    data = [dict(entityType=entity_type, entityName=name) for entity_type, name in entities]
+
+    resp = rawls.post(endpoint, headers=headers, data=json.dumps(data))
+    resp.raise_for_status()
+    return {}
+
+
 @retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
 def import_pfb(workspace, pfb_file):
     endpoint = f'{ORC_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}/importPFB'
 
-    token = gs.get_access_token()
-    headers = {'Content-Type': 'application/json',
-               'Accept': 'application/json',
-               'Authorization': f'Bearer {token}'}
+    headers = terra_token.headers({'Content-Type': 'application/json',
+                                   'Accept': 'application/json'})
     data = dict(url=pfb_file)
 
-    resp = requests.post(endpoint, headers=headers, data=json.dumps(data))
+    resp = orc.post(endpoint, headers=headers, data=json.dumps(data))
 
     if resp.ok:
         return resp.json()
@@ -272,18 +323,20 @@ def import_pfb(workspace, pfb_file):
 
 # this timeout interval maybe overkill... but...
 # if the status timesout and the job is still running,
-# the workspace may be deleted too soon, orphaning the job
+# the workspace may be deleted too soon, orphaning the job.
+# So the whole schedule is always waited out: without jitter, which would halve the expected
+# wait, and without the shared circuit breaker, which would give up after a few 5xx.
 @retry(error_codes={500, 502, 503, 504},
        errors={HTTPError, ConnectionError},
-       intervals=[1, 1, 2, 4, 8, 16, 32, 64])
+       intervals=[1, 1, 2, 4, 8, 16, 32, 64],
+       jitter=False,
+       circuit_breaker=None)
 def pfb_job_status_in_terra(workspace, job_id):
     endpoint = f'{ORC_DOMAIN}/api/workspaces/{BILLING_PROJECT}/{workspace}/importPFB/{job_id}'
-    token = gs.get_access_token()
 
-    headers = {'Accept': 'application/json',
-               'Authorization': f'Bearer {token}'}
+    headers = terra_token.headers({'Accept': 'application/json'})
 
-    resp = requests.get(endpoint, headers=headers)
+    resp = orc.get(endpoint, headers=headers)
 
     if resp.ok:
         return resp.json()
@@ -292,6 +345,13 @@ def pfb_job_status_in_terra(workspace, job_id):
         resp.raise_for_status()
 
 
+def drs_uri_to_guid(drs_uri: str) -> str:
+    if drs_uri.startswith('drs://'):
+        return drs_uri[len('drs://'):]
+    else:
+        raise ValueError(f'DRS URI is missing the "drs://" schema.  Please specify a DRS URI, not: {drs_uri}')
+
+
 def add_requester_pays_arg_to_url(url):
     endpoint, args = url.split('?', 1)
     return f'{endpoint}?userProject={BILLING_PROJECT}&{args}'
@@ -299,21 +359,50 @@ def add_requester_pays_arg_to_url(url):
 
 @retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
 def import_drs_with_direct_gen3_access_token(guid: str) -> requests.Response:
-    if guid.startswith('drs://'):
-        guid = guid[len('drs://'):]
-    else:
-        raise ValueError(f'DRS URI is missing the "drs://" schema.  Please specify a DRS URI, not: {guid}')
+    guid = drs_uri_to_guid(guid)
+    gen3_endpoint = f'https://staging.gen3.biodatacatalyst.nhlbi.nih.gov/user/data/download/{guid}'
+    return get_session(gen3_endpoint).head(gen3_endpoint, headers=gen3_credentials.headers())
+
+
+@retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
+def get_indexd_record(guid: str) -> dict:
+    """The indexd record of a GUID, with its "size", "hashes", "acl" and "urls"."""
+    resp = gen3.get(f'{GEN3_DOMAIN}/index/{guid}', headers={'Accept': 'application/json'})
+    resp.raise_for_status()
+    return resp.json()
+
+
+def request_signed_url_from_gen3(guid: str) -> requests.Response:
+    """The first hop of import_drs_from_gen3: ask gen3 (fence) for a signed google url to the object."""
+    gen3_endpoint = f'{GEN3_DOMAIN}/user/data/download/{guid}'
+    headers = terra_token.headers({'Content-Type': 'application/json',
+                                   'Accept': 'application/json'})
+    return gen3.get(gen3_endpoint, headers=headers)
 
-    gen3_api_key = base64.decodebytes(os.environ['GEN3_API_KEY'].encode('utf-8')).decode('utf-8')
 
-    decoded_api_key = jwt.decode(gen3_api_key, verify=False)
-    hostname = decoded_api_key['iss'].replace('/user', '')
+def read_first_bytes_from_gs(gs_endpoint: str) -> requests.Response:
+    """The second hop of import_drs_from_gen3: fetch the first two bytes of a signed google url."""
+    gs_endpoint_w_requester_pays = add_requester_pays_arg_to_url(gs_endpoint)
+    headers = terra_token.headers({'Content-Type': 'application/json',
+                                   'Accept': 'application/json',
+                                   # Use 'Range' header to only download the first two bytes
+                                   # https://cloud.google.com/storage/docs/json_api/v1/parameters#range
+                                   'Range': 'bytes=0-1'})
+    return get_session(gs_endpoint).get(gs_endpoint_w_requester_pays, headers=headers)
 
-    response = requests.post(f'{hostname}/user/credentials/api/access_token',
-                             data={"api_key": gen3_api_key, "Content-Type": "application/json"}).json()
-    access_token = response['access_token']
-    return requests.head(f'https://staging.gen3.biodatacatalyst.nhlbi.nih.gov/user/data/download/{guid}',
-                         headers={"Authorization": f"Bearer {access_token}"})
+
+@retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
+def signed_url_from_gen3(guid: str) -> str:
+    """The signed google url of a GUID, from drs_cache if it's enabled and has an unexpired one."""
+    cached_url = drs_cache.get(GEN3_DOMAIN, drs_cache_identity(), guid) if drs_cache else None
+    if cached_url:
+        return cached_url
+    gen3_resp = request_signed_url_from_gen3(guid)
+    gen3_resp.raise_for_status()
+    url = gen3_resp.json()['url']
+    if drs_cache:
+        drs_cache.put(GEN3_DOMAIN, drs_cache_identity(), guid, url)
+    return url
 
 
 @retry(error_codes={500, 502, 503, 504}, errors={HTTPError, ConnectionError})
@@ -322,18 +411,11 @@ def import_drs_from_gen3(guid: str, raise_for_status=True) -> requests.Response:
     Import the first byte of a DRS URI using gen3.
 
     Makes two calls, first one to gen3, which returns the link needed to make the second
-    call to the google API and fetch directly from the google bucket.
+    call to the google API and fetch directly from the google bucket.  This checks access, so
+    gen3 is always asked, never drs_cache; the url it returns is cached for later reads.
     """
-    if guid.startswith('drs://'):
-        guid = guid[len('drs://'):]
-    else:
-        raise ValueError(f'DRS URI is missing the "drs://" schema.  Please specify a DRS URI, not: {guid}')
-    gen3_endpoint = f'{GEN3_DOMAIN}/user/data/download/{guid}'
-    token = gs.get_access_token()
-    headers = {'Content-Type': 'application/json',
-               'Accept': 'application/json',
-               'Authorization': f'Bearer {token}'}
-    gen3_resp = requests.get(gen3_endpoint, headers=headers)
+    guid = drs_uri_to_guid(guid)
+    gen3_resp = request_signed_url_from_gen3(guid)
 
     if gen3_resp.ok:
         # Example of the url that gen3 returns:
@@ -343,23 +425,19 @@ def import_drs_from_gen3(guid: str, raise_for_status=True) -> requests.Response:
         #   signature_arg = 'Signature=hugehashofmanycharsincluding%=='
         #   endpoint_looks_like = f'{google_uri}?{access_id_arg}&{expires_arg}&{signature_arg}'
         gs_endpoint = gen3_resp.json()["url"]
-        gs_endpoint_w_requester_pays = add_requester_pays_arg_to_url(gs_endpoint)
-
-        # Use 'Range' header to only download the first two bytes
-        # https://cloud.google.com/storage/docs/json_api/v1/parameters#range
-        headers['Range'] = 'bytes=0-1'
-
-        gs_resp = requests.get(gs_endpoint_w_requester_pays, headers=headers)
+        gs_resp = read_first_bytes_from_gs(gs_endpoint)
         if gs_resp.ok:
+            if drs_cache:
+                drs_cache.put(GEN3_DOMAIN, drs_cache_identity(), guid, gs_endpoint)
             return gs_resp
         else:
             if raise_for_status:
-                print(f'Gen3 url call succeeded for: {gen3_endpoint} with: {gen3_resp.json()} ...\n'
-                      f'BUT the subsequent google called failed: {gs_endpoint_w_requester_pays} with: {gs_resp.content}')
+                print(f'Gen3 url call succeeded for: {gen3_resp.url} with: {gen3_resp.json()} ...\n'
+                      f'BUT the subsequent google called failed: {gs_resp.url} with: {gs_resp.content}')
                 gs_resp.raise_for_status()
             return gs_resp
     else:
         if raise_for_status:
-            print(f'Gen3 url call failed for: {gen3_endpoint} with: {gen3_resp.content}')
+            print(f'Gen3 url call failed for: {gen3_resp.url} with: {gen3_resp.content}')
             gen3_resp.raise_for_status()
         return gen3_resp
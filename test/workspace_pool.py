@@ -0,0 +1,168 @@
+"""
+A pool of long-lived Terra workspaces that tests lease instead of creating and deleting their own.
+
+Creating a workspace is one of the slowest steps of a test, so pooled workspaces are kept
+between runs and only their entity tables are reset when they are leased:
+
+    with WorkspacePool().lease() as workspace:
+        import_pfb(workspace, pfb_file)
+
+Pooled workspaces are named "integration_test_pool_{stage}_..." and are created on demand,
+up to ``max_size``.  A lease is recorded in a workspace attribute, so concurrent runs skip
+leased workspaces; a lease left behind by a crashed run expires after ``lease_seconds``.
+
+reap() deletes the "..._delete_me" workspaces that crashed runs leave behind.
+"""
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+from test.utils import (STAGE,
+                        create_terra_workspace,
+                        delete_entities,
+                        delete_terra_workspace,
+                        get_terra_workspace,
+                        list_entities,
+                        list_entity_types,
+                        list_terra_workspaces,
+                        update_terra_workspace_attributes)
+
+log = logging.getLogger(__name__)
+
+LEASE_ATTRIBUTE = 'integration_test_lease'
+DELETE_ME_SUFFIX = '_delete_me'
+
+
+def created_at(workspace: dict) -> datetime.datetime:
+    """When a workspace was created, as a UTC datetime; Rawls reports e.g. "2020-12-09T19:10:41.526Z"."""
+    return datetime.datetime.fromisoformat(workspace['createdDate'].replace('Z', '+00:00'))
+
+
+def reset_entities(workspace: str) -> int:
+    """Delete every entity of a workspace, returning how many there were."""
+    entities = [(entity_type, entity['name'])
+                for entity_type in list_entity_types(workspace)
+                for entity in list_entities(workspace, entity_type)]
+    if entities:
+        # In one call, so that sets are deleted along with the entities they reference
+        delete_entities(workspace, entities)
+    return len(entities)
+
+
+def reap(max_age_hours: float = 24, now: Optional[datetime.datetime] = None) -> List[str]:
+    """
+    Delete the workspaces named "..._delete_me" that are older than ``max_age_hours``.
+
+    Younger ones may still be in use by a concurrent run.  Never raises, so that it can run
+    before the tests without failing them; returns the names of the deleted workspaces.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    reaped = []
+    try:
+        workspaces = list_terra_workspaces()
+    except Exception:
+        log.warning('Could not list workspaces to reap', exc_info=True)
+        return reaped
+    for workspace in workspaces:
+        name = workspace['name']
+        try:
+            if name.endswith(DELETE_ME_SUFFIX) and (now - created_at(workspace)).total_seconds() > max_age_hours * 3600:
+                response = delete_terra_workspace(name)
+                if response.ok:
+                    log.info('Reaped workspace %s, created %s', name, workspace['createdDate'])
+                    reaped.append(name)
+                else:
+                    log.warning('Could not reap workspace %s: [%s] %s', name, response.status_code, response.text)
+        except Exception:
+            log.warning('Could not reap workspace %s', name, exc_info=True)
+    return reaped
+
+
+class WorkspacePool:
+
+    """Lease pooled workspaces; see the module docstring
+
+    :param prefix: Names of the pooled workspaces start with this.
+    :param max_size: Workspaces to create at most; acquire() raises once all of them are leased.
+    :param lease_seconds: After this long a lease is considered abandoned.
+    :param settle_seconds: Wait this long after writing a lease before confirming it, so that
+        of two runs leasing the same workspace at the same time, the one that wrote first backs off.
+        A lease that is held and unexpired is never overwritten.
+    """
+
+    def __init__(self,
+                 prefix: str = f'integration_test_pool_{STAGE}_',
+                 max_size: int = 4,
+                 lease_seconds: float = 2 * 60 * 60,
+                 settle_seconds: float = 2.0):
+        self.prefix = prefix
+        self.max_size = max_size
+        self.lease_seconds = lease_seconds
+        self.settle_seconds = settle_seconds
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        # Threads of this process take turns, so they never race each other for a lease
+        self._lock = threading.Lock()
+
+    def _lease_value(self) -> str:
+        return f'{self.owner}@{time.time() + self.lease_seconds:.0f}'
+
+    def _is_free(self, workspace: dict) -> bool:
+        lease = workspace.get('attributes', {}).get(LEASE_ATTRIBUTE)
+        if not lease:
+            return True
+        _, _, expires = lease.rpartition('@')
+        try:
+            return float(expires) < time.time()
+        except ValueError:
+            return True
+
+    def _try_lease(self, name: str) -> bool:
+        # The listing may be stale, so don't overwrite a lease another run has taken since
+        if not self._is_free(get_terra_workspace(name)):
+            return False
+        lease = self._lease_value()
+        update_terra_workspace_attributes(name, {LEASE_ATTRIBUTE: lease})
+        time.sleep(self.settle_seconds)
+        # Of two runs that both found the workspace free, the one that wrote last keeps it
+        return get_terra_workspace(name).get('attributes', {}).get(LEASE_ATTRIBUTE) == lease
+
+    def acquire(self) -> str:
+        """Lease a free pooled workspace, creating one if there is none, and reset its entities."""
+        with self._lock:
+            pooled = [w for w in list_terra_workspaces() if w['name'].startswith(self.prefix)]
+            for workspace in pooled:
+                if self._is_free(workspace) and self._try_lease(workspace['name']):
+                    name = workspace['name']
+                    break
+            else:
+                if len(pooled) >= self.max_size:
+                    raise RuntimeError(f'All {len(pooled)} pooled workspaces are leased, '
+                                       f'see the {LEASE_ATTRIBUTE} attribute of {self.prefix}*')
+                name = f'{self.prefix}{uuid.uuid4().hex[:8]}'
+                create_terra_workspace(name)
+                update_terra_workspace_attributes(name, {LEASE_ATTRIBUTE: self._lease_value()})
+                log.info('Created pooled workspace %s', name)
+        deleted = reset_entities(name)
+        log.info('Leased pooled workspace %s, deleted %d leftover entities', name, deleted)
+        return name
+
+    def release(self, name: str):
+        """End a lease; never raises, an unreleased lease expires by itself."""
+        try:
+            update_terra_workspace_attributes(name, {}, removals=[LEASE_ATTRIBUTE])
+        except Exception:
+            log.warning('Could not release pooled workspace %s', name, exc_info=True)
+
+    @contextmanager
+    def lease(self) -> Iterator[str]:
+        name = self.acquire()
+        try:
+            yield name
+        finally:
+            self.release(name)